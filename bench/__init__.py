@@ -0,0 +1,30 @@
+# Copyright 2009-2012 Peter Williams
+#
+# This file is part of miriad-python.
+#
+# Miriad-python is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Miriad-python is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
+
+"""bench - benchmarks of miriad-python
+
+These are not installed; run them from the top of the source tree,
+against an installed or in-tree build of miriad-python:
+
+  python -m bench.iobench [keyword=value ...]
+  python bench/importtime.py [ntrials]
+
+bench.iobench times the core I/O paths on synthetic datasets made by
+bench.synth and can save its results as JSON to compare against
+later runs. bench.importtime measures the cost of importing the
+modules.
+"""
@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+# Copyright 2009-2012 Peter Williams
+#
+# This file is part of miriad-python.
+#
+# Miriad-python is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Miriad-python is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
+
+"""importtime - measure the startup cost of importing miriad-python
+
+Usage: importtime.py [ntrials]
+
+Each case is run in a fresh Python interpreter *ntrials* times
+(default 20), and the minimum and median wall-clock times are printed
+in milliseconds. The "bare" case measures the interpreter startup
+alone, so that it can be subtracted from the others. The
+"mirtask+_miriad_f" case forces all of the Fortran bindings to load,
+as every "import mirtask" did before they were made lazy, so the
+difference between it and the "mirtask" case is the saving. The
+"mirtask+_miriad_f_uvdat" case loads only the UVDAT and keyword
+wrappers, which is all that most tasks need.
+"""
+
+import sys, time
+from subprocess import check_call
+
+cases = [
+    ('bare', 'pass'),
+    ('mirtask', 'import mirtask'),
+    ('mirtask+_miriad_f', 'import mirtask, mirtask._miriad_f'),
+    ('mirtask+_miriad_f_uvdat', 'import mirtask, mirtask._miriad_f_uvdat'),
+    ('miriad', 'import miriad'),
+    ('mirtask.keys', 'import mirtask.keys'),
+    ('mirtask.uvdat', 'import mirtask.uvdat'),
+    ('mirtask.util', 'import mirtask.util'),
+]
+
+
+def timeit (stmt, ntrials):
+    times = []
+
+    for i in xrange (ntrials):
+        t0 = time.time ()
+        check_call ([sys.executable, '-c', stmt])
+        times.append (time.time () - t0)
+
+    times.sort ()
+    return 1000 * times[0], 1000 * times[len (times) // 2]
+
+
+def main (argv):
+    if len (argv) > 2:
+        print >>sys.stderr, 'usage: importtime.py [ntrials]'
+        return 1
+
+    if len (argv) == 2:
+        ntrials = int (argv[1])
+    else:
+        ntrials = 20
+
+    print '%-24s %10s %10s' % ('case', 'min (ms)', 'median (ms)')
+    for name, stmt in cases:
+        tmin, tmed = timeit (stmt, ntrials)
+        print '%-24s %10.1f %10.1f' % (name, tmin, tmed)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit (main (sys.argv))
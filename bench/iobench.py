@@ -0,0 +1,487 @@
+#! /usr/bin/env python
+# Copyright 2009-2012 Peter Williams
+#
+# This file is part of miriad-python.
+#
+# Miriad-python is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Miriad-python is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
+
+"""iobench - time the core I/O paths of miriad-python
+
+Usage: python -m bench.iobench [keyword=value ...]
+
+Run from the top of the source tree. Synthetic datasets are generated
+with bench.synth and each case is run *trials* times; the fastest
+trial is reported, as records per second and megabytes (2**20 bytes)
+of data per second. The keywords are:
+
+  nant=8        number of antennas in the UV dataset
+  nchan=256     number of spectral channels
+  ntime=100     number of integrations
+  npol=2        number of polarizations, 1 to 4
+  corr=j        correlation storage type, "j" (scaled int16) or "r"
+  imsize=512    width and height of the image
+  nplanes=16    number of image planes
+  naver=4       number of channels averaged by the chanaver case
+  trials=5      number of times each case is run
+  cases=...     comma-separated names of the cases to run; default all
+  workdir=...   directory for the datasets, which are kept and reused
+                by later runs with the same parameters; default is a
+                temporary directory that is deleted afterwards
+  json=...      file to write the results to as JSON
+  compare=...   JSON file of an earlier run to compare against
+
+The cases are:
+
+  uvdat.read          read the UV data through UVDAT, applying gains
+  uvdat.read.nocal    the same, without calibration
+  lowlevelRead        read the UV data with UVDataSet.lowlevelRead
+  readPlane           read every image plane with XYDataSet.readPlane
+  GainsReader.readAll read the gains table
+  quickHash           hash the UV dataset with VisData.quickHash
+  itemAccess          getItemInfo on every item of the UV dataset and
+                      getArrayItem on those that are arrays
+  chanaver            channel average the UV data with the chanaver
+                      example program, applying gains
+
+For the UV cases a record is one visibility spectrum and the bytes are
+those of the complex data; for readPlane, one plane; for the gains,
+one solution; for quickHash, one hash of the dataset, counting the
+bytes hashed; and for itemAccess, one item, counting the bytes of
+the arrays read. The statistics of mirtask.ioStats for the fastest
+trial are included in the JSON output, so that the time spent in
+MIRIAD can be compared to the total.
+"""
+
+import sys, os, time, shutil, tempfile
+from os.path import join, exists, dirname, abspath
+import numpy as N
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import miriad, mirtask
+from mirtask import uvdat, flagsBuffer
+from mirtask.readgains import GainsReader
+from bench import synth
+
+__all__ = ['defaultParams', 'cases', 'Context', 'runCase', 'runAll',
+           'report', 'compare', 'main']
+
+
+defaultParams = dict (nant=8, nchan=256, ntime=100, npol=2, corr='j',
+                      imsize=512, nplanes=16, naver=4)
+
+
+class Context (object):
+    """:synopsis: the datasets and parameters shared by the cases
+
+:arg str workdir: the directory in which to create the datasets
+:arg dict params: the parameters, as in :data:`defaultParams`
+
+The datasets are named after their parameters, and are only generated
+if they don't already exist.
+"""
+
+    def __init__ (self, workdir, params):
+        self.workdir = workdir
+        self.params = p = params
+
+        visname = 'vis-a%(nant)d-c%(nchan)d-t%(ntime)d-p%(npol)d-%(corr)s' % p
+        imname = 'im-%(imsize)d-%(nplanes)d' % p
+
+        self.vis = miriad.VisData (join (workdir, visname))
+        if not self.vis.exists:
+            synth.makeVis (self.vis, nant=p['nant'], nchan=p['nchan'],
+                           ntime=p['ntime'], npol=p['npol'],
+                           corrtype=p['corr'])
+
+        self.image = miriad.ImData (join (workdir, imname))
+        if not self.image.exists:
+            synth.makeImage (self.image, nx=p['imsize'], ny=p['imsize'],
+                             nplanes=p['nplanes'])
+
+        self.nrecords = (p['ntime'] * p['nant'] * (p['nant'] - 1) // 2 *
+                         p['npol'])
+        self.visBytes = self.nrecords * p['nchan'] * 8
+
+        # Left behind if an earlier run was interrupted.
+        _chanaverCleanup (self)
+
+        counter = _Counter ()
+        self.vis.updateHash (counter)
+        self.hashBytes = counter.n
+
+
+class _Counter (object):
+    n = 0
+
+    def __call__ (self, s):
+        self.n += len (s)
+
+
+# The cases. Each takes a Context and returns the number of records
+# and of bytes that it read. Cleanup functions, run after each trial
+# but not timed, undo any changes a case makes.
+
+def _uvdatRead (ctx, nocal=False):
+    n = nbytes = 0
+
+    for inp, preamble, data, flags in uvdat.setupAndRead (ctx.vis, '3', False,
+                                                          nocal=nocal):
+        n += 1
+        nbytes += data.nbytes
+
+    return n, nbytes
+
+
+def _uvdatReadNoCal (ctx):
+    return _uvdatRead (ctx, True)
+
+
+def _lowlevelRead (ctx):
+    nchan = ctx.params['nchan']
+    preamble = N.empty (5, dtype=N.double)
+    data = N.empty (nchan, dtype=N.complex64)
+    flags = flagsBuffer (nchan)
+    n = nbytes = 0
+
+    hnd = ctx.vis.open ('rw')
+
+    while True:
+        nread = hnd.lowlevelRead (preamble, data, flags)
+        if nread == 0:
+            break
+        n += 1
+        nbytes += nread * 8
+
+    hnd.close ()
+    return n, nbytes
+
+
+def _readPlane (ctx):
+    buf = None
+    n = nbytes = 0
+
+    hnd = ctx.image.open ('rw')
+
+    for i in xrange (ctx.params['nplanes']):
+        buf = hnd.readPlane (axes=[i], buf=buf)
+        n += 1
+        nbytes += buf.data.nbytes
+
+    hnd.close ()
+    return n, nbytes
+
+
+def _gainsReadAll (ctx):
+    hnd = ctx.vis.open ('rw')
+    gr = GainsReader (hnd)
+    gr.prep ()
+    times, gains = gr.readAll ()
+    hnd.close ()
+    return gr.nsols, times.nbytes + gains.nbytes
+
+
+def _quickHash (ctx):
+    ctx.vis.quickHash ()
+    return 1, ctx.hashBytes
+
+
+def _itemAccess (ctx):
+    n = nbytes = 0
+
+    hnd = ctx.vis.open ('rw')
+
+    for name in hnd.itemNames ():
+        kind, dtype, nvals, offset = hnd.getItemInfo (name)
+        n += 1
+
+        if kind == 'standard':
+            value = hnd.getArrayItem (name)
+            if isinstance (value, str):
+                nbytes += len (value)
+            else:
+                nbytes += value.nbytes
+
+    hnd.close ()
+    return n, nbytes
+
+
+def _chanaverOut (ctx):
+    return miriad.VisData (join (ctx.workdir, 'chanaver.out'))
+
+
+def _chanaver (ctx):
+    chanaver = _importChanaver ()
+    chanaver.channelAverageWithSetup (ctx.vis, _chanaverOut (ctx),
+                                      ctx.params['naver'])
+    return ctx.nrecords, ctx.visBytes
+
+
+def _chanaverCleanup (ctx):
+    _chanaverOut (ctx).delete ()
+
+
+def _importChanaver ():
+    # chanaver is an example program, not an installed module.
+    examples = join (dirname (dirname (abspath (__file__))), 'examples')
+    if examples not in sys.path:
+        sys.path.insert (0, examples)
+    import chanaver
+    return chanaver
+
+
+cases = [
+    ('uvdat.read', _uvdatRead, None),
+    ('uvdat.read.nocal', _uvdatReadNoCal, None),
+    ('lowlevelRead', _lowlevelRead, None),
+    ('readPlane', _readPlane, None),
+    ('GainsReader.readAll', _gainsReadAll, None),
+    ('quickHash', _quickHash, None),
+    ('itemAccess', _itemAccess, None),
+    ('chanaver', _chanaver, _chanaverCleanup),
+]
+
+
+def runCase (ctx, func, cleanup, trials):
+    """Time a benchmark case.
+
+:arg ctx: the datasets and parameters
+:type ctx: :class:`Context`
+:arg callable func: the case; see :data:`cases`
+:arg cleanup: called after each trial, or :const:`None`
+:type cleanup: callable or :const:`None`
+:arg int trials: the number of times to run the case
+:returns: a :class:`dict` of the results of the fastest trial
+
+The results are *records* and *bytes*, the amounts processed in each
+trial; *seconds*, the duration of the fastest trial, and *median*,
+the median duration; *recordsPerSec* and *mbPerSec*, the throughput
+of the fastest trial; and *io*, the nonzero statistics of
+:func:`mirtask.ioStats` for the fastest trial.
+"""
+    times = []
+    best = None
+    wasEnabled = mirtask.enableIoStats ()
+
+    try:
+        for i in xrange (trials):
+            mirtask.resetIoStats ()
+            t0 = time.time ()
+            nrec, nbytes = func (ctx)
+            dt = time.time () - t0
+            io = mirtask.ioStats ()
+
+            if cleanup is not None:
+                cleanup (ctx)
+
+            times.append (dt)
+            if best is None or dt < best[0]:
+                best = (dt, nrec, nbytes, io)
+    finally:
+        mirtask.enableIoStats (wasEnabled)
+
+    dt, nrec, nbytes, io = best
+    times.sort ()
+
+    return dict (records=nrec, bytes=nbytes, seconds=dt,
+                 median=times[len (times) // 2],
+                 recordsPerSec=nrec / max (dt, 1e-9),
+                 mbPerSec=nbytes / 1048576. / max (dt, 1e-9),
+                 io=dict ((k, v) for k, v in io.iteritems () if v['calls']))
+
+
+def runAll (ctx, trials, names=None, log=None):
+    """Run the benchmark cases.
+
+:arg ctx: the datasets and parameters
+:type ctx: :class:`Context`
+:arg int trials: the number of times to run each case
+:arg names: the names of the cases to run, or :const:`None` for all
+:type names: list of str or :const:`None`
+:arg log: where to print each case's results as it finishes, or
+  :const:`None` to print nothing
+:type log: filelike or :const:`None`
+:returns: a :class:`dict` of the results of :func:`runCase` keyed by
+  case name
+:raises: :exc:`ValueError` if a name is not that of a case
+"""
+    known = [c[0] for c in cases]
+
+    if names is None:
+        names = known
+
+    for name in names:
+        if name not in known:
+            raise ValueError ('unknown case "%s"; choices are: %s'
+                              % (name, ', '.join (known)))
+
+    results = {}
+
+    for name, func, cleanup in cases:
+        if name not in names:
+            continue
+
+        results[name] = r = runCase (ctx, func, cleanup, trials)
+        if log is not None:
+            _printResult (log, name, r)
+
+    return results
+
+
+def _printHeader (stream):
+    print >>stream, '%-20s %10s %10s %10s %12s %10s' % \
+        ('case', 'best (s)', 'median (s)', 'records', 'records/s', 'MB/s')
+
+
+def _printResult (stream, name, r):
+    print >>stream, '%-20s %10.4f %10.4f %10d %12.1f %10.2f' % \
+        (name, r['seconds'], r['median'], r['records'], r['recordsPerSec'],
+         r['mbPerSec'])
+
+
+def report (ctx, results, trials):
+    """Assemble the full report of a run.
+
+:arg ctx: the datasets and parameters
+:type ctx: :class:`Context`
+:arg dict results: the return value of :func:`runAll`
+:arg int trials: the number of trials of each case
+:returns: a JSON-compatible :class:`dict`
+"""
+    import platform
+
+    return dict (version=1, params=ctx.params, trials=trials,
+                 time=time.time (), host=platform.node (),
+                 python=platform.python_version (), numpy=N.__version__,
+                 results=results)
+
+
+def compare (old, new, stream=None):
+    """Print a comparison of two reports.
+
+:arg dict old: the earlier report, as returned by :func:`report`
+:arg dict new: the later report
+:arg filelike stream: where to print the comparison; defaults to
+  :data:`sys.stdout`
+:returns: a :class:`dict` mapping the names of the cases in both
+  reports to the ratio of their throughputs, new to old, so that
+  values greater than one are speedups
+
+A warning is printed if the reports' parameters differ, since their
+timings are then not directly comparable.
+"""
+    if stream is None:
+        stream = sys.stdout
+
+    if old.get ('params') != new.get ('params'):
+        print >>stream, 'warning: the runs had different parameters:'
+        print >>stream, '  old:', json.dumps (old.get ('params'), sort_keys=True)
+        print >>stream, '  new:', json.dumps (new.get ('params'), sort_keys=True)
+
+    print >>stream, '%-20s %12s %12s %8s' % ('case', 'old rec/s', 'new rec/s',
+                                             'ratio')
+    ratios = {}
+
+    for name, func, cleanup in cases:
+        o = old['results'].get (name)
+        n = new['results'].get (name)
+        if o is None or n is None:
+            continue
+
+        ratios[name] = r = n['recordsPerSec'] / max (o['recordsPerSec'], 1e-9)
+        print >>stream, '%-20s %12.1f %12.1f %8.3f' % \
+            (name, o['recordsPerSec'], n['recordsPerSec'], r)
+
+    return ratios
+
+
+def main (argv):
+    params = dict (defaultParams)
+    trials = 5
+    names = workdir = jsonpath = comparepath = None
+
+    for arg in argv[1:]:
+        if '=' not in arg:
+            print >>sys.stderr, __doc__
+            return 1
+
+        key, val = arg.split ('=', 1)
+
+        if key in ('corr', ):
+            params[key] = val
+        elif key in params:
+            params[key] = int (val)
+        elif key == 'trials':
+            trials = int (val)
+        elif key == 'cases':
+            names = val.split (',')
+        elif key == 'workdir':
+            workdir = val
+        elif key == 'json':
+            jsonpath = val
+        elif key == 'compare':
+            comparepath = val
+        else:
+            print >>sys.stderr, 'iobench: unknown keyword "%s"' % key
+            return 1
+
+    known = [c[0] for c in cases]
+    for name in names or []:
+        if name not in known:
+            print >>sys.stderr, ('iobench: unknown case "%s"; choices are: %s'
+                                 % (name, ', '.join (known)))
+            return 1
+
+    if params['nchan'] % params['naver'] != 0:
+        print >>sys.stderr, 'iobench: naver must divide evenly into nchan'
+        return 1
+    if trials < 1:
+        print >>sys.stderr, 'iobench: trials must be positive'
+        return 1
+
+    if workdir is None:
+        tmpdir = workdir = tempfile.mkdtemp (prefix='iobench')
+    else:
+        tmpdir = None
+        if not exists (workdir):
+            os.makedirs (workdir)
+
+    try:
+        ctx = Context (workdir, params)
+        _printHeader (sys.stdout)
+        results = runAll (ctx, trials, names, sys.stdout)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree (tmpdir)
+
+    rep = report (ctx, results, trials)
+
+    if jsonpath is not None:
+        f = open (jsonpath, 'w')
+        json.dump (rep, f, indent=2, sort_keys=True)
+        f.write ('\n')
+        f.close ()
+
+    if comparepath is not None:
+        print
+        compare (json.load (open (comparepath)), rep)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit (main (sys.argv))
@@ -0,0 +1,198 @@
+# Copyright 2009-2012 Peter Williams
+#
+# This file is part of miriad-python.
+#
+# Miriad-python is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Miriad-python is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
+
+"""bench.synth - generate synthetic MIRIAD datasets for benchmarking
+
+The datasets are filled with seeded random numbers, so that two runs
+with the same parameters write identical data. They have enough of
+the usual headers and UV variables for the UVDAT routines, calibration
+and time averaging to work on them, but are not physically
+meaningful.
+"""
+
+import numpy as N
+from miriad import VisData, ImData
+from mirtask import FLAGS_BOOL, flagsBuffer, util
+
+__all__ = ['POLS', 'makeVis', 'makeImage']
+
+# Linear polarizations XX, YY, XY, YX, in the usual MIRIAD order.
+POLS = (-5, -6, -7, -8)
+
+_JD0 = 2455197.5 # 2010 Jan 1
+_SFREQ = 1.4 # GHz
+_SDF = 1e-4 # GHz
+
+
+def makeVis (path, nant=8, nchan=256, ntime=100, npol=2, corrtype='j',
+             inttime=10., gains=True, flagfrac=0.05, seed=0):
+    """Write a synthetic UV dataset.
+
+:arg path: the name of the dataset, which must not exist
+:type path: str or :class:`miriad.VisData`
+:arg int nant: the number of antennas; every baseline between them
+  (without autocorrelations) is written
+:arg int nchan: the number of spectral channels, in one window
+:arg int ntime: the number of integrations
+:arg int npol: the number of polarizations, from one to four; the
+  first *npol* of :data:`POLS` are written
+:arg str corrtype: the storage type of the correlations: "j" for
+  scaled 16-bit integers, as most telescopes write, or "r" for floats
+:arg float inttime: the integration time in seconds
+:arg bool gains: whether to write a gains table, with one solution for
+  each integration
+:arg float flagfrac: the fraction of channels to flag at random
+:arg int seed: the seed of the random numbers
+:returns: the dataset, as a :class:`miriad.VisData`
+
+There are ``ntime * nant * (nant - 1) / 2 * npol`` records.
+"""
+    if npol < 1 or npol > len (POLS):
+        raise ValueError ('npol must be between 1 and %d (got %d)'
+                          % (len (POLS), npol))
+    if nant < 2:
+        raise ValueError ('need at least two antennas (got %d)' % nant)
+
+    vis = VisData (str (path))
+    rs = N.random.RandomState (seed)
+    hnd = vis.open ('c')
+
+    hnd.setCorrelationType (corrtype)
+    hnd.setPreambleType ('uvw', 'time', 'baseline')
+
+    hnd.openHistory ()
+    hnd.writeHistory ('BENCH synth: nant=%d nchan=%d ntime=%d npol=%d corr=%s'
+                      % (nant, nchan, ntime, npol, corrtype))
+    hnd.closeHistory ()
+
+    hnd.writeVars (dict (telescop='SYNTH', source='BENCH', ra=1.0, dec=0.5,
+                         obsra=1.0, obsdec=0.5, epoch=N.float32 (2000.),
+                         nants=nant, nspect=1,
+                         nschan=N.array ([nchan], dtype=N.int32),
+                         ischan=N.array ([1], dtype=N.int32),
+                         sfreq=N.array ([_SFREQ]), sdf=N.array ([_SDF]),
+                         restfreq=N.array ([0.]),
+                         inttime=N.float32 (inttime),
+                         jyperk=N.float32 (150.),
+                         systemp=N.float32 (50.), npol=npol))
+
+    preamble = N.empty (5, dtype=N.double)
+    data = N.empty (nchan, dtype=N.complex64)
+    flags = flagsBuffer (nchan, FLAGS_BOOL)
+    ants = N.arange (1, nant + 1)
+    antpos = rs.normal (scale=500., size=(nant, 3)) # nanoseconds
+    baselines = [(a1, a2, util.encodeBaseline (a1, a2))
+                 for a1 in ants for a2 in ants if a1 < a2]
+
+    for itime in xrange (ntime):
+        t = _JD0 + itime * inttime / 86400.
+        hnd.writeVarDouble ('lst', (itime * inttime / 86400. * 2 * N.pi) % (2 * N.pi))
+        hnd.writeVarDouble ('ut', (itime * inttime / 86400. * 2 * N.pi) % (2 * N.pi))
+
+        for a1, a2, bl in baselines:
+            preamble[:3] = antpos[a2-1] - antpos[a1-1]
+            preamble[3] = t
+            preamble[4] = bl
+
+            for pol in POLS[:npol]:
+                hnd.writeVarInt ('pol', pol)
+                data.real = rs.normal (size=nchan)
+                data.imag = rs.normal (size=nchan)
+                flags[:] = rs.uniform (size=nchan) >= flagfrac
+                hnd.write (preamble, data, flags)
+
+    hnd.close ()
+
+    if gains:
+        _writeGains (vis, nant, ntime, inttime, rs)
+
+    return vis
+
+
+def _writeGains (vis, nant, nsols, inttime, rs):
+    # The gains item has an 8-byte header followed by, for each
+    # solution, its time and then one complex gain per antenna and
+    # feed; see mirtask.readgains.GainsReader.
+    nfeeds = 1
+    ngains = nant * nfeeds
+    hnd = vis.open ('rw')
+
+    item = hnd.getItem ('gains', 'w')
+    item.write (0, N.int32, N.zeros (2, dtype=N.int32))
+    offset = 8
+    g = N.empty (ngains, dtype=N.complex64)
+
+    for isol in xrange (nsols):
+        item.write (offset, N.float64, [_JD0 + isol * inttime / 86400.])
+        offset += 8
+        amp = rs.normal (loc=1., scale=0.05, size=ngains)
+        phase = rs.uniform (-N.pi, N.pi, size=ngains)
+        g.real = amp * N.cos (phase)
+        g.imag = amp * N.sin (phase)
+        item.write (offset, N.complex64, g)
+        offset += 8 * ngains
+
+    item.close ()
+
+    hnd.setScalarItem ('nfeeds', N.int32, nfeeds)
+    hnd.setScalarItem ('ntau', N.int32, 0)
+    hnd.setScalarItem ('ngains', N.int32, ngains)
+    hnd.setScalarItem ('nsols', N.int32, nsols)
+    hnd.setScalarItem ('interval', N.float64, 2 * inttime / 86400.)
+    hnd.close ()
+
+
+def makeImage (path, nx=512, ny=512, nplanes=16, seed=0):
+    """Write a synthetic image.
+
+:arg path: the name of the dataset, which must not exist
+:type path: str or :class:`miriad.ImData`
+:arg int nx: the number of columns
+:arg int ny: the number of rows
+:arg int nplanes: the number of planes along the third (spectral) axis
+:arg int seed: the seed of the random numbers
+:returns: the dataset, as a :class:`miriad.ImData`
+
+The image is written plane by plane with
+:meth:`mirtask.XYDataSet.writePlane`. A border of pixels one tenth of
+the width of each plane is masked.
+"""
+    im = ImData (str (path))
+    rs = N.random.RandomState (seed)
+    hnd = im.open ('c', N.array ([nx, ny, nplanes], dtype=N.intc))
+
+    for i, (ctype, crval, cdelt, crpix) in enumerate ([
+            ('RA---SIN', 1.0, -1e-5, nx // 2 + 1),
+            ('DEC--SIN', 0.5, 1e-5, ny // 2 + 1),
+            ('FREQ', _SFREQ, _SDF, 1)]):
+        hnd.setScalarItem ('ctype%d' % (i + 1), str, ctype)
+        hnd.setScalarItem ('crval%d' % (i + 1), N.float64, crval)
+        hnd.setScalarItem ('cdelt%d' % (i + 1), N.float64, cdelt)
+        hnd.setScalarItem ('crpix%d' % (i + 1), N.float64, crpix)
+    hnd.setScalarItem ('bunit', str, 'JY/BEAM')
+
+    mask = N.ones ((ny, nx), dtype=N.bool)
+    bx, by = nx // 10, ny // 10
+    mask[by:ny-by,bx:nx-bx] = False
+
+    for iplane in xrange (nplanes):
+        plane = N.ma.masked_array (rs.normal (size=(ny, nx)).astype (N.float32),
+                                   mask)
+        hnd.writePlane (plane, axes=[iplane])
+
+    hnd.close ()
+    return im
@@ -56,8 +56,16 @@
  not share the default UVAVER behavior of discarding
  completely-flagged records.
 
- LIMITATIONS: CHANAVER only works with datasets containing a single
- spectral window.
+ CHANAVER can also average in time, like UVAVER, in the same pass.
+ The records of each baseline and polarization are averaged over
+ intervals of the length given by the interval keyword, after their
+ channels have been averaged. The variances of the time-averaged
+ records are propagated to the output through the "inttime" variable.
+
+ Datasets with several spectral windows are supported, provided that
+ the windows are contiguous and in order in the data. Each window can
+ be averaged by a different number of channels. CHANAVER does not work
+ with datasets containing wideband channels.
 
 @ vis
  The input dataset or datasets. For more information, see
@@ -68,9 +76,11 @@
 
 @ naver
  The number of channels to average together. This number must divide
- evenly into the number of spectral channels. A value of one is
- acceptable, meaning that calibrations will be applied and flagged
- data will be zeroed out in the output dataset.
+ evenly into the number of spectral channels of each window. A value
+ of one is acceptable, meaning that calibrations will be applied and
+ flagged data will be zeroed out in the output dataset. If several
+ values are given, one per spectral window, each window is averaged
+ by its own value.
 
 @ slop
  The fraction of channels in each averaging bin that must be present
@@ -79,6 +89,18 @@
  one channel must still be good in each bin in order for the data
  to remain unflagged.
 
+@ interval
+ The time averaging interval in minutes. The default of zero means
+ that no time averaging is done.
+
+@ weight
+ How records are weighted when averaging in time. "none", the default,
+ weights all records equally. "variance" weights them by the inverse
+ of their variances, as computed from the "jyperk", "systemp", "sdf",
+ and "inttime" variables; records with no variance information are
+ discarded. The weighting only matters if interval is nonzero, as the
+ channels of a single record all have the same variance.
+
 @ select
  The standard MIRIAD UV-data selection keyword. For more information,
  see "mirhelp select".
@@ -114,8 +136,9 @@
 # information.
 
 import numpy as N
-from miriad import VisData, ensureiterable
-from mirtask import keys, util, uvdat
+from miriad import VisData, commasplice
+from mirtask import keys, util, uvdat, FLAGS_BOOL
+from mirtask.timeaver import TimeAverager, WEIGHT_NONE, WEIGHT_VARIANCE
 
 
 __all__ = ('DEFAULT_SLOP DEFAULT_BANNER InputStructureError '
@@ -145,29 +168,51 @@ class _CreateFailedError (Exception):
         self.subexc = subexc
 
 
+def _checkParams (naver, slop, interval=0., weighting=WEIGHT_NONE):
+    navers = N.atleast_1d (naver)
+
+    if navers.ndim != 1 or navers.size == 0:
+        raise ValueError ('naver must be an integer or a list of integers')
+    if (navers < 1).any ():
+        raise ValueError ('must average at least one channel (got naver=%s)'
+                          % _fmtNaver (naver))
+    if slop < 0 or slop > 1:
+        raise ValueError ('slop must be between 0 and 1 (got slop=%f)' % slop)
+    if interval < 0:
+        raise ValueError ('interval must be nonnegative (got interval=%f)' % interval)
+    if weighting not in (WEIGHT_NONE, WEIGHT_VARIANCE):
+        raise ValueError ('unknown weighting "%s"' % weighting)
+
+
+def _fmtNaver (naver):
+    return ','.join (str (int (x)) for x in N.atleast_1d (naver))
+
+
 def channelAverage (out, naver, slop=DEFAULT_SLOP, banner=DEFAULT_BANNER,
-                    args=['undefined']):
+                    args=['undefined'], interval=0., weighting=WEIGHT_NONE):
     """Read data from the uvdat subsystem and channel average into an output dataset.
 
     out: dataset handle; the output dataset to be created
-  naver: int; the number of channels to average together (see task docs)
+  naver: int or list of int; the number of channels to average together,
+         either for all windows or for each window (see task docs)
    slop: float; tolerance for partially flagged bins (see task docs)
  banner: string; a message to write into the output's history
    args: list of strings; command-line arguments to write into the output's history,
          not including the program name (i.e. no traditional argv[0])
+interval: float; the time averaging interval in minutes, or 0 for none
+weighting: WEIGHT_NONE or WEIGHT_VARIANCE; how records are weighted in
+         time averaging (see task docs)
 returns: None
 
 Contrast with channelAverageWithSetup, which sets up the uvdat subsytem itself
 rather than assuming that it's been initialized.
 """
 
-    if naver < 1:
-        raise ValueError ('must average at least one channel (got naver=%d)' % naver)
-    if slop < 0 or slop > 1:
-        raise ValueError ('slop must be between 0 and 1 (got slop=%f)' % slop)
+    _checkParams (naver, slop, interval, weighting)
 
     try:
-        _channelAverage (uvdat.read (), out, naver, slop, banner, args)
+        _channelAverage (uvdat.read (flagtype=FLAGS_BOOL), out, naver, slop,
+                         banner, args, interval, weighting)
     except _CreateFailedError, e:
         # Don't delete the existing dataset!
         raise e.subexc
@@ -177,32 +222,65 @@ rather than assuming that it's been initialized.
 
 
 def channelAverageWithSetup (toread, out, naver, slop=DEFAULT_SLOP,
-                             banner=DEFAULT_BANNER, **uvdargs):
+                             banner=DEFAULT_BANNER, nproc=1, interval=0.,
+                             weighting=WEIGHT_NONE, **uvdargs):
     """Read UV data and channel average into an output dataset.
 
    toread: dataset handle or iterable thereof; input dataset(s)
       out: dataset handle; the output dataset to be created
-    naver: int; the number of channels to average together (see task docs)
+    naver: int or list of int; the number of channels to average together,
+           either for all windows or for each window (see task docs)
      slop: float; tolerance for partially flagged bins (see task docs)
    banner: string; a message to write into the output's history
+    nproc: int or None; the number of processes to use. None means one
+           per CPU.
+ interval: float; the time averaging interval in minutes, or 0 for none
+weighting: WEIGHT_NONE or WEIGHT_VARIANCE; how records are weighted in
+           time averaging (see task docs)
 **uvdargs: keyword arguments passed through to the uvdat subsystem
            initialization (mirtask.uvdat.setupAndRead)
   returns: None
 
 Contrast with channelAverage, which performs no extra initialization
 of the uvdat subsystem.
+
+If nproc is not 1, the distinct timestamps of the input are found by
+scanning it, and are divided into contiguous time ranges, one per
+process. Each process reads its time range by adding a time clause to
+the selection, and averages it into a temporary dataset named after
+out. The temporary datasets are then concatenated in time order into
+out with UVCAT and deleted. In this mode the selection may not itself
+contain time clauses, and if several datasets are read their records
+are written in time order rather than dataset order. Time averaging
+intervals don't span the boundaries between the processes' ranges.
+The mode needs the multiprocessing module, new in Python 2.6, and is
+only available through this function, not from the command line.
 """
 
-    if naver < 1:
-        raise ValueError ('must average at least one channel (got naver=%d)' % naver)
-    if slop < 0 or slop > 1:
-        raise ValueError ('slop must be between 0 and 1 (got slop=%f)' % slop)
+    _checkParams (naver, slop, interval, weighting)
+
+    args = ['vis=' + commasplice (toread)]
+    args += ['%s=%s' % (k, uvdargs[k]) for k in sorted (uvdargs.iterkeys ())]
+
+    if nproc != 1:
+        if out.exists:
+            # Don't delete the existing dataset!
+            raise ValueError ('output dataset %s already exists' % out)
+
+        try:
+            _parallelAverage (toread, out, (naver, slop, banner, args,
+                                            interval, weighting),
+                              nproc, uvdargs)
+        except Exception:
+            out.delete ()
+            raise
+        return
 
     try:
-        gen = uvdat.setupAndRead (toread, UVDAT_OPTIONS, False, **uvdargs)
-        args = ['vis=' + ','.join (str (x) for x in ensureiterable (toread))]
-        args += ['%s=%s' % (k, uvdargs[k]) for k in sorted (uvdargs.iterkeys ())]
-        _channelAverage (gen, out, naver, slop, banner, args)
+        gen = uvdat.setupAndRead (toread, UVDAT_OPTIONS, False,
+                                  flagtype=FLAGS_BOOL, **uvdargs)
+        _channelAverage (gen, out, naver, slop, banner, args, interval,
+                         weighting)
     except _CreateFailedError, e:
         # Don't delete the existing dataset!
         raise e.subexc
@@ -211,20 +289,154 @@ of the uvdat subsystem.
         raise
 
 
-def _channelAverage (gen, out, naver, slop, banner, args):
+def _timeSelections (toread, nparts):
+    """Divide the timestamps of the input into contiguous ranges.
+
+ toread: dataset handle or iterable thereof; input dataset(s)
+ nparts: int; the maximum number of ranges
+returns: list of strings; one "time(...)" selection clause per range
+
+The boundaries between ranges are placed midway between consecutive
+timestamps, so they are robust to the limited precision of the
+textual time format.
+"""
+    times = set ()
+
+    for path in commasplice (toread).split (','):
+        hnd = VisData (path).open ('rw')
+        try:
+            while hnd.scanUntilChange ('time'):
+                times.add (hnd.getVarDouble ('time'))
+        finally:
+            hnd.close ()
+
+    times = N.asarray (sorted (times))
+    if times.size == 0:
+        return []
+
+    margin = 1. / 86400 # one second
+    edges = N.unique (N.linspace (0, times.size, nparts + 1).astype (N.int))
+    clauses = []
+
+    for i in xrange (edges.size - 1):
+        lo, hi = edges[i], edges[i+1]
+
+        if lo == 0:
+            tlo = times[0] - margin
+        else:
+            tlo = 0.5 * (times[lo-1] + times[lo])
+
+        if hi == times.size:
+            thi = times[-1] + margin
+        else:
+            thi = 0.5 * (times[hi-1] + times[hi])
+
+        clauses.append ('time(%s,%s)' % (util.jdToFull (tlo), util.jdToFull (thi)))
+
+    return clauses
+
+
+def _averagePart (job):
+    """Worker-process half of _parallelAverage."""
+    toread, outpath, params, uvdargs = job
+
+    gen = uvdat.setupAndRead (toread, UVDAT_OPTIONS, False,
+                              flagtype=FLAGS_BOOL, **uvdargs)
+    _channelAverage (gen, VisData (outpath), *params)
+    return outpath
+
+
+def _parallelAverage (toread, out, params, nproc, uvdargs):
+    """Channel average time ranges of the input in separate processes.
+
+See channelAverageWithSetup for a description of the approach. params
+is the tuple of the arguments to _channelAverage following out.
+"""
+    try:
+        from multiprocessing import Pool, cpu_count
+    except ImportError:
+        raise ValueError ('cannot use multiple processes without the '
+                          'multiprocessing module (Python 2.6 or newer)')
+    from mirexec import TaskUVCat
+
+    select = uvdargs.get ('select')
+    if select is not None and 'time' in select.lower ():
+        raise ValueError ('cannot use multiple processes with a time selection')
+
+    if nproc is None:
+        nproc = cpu_count ()
+
+    jobs = []
+    parts = []
+
+    for i, clause in enumerate (_timeSelections (toread, nproc)):
+        kw = dict (uvdargs)
+        if select is None:
+            kw['select'] = clause
+        else:
+            kw['select'] = clause + ',' + select
+
+        part = out.vvis ('part%d' % i)
+        part.delete ()
+        parts.append (part)
+        jobs.append ((commasplice (toread), str (part), params, kw))
+
+    if not len (jobs):
+        raise InputStructureError (commasplice (toread), 'no UV data found')
+
+    pools = []
+
+    try:
+        # Each part needs freshly initialized UVDAT state, so each
+        # gets a process of its own. There are no more parts than
+        # nproc.
+        try:
+            results = []
+            for job in jobs:
+                pool = Pool (1)
+                pools.append (pool)
+                results.append (pool.apply_async (_averagePart, (job, )))
+                pool.close ()
+            for result in results:
+                result.get ()
+        except:
+            for pool in pools:
+                pool.terminate ()
+            raise
+        finally:
+            for pool in pools:
+                pool.join ()
+
+        TaskUVCat (vis=','.join (str (p) for p in parts), out=out,
+                   nocal=True, nopass=True, nopol=True).run ()
+    finally:
+        for part in parts:
+            part.delete ()
+
+
+def _channelAverage (gen, out, naver, slop, banner, args, interval=0.,
+                     weighting=WEIGHT_NONE):
     """Implementation of the channel averaging.
 
     gen: iterable of (hnd, pream, data, flags); source of UV records
     out: dataset handle; the output dataset to be created
-  naver: int; the number of channels to average together (see task docs)
+  naver: int or list of int; the number of channels to average together
+         (see task docs)
    slop: float; tolerance for partially flagged bins (see task docs)
  banner: string; a message to write into the output's history
    args: list of strings; command-line args to write into the output history
+interval: float; the time averaging interval in minutes, or 0 for none
+weighting: WEIGHT_NONE or WEIGHT_VARIANCE; how records are weighted in
+         time averaging
 returns: None
+
+If interval is nonzero, the channel-averaged records are passed to a
+mirtask.timeaver.TimeAverager, which takes care of copying UV
+variables and writing the output records.
 """
     from numpy import sum, greater_equal, maximum
 
-    nmin = max (int (round (slop * naver)), 1) # min num. chans to avoid flagging
+    navers = N.atleast_1d (naver).astype (N.int)
 
     firstiteration = True
     prevhnd = None
@@ -237,6 +449,11 @@ returns: None
         raise _CreateFailedError (e)
     outhnd.setPreambleType ('uvw', 'time', 'baseline')
 
+    if interval > 0:
+        aver = TimeAverager (outhnd, interval, weighting)
+    else:
+        aver = None
+
     for vishnd, preamble, data, flags in gen:
         if firstiteration:
             firstiteration = False
@@ -252,7 +469,11 @@ returns: None
             outhnd.openHistory ()
             outhnd.writeHistory (banner)
             outhnd.logInvocation ('PYTHON chanaver', args)
-            outhnd.writeHistory ('PYTHON chanaver: naver=%d slop=%f' % (naver, slop))
+            outhnd.writeHistory ('PYTHON chanaver: naver=%s slop=%f'
+                                 % (_fmtNaver (naver), slop))
+            if aver is not None:
+                outhnd.writeHistory ('PYTHON chanaver: interval=%f weight=%s'
+                                     % (interval, weighting))
             outhnd.closeHistory ()
 
         if vishnd is not prevhnd:
@@ -260,6 +481,9 @@ returns: None
             prevhnd = vishnd
             npol = 0
 
+            if aver is not None:
+                aver.flush ()
+
             tracker = vishnd.makeVarTracker ()
             tracker.track ('nchan', 'nspect', 'nwide', 'sdf', 'nschan',
                            'ischan', 'sfreq')
@@ -269,55 +493,92 @@ returns: None
             for var in 'restfreq systemp xtsys ytsys xyphase'.split ():
                 vishnd.trackVar (var, False, True)
 
-            vishnd.initVarsAsInput (' ') # set up to copy basic variables
-            outhnd.initVarsAsOutput (vishnd, ' ')
+            if aver is None:
+                # The TimeAverager does this itself.
+                vishnd.initVarsAsInput (' ') # set up to copy basic variables
+                outhnd.initVarsAsOutput (vishnd, ' ')
 
         if tracker.updated ():
-            # Potentially new spectral configuration. Verify.
+            # Potentially new spectral configuration. Any pending
+            # averages must be written out before the new
+            # configuration is. Then verify.
+            if aver is not None:
+                aver.flush ()
+
             nspect = vishnd.getScalar ('nspect', 0)
             nwide = vishnd.getScalar ('nwide', 0)
             nchan = vishnd.getScalar ('nchan', 0)
 
-            if nspect != 1:
+            if nspect < 1:
                 raise InputStructureError (vishnd.path (),
-                                           'require exactly one spectral window')
+                                           'require at least one spectral window')
             if nwide != 0:
                 raise InputStructureError (vishnd.path (),
                                            'require no wideband windows')
 
-            sdf = vishnd.getVarDouble ('sdf', nspect)
-            nschan = vishnd.getVarInt ('nschan', nspect)
-            ischan = vishnd.getVarInt ('ischan', nspect)
-            sfreq = vishnd.getVarDouble ('sfreq', nspect)
+            sdf = N.atleast_1d (vishnd.getVarDouble ('sdf', nspect))
+            nschan = N.atleast_1d (vishnd.getVarInt ('nschan', nspect))
+            ischan = N.atleast_1d (vishnd.getVarInt ('ischan', nspect))
+            sfreq = N.atleast_1d (vishnd.getVarDouble ('sfreq', nspect))
 
-            if nschan != nchan:
+            if navers.size == 1:
+                wnaver = N.repeat (navers, nspect)
+            elif navers.size == nspect:
+                wnaver = navers
+            else:
                 raise InputStructureError (vishnd.path (),
-                                           'require nchan (%d) = nschan (%d)',
-                                           nchan, nschan)
-            if ischan != 1:
+                                           'got %d values of naver for %d '
+                                           'spectral windows', navers.size,
+                                           nspect)
+
+            if nschan.sum () != nchan:
                 raise InputStructureError (vishnd.path (),
-                                           'require ischan (%d) = 1', ischan)
+                                           'require nchan (%d) = sum of nschan (%d)',
+                                           nchan, nschan.sum ())
 
-            if nchan % naver != 0:
+            wstart = N.cumsum (nschan) - nschan
+            if (ischan != wstart + 1).any ():
                 raise InputStructureError (vishnd.path (),
-                                           'require nchan (%d) to be a multiple '
-                                           'of naver (%d)', nchan, naver)
+                                           'require spectral windows to be '
+                                           'contiguous and in order')
+
+            for i in xrange (nspect):
+                if nschan[i] % wnaver[i] != 0:
+                    raise InputStructureError (vishnd.path (),
+                                               'require nschan (%d) of window %d '
+                                               'to be a multiple of naver (%d)',
+                                               nschan[i], i + 1, wnaver[i])
 
             # OK, everything is hunky-dory. Compute new setup.
 
-            nout = nchan // naver
-            sdfout = sdf * naver
-            sfreqout = sfreq + 0.5 * sdf * (naver - 1)
+            wnout = nschan // wnaver
+            nout = wnout.sum ()
+            ostart = N.cumsum (wnout) - wnout
+
+            # (chanstart, chanstop, outstart, outstop, naver) for each
+            # block of channels averaged with a single reshape. If all
+            # windows use the same naver, bins never straddle windows
+            # and the whole spectrum can be done at once.
+            if (wnaver == wnaver[0]).all ():
+                blocks = [(0, nchan, 0, nout, wnaver[0])]
+            else:
+                blocks = [(wstart[i], wstart[i] + nschan[i], ostart[i],
+                           ostart[i] + wnout[i], wnaver[i])
+                          for i in xrange (nspect)]
+
+            # min num. chans to avoid flagging, for each output channel
+            nmin = N.repeat ([max (int (round (slop * n)), 1) for n in wnaver],
+                             wnout)
 
             outdata = N.empty (nout, dtype=N.complex64)
-            outflags = N.empty (nout, dtype=N.int32)
+            outflags = N.empty (nout, dtype=N.bool)
             counts = N.empty (nout, dtype=N.int32)
 
-            outhnd.writeVarInt ('nspect', 1)
-            outhnd.writeVarInt ('nschan', nout)
-            outhnd.writeVarInt ('ischan', 1)
-            outhnd.writeVarDouble ('sdf', sdfout)
-            outhnd.writeVarDouble ('sfreq', sfreqout)
+            outhnd.writeVarInt ('nspect', nspect)
+            outhnd.writeVarInt ('nschan', wnout.astype (N.int32))
+            outhnd.writeVarInt ('ischan', (ostart + 1).astype (N.int32))
+            outhnd.writeVarDouble ('sdf', sdf * wnaver)
+            outhnd.writeVarDouble ('sfreq', sfreq + 0.5 * sdf * (wnaver - 1))
 
         # Do the averaging. This is as fast as I know how to make it
         # within numpy. Have no idea if there's a way to take advantage
@@ -325,12 +586,17 @@ returns: None
         # ton of effort.
 
         data *= flags # zero out flagged data
-        sum (data.reshape ((nout, naver)), axis=1, out=outdata)
-        sum (flags.reshape ((nout, naver)), axis=1, out=counts)
+        for c0, c1, o0, o1, nav in blocks:
+            sum (data[c0:c1].reshape ((o1 - o0, nav)), axis=1, out=outdata[o0:o1])
+            sum (flags[c0:c1].reshape ((o1 - o0, nav)), axis=1, out=counts[o0:o1])
         greater_equal (counts, nmin, outflags)
         maximum (counts, 1, counts) # avoid div-by-zero
         outdata /= counts
 
+        if aver is not None:
+            aver.add (vishnd, preamble, outdata, outflags)
+            continue
+
         # Write, with the usual npol tomfoolery.
 
         vishnd.copyLineVars (outhnd)
@@ -349,7 +615,9 @@ returns: None
 
     # All done.
 
-    if not npolvaried:
+    if aver is not None:
+        aver.flush ()
+    elif not npolvaried:
         outhnd.setScalarItem ('npol', N.int32, prevnpol)
 
     outhnd.close ()
@@ -368,8 +636,10 @@ Will call mirtask.util.die on some errors.
 
     ks = keys.KeySpec ()
     ks.keyword ('out', 'f', ' ')
-    ks.keyword ('naver', 'i', -1)
+    ks.mkeyword ('naver', 'i', None)
     ks.keyword ('slop', 'd', DEFAULT_SLOP)
+    ks.keyword ('interval', 'd', 0.)
+    ks.keymatch ('weight', 1, [WEIGHT_NONE, WEIGHT_VARIANCE])
     ks.uvdat (UVDAT_OPTIONS + 'dslr')
     opts = ks.process (args)
 
@@ -378,12 +648,18 @@ Will call mirtask.util.die on some errors.
 
     out = VisData (opts.out)
 
-    if opts.naver == -1:
+    if not len (opts.naver):
         util.wrongusage (__doc__,
                          'must specify the number of channels to average (naver=...)')
 
+    if len (opts.weight):
+        weighting = opts.weight[0]
+    else:
+        weighting = WEIGHT_NONE
+
     try:
-        channelAverage (out, opts.naver, opts.slop, banner=DEFAULT_BANNER, args=args)
+        channelAverage (out, opts.naver, opts.slop, banner=DEFAULT_BANNER,
+                        args=args, interval=opts.interval, weighting=weighting)
     except (InputStructureError, ValueError), e:
         util.die (str (e))
 
@@ -17,12 +17,19 @@
 # You should have received a copy of the GNU General Public License
 # along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys, os, re, math
+import sys, os, re, math, threading, time
+import errno, fcntl, resource, select, signal, struct
 import os.path
 from os.path import join
 from subprocess import Popen, PIPE, STDOUT
 import miriad
 
+try:
+    import trollius as _asyncio
+    from trollius import From as _From, Return as _Return
+except ImportError:
+    _asyncio = None
+
 # Compatibility with Python 2.4. It seems safest to give the exception
 # class a unique name so that callers don't build in a Python >=2.5
 # dependency by expecting our exception class to be CalledProcessError
@@ -184,6 +191,240 @@ class DefaultedTaskType (type):
                 setattr (cls, o, False)
 
 
+# Resource accounting for launched tasks.
+
+if sys.platform == 'darwin':
+    _maxrssUnit = 1 # bytes
+else:
+    _maxrssUnit = 1024 # kibibytes
+
+
+_ruFields = ('ru_utime', 'ru_stime', 'ru_maxrss', 'ru_inblock', 'ru_oublock',
+             'ru_minflt', 'ru_majflt')
+
+class _RUsage (object):
+    # Stands in for the rusage structure when the figures for a task
+    # aren't reported by wait4() but computed from getrusage() calls.
+    # *values* are in the order of _ruFields.
+
+    def __init__ (self, values):
+        for k, v in zip (_ruFields, values):
+            setattr (self, k, v)
+
+
+def _ruDelta (before, after):
+    # The peak RSS can't be differenced, so it is the peak at the
+    # second call.
+    values = []
+    for k in _ruFields:
+        if k == 'ru_maxrss':
+            values.append (after.ru_maxrss)
+        else:
+            values.append (getattr (after, k) - getattr (before, k))
+    return _RUsage (values)
+
+
+class TaskUsage (object):
+    """:synopsis: the resources used by a task that was run
+
+Instances are created when a :class:`MiriadSubprocess` is waited for
+and are stored in its :attr:`~MiriadSubprocess.usage` attribute. They
+are also created for tasks run with :meth:`TaskBase.arun`,
+:meth:`TaskBase.asnarf`, and :class:`WorkerPool`, and all of them are
+passed to :data:`usageTotals`. The attributes are:
+
+============== =========================================================
+Attribute      Meaning
+============== =========================================================
+taskname       The name of the task
+command        The command and arguments that were executed
+returncode     The exit code of the task
+wallTime       The elapsed time from launch until the task was waited
+               for, in seconds
+userTime       The CPU time spent in user mode, in seconds
+sysTime        The CPU time spent in the kernel, in seconds
+maxRSS         The peak resident set size, in bytes
+readBytes      The amount of data read from storage, in bytes
+writeBytes     The amount of data written to storage, in bytes
+minorFaults    The number of page faults serviced without I/O
+majorFaults    The number of page faults that required I/O
+============== =========================================================
+
+The CPU, memory, and I/O figures come from the :func:`os.wait4` call
+that reaps the task, so they cover the task and any of its children
+that it waited for. The I/O figures are derived from the block counts
+reported by the kernel, which are in 512-byte units on Linux; they
+count only data that actually went to or came from storage, not that
+served from the page cache. *wallTime* includes any time that the
+task had finished but had not yet been waited for.
+
+For the asynchronous runners and for jobs run in a :class:`WorkerPool`
+the figures are measured less directly. The asynchronous runners take
+the growth of the :data:`resource.RUSAGE_CHILDREN` totals over the
+life of the task, which also includes any other children of this
+process that finished in the meantime, so when several run at once
+their figures overlap. Pool jobs report the growth of their worker's
+own totals (and those of its children) over the job; if the worker
+dies during the job, only *wallTime* is known and the other figures are
+zero. In both cases *maxRSS* is the peak over all of the processes
+measured, not just the task. Tasks implemented as Python modules and run in this process, or
+in a :class:`multiprocessing.Pool`, are not recorded.
+"""
+
+    def __init__ (self, taskname, command, returncode, wallTime, ru):
+        self.taskname = taskname
+        self.command = command
+        self.returncode = returncode
+        self.wallTime = wallTime
+        self.userTime = ru.ru_utime
+        self.sysTime = ru.ru_stime
+        self.maxRSS = ru.ru_maxrss * _maxrssUnit
+        self.readBytes = ru.ru_inblock * 512
+        self.writeBytes = ru.ru_oublock * 512
+        self.minorFaults = ru.ru_minflt
+        self.majorFaults = ru.ru_majflt
+
+
+    def asDict (self):
+        """Return the usage information as a :class:`dict`, suitable for
+serializing as JSON or similar."""
+        return dict ((k, getattr (self, k)) for k in _usageKeys)
+
+
+    def __repr__ (self):
+        return '<TaskUsage %s: rc=%d wall=%.3fs user=%.3fs sys=%.3fs maxrss=%d>' % \
+            (self.taskname, self.returncode, self.wallTime, self.userTime,
+             self.sysTime, self.maxRSS)
+
+
+_usageKeys = ('taskname', 'command', 'returncode', 'wallTime', 'userTime',
+              'sysTime', 'maxRSS', 'readBytes', 'writeBytes', 'minorFaults',
+              'majorFaults')
+
+# Fields summed by UsageAggregator, and those for which it takes
+# the maximum.
+_usageSums = ('wallTime', 'userTime', 'sysTime', 'readBytes', 'writeBytes',
+              'minorFaults', 'majorFaults')
+_usageMaxes = ('maxRSS', )
+
+
+class UsageAggregator (object):
+    """:synopsis: accumulates task resource usage by task name
+
+Each :class:`TaskUsage` passed to :meth:`add` is tallied under its
+*taskname*. The process-wide instance :data:`usageTotals` receives the
+usage of every task run by :mod:`mirexec`, so that a pipeline can
+report where its resources went::
+
+  ... # run a pipeline
+  mirexec.usageTotals.report ()
+
+This is safe to use from multiple threads.
+"""
+
+    def __init__ (self):
+        self._lock = threading.Lock ()
+        self.reset ()
+
+
+    def reset (self):
+        """Forget everything that has been tallied.
+
+:returns: *self*
+"""
+        self._lock.acquire ()
+        try:
+            self._byTask = {}
+        finally:
+            self._lock.release ()
+        return self
+
+
+    def add (self, usage):
+        """Tally the resource usage of a task.
+
+:arg usage: the usage
+:type usage: :class:`TaskUsage`
+:returns: *self*
+"""
+        self._lock.acquire ()
+        try:
+            t = self._byTask.get (usage.taskname)
+            if t is None:
+                t = self._byTask[usage.taskname] = dict (count=0, failures=0)
+                for k in _usageSums + _usageMaxes:
+                    t[k] = 0
+
+            t['count'] += 1
+            if usage.returncode != 0:
+                t['failures'] += 1
+            for k in _usageSums:
+                t[k] += getattr (usage, k)
+            for k in _usageMaxes:
+                t[k] = max (t[k], getattr (usage, k))
+        finally:
+            self._lock.release ()
+        return self
+
+
+    def summary (self):
+        """Get the tallies.
+
+:returns: a :class:`dict` mapping each task name to a :class:`dict`
+  with the number of times it was run (*count*) and the number of
+  those runs that failed (*failures*), the maximum *maxRSS*, and the
+  sums of the other numerical :class:`TaskUsage` attributes
+"""
+        self._lock.acquire ()
+        try:
+            return dict ((k, dict (v)) for k, v in self._byTask.iteritems ())
+        finally:
+            self._lock.release ()
+
+
+    def report (self, stream=None):
+        """Print a table of the tallies.
+
+:arg filelike stream: where to print the table; defaults to
+  :data:`sys.stdout`
+:returns: *self*
+
+The tasks are listed in order of decreasing total wall-clock time.
+"""
+        if stream is None:
+            stream = sys.stdout
+
+        s = self.summary ()
+        order = sorted (s.iterkeys (), key=lambda n: s[n]['wallTime'], reverse=True)
+
+        print >>stream, '%-16s %6s %5s %10s %10s %10s %10s %10s %10s' % \
+            ('task', 'count', 'fail', 'wall (s)', 'user (s)', 'sys (s)',
+             'maxrss(MB)', 'read (MB)', 'write (MB)')
+        for name in order:
+            t = s[name]
+            print >>stream, '%-16s %6d %5d %10.2f %10.2f %10.2f %10.1f %10.1f %10.1f' % \
+                (name, t['count'], t['failures'], t['wallTime'], t['userTime'],
+                 t['sysTime'], t['maxRSS'] / 1048576., t['readBytes'] / 1048576.,
+                 t['writeBytes'] / 1048576.)
+        return self
+
+
+usageTotals = UsageAggregator ()
+
+
+def _recordUsage (taskname, command, returncode, start, ru):
+    # For tasks that aren't reaped by a MiriadSubprocess.
+    usage = TaskUsage (taskname, command, returncode, time.time () - start, ru)
+    usageTotals.add (usage)
+    return usage
+
+
+def _usageTraceExtra (usage):
+    # The usage figures recorded in a task's trace end event.
+    return dict ((k, getattr (usage, k)) for k in
+                 ('userTime', 'sysTime', 'maxRSS', 'readBytes', 'writeBytes'))
+
+
 class MiriadSubprocess (Popen):
     # In this class, we work around the crappy API of the Python standard libraries.
 
@@ -220,12 +461,83 @@ subprocess is launched.
     """An iterable of strings giving the command and arguments that
     were executed."""
 
+    taskname = None
+    """The name of the task, used for resource accounting. Defaults to
+    the base name of the executable."""
+
+    traceToken = None
+    """The token from :func:`miriad.traceStart` for the task, if
+    structured tracing is active; the end event is emitted when the
+    task is waited for."""
+
+    usage = None
+    """A :class:`TaskUsage` recording the resources used by the task,
+    or :const:`None` if it hasn't yet been waited for. It is also
+    :const:`None` if the task was reaped without going through
+    :meth:`wait` or :meth:`poll`."""
+
     def __init__ (self, command, **kwargs):
         # Raise a TypeError if command is not iterable.
         iter (command)
 
+        self._startTime = time.time ()
         super (MiriadSubprocess, self).__init__ (command, **kwargs)
         self.command = command
+        self.taskname = os.path.basename (command[0])
+
+
+    # We override wait() and poll() to reap the child with wait4, so
+    # that we get its resource usage. These follow the implementations
+    # in subprocess.Popen.
+
+    def _reaped (self, status, ru):
+        # _handle_exitstatus is private to subprocess, but takes the
+        # status as its one required argument in Python 2.5 through
+        # 2.7; check it when supporting another version.
+        self._handle_exitstatus (status)
+        extra = {}
+
+        if ru is not None:
+            self.usage = _recordUsage (self.taskname, self.command,
+                                       self.returncode, self._startTime, ru)
+            extra = _usageTraceExtra (self.usage)
+
+        if self.traceToken is not None:
+            miriad.traceEnd (self.traceToken, self.returncode, **extra)
+            self.traceToken = None
+
+
+    def wait (self):
+        while self.returncode is None:
+            try:
+                pid, status, ru = os.wait4 (self.pid, 0)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno != errno.ECHILD:
+                    raise
+                # As in Popen: the child is gone and its status is lost.
+                pid, status, ru = self.pid, 0, None
+
+            if pid == self.pid:
+                self._reaped (status, ru)
+
+        return self.returncode
+
+
+    def poll (self):
+        if self.returncode is None:
+            try:
+                pid, status, ru = os.wait4 (self.pid, os.WNOHANG)
+            except OSError, e:
+                if e.errno != errno.ECHILD:
+                    raise
+                pid, status, ru = self.pid, 0, None
+
+            if pid == self.pid:
+                self._reaped (status, ru)
+
+        return self.returncode
 
 
     def checkFailNoPipe (self, log=None):
@@ -363,6 +675,32 @@ This method captures the task output and hence uses
         return stdout, stderr
 
 
+class TaskResult (object):
+    """:synopsis: the outcome of a task that was not run with a
+    :class:`MiriadSubprocess`
+
+Instances have the attributes **command**, the task name and
+arguments, and **returncode**, the exit code of the task, or the exit
+code the task would have had had it been run as a program. They offer
+the :meth:`checkFailNoPipe` and :meth:`checkFailPipe` methods of
+:class:`MiriadSubprocess`. They're used for tasks run in-process by
+:class:`PyModTask` and asynchronously by :meth:`TaskBase.arun`; you
+won't usually need to deal with them directly. The class is also
+available under its original name, :class:`PyModResult`.
+"""
+
+    def __init__ (self, command, returncode):
+        self.command = command
+        self.returncode = returncode
+
+    checkFailNoPipe = MiriadSubprocess.checkFailNoPipe.im_func
+    checkFailPipe = MiriadSubprocess.checkFailPipe.im_func
+
+
+# The class's original name, from when only PyModTask used it.
+PyModResult = TaskResult
+
+
 class TaskBase (object):
     """:synopsis: Generic MIRIAD task launcher
 :arg kwargs: attributes to set on the object (with :meth:`set`)
@@ -531,16 +869,49 @@ To wait for the task to complete, use :meth:`run`. To wait for the task and
 obtain its output, use :meth:`snarf`. To wait for the task and discard its
 output, use :meth:`runsilent`.
 """
-        cmd = self.commandLine ()
+        cmd, env = self._launchArgs ()
         miriad.trace (cmd)
+        tok = self._traceStart ('task', cmd)
+
         try:
-            return MiriadSubprocess (cmd, shell=False, close_fds=True,
-                                     env=_childenv, **kwargs)
+            proc = MiriadSubprocess (cmd, shell=False, close_fds=True,
+                                     env=env, **kwargs)
         except OSError, e:
+            miriad.traceEnd (tok, None, error=str (e))
             if e.errno == 2:
                 raise TaskLaunchError (cmd, 'executable not found in $PATH')
             raise TaskLaunchError (cmd, str (e))
 
+        proc.traceToken = tok
+        return proc
+
+
+    def _launchArgs (self):
+        # The argv and environment of a subprocess running the task,
+        # shared by launch() and the asynchronous runners.
+        return self.commandLine (), _childenv
+
+
+    def _traceStart (self, kind, cmd):
+        # Trace the datasets among the keyword values, whose sizes are
+        # recorded.
+        if miriad.eventTrace is None:
+            return None
+
+        datasets = {}
+
+        for name in self._keywords or []:
+            val = getattr (self, name)
+
+            if isinstance (val, miriad.Data):
+                datasets[name] = val
+            elif isinstance (val, (list, tuple)):
+                for i, item in enumerate (val):
+                    if isinstance (item, miriad.Data):
+                        datasets['%s[%d]' % (name, i)] = item
+
+        return miriad.traceStart (kind, self._name, cmd, datasets)
+
 
     def launchpipe (self, **kwargs):
         """Launch an invocation of the task with the current keywords,
@@ -679,6 +1050,964 @@ output of the task, use :meth:`runsilent`.
         stdout, stderr = self.launchpipe (**kwargs).checkcommunicate (send, failok, log)
         return stdout.splitlines (), stderr.splitlines ()
 
+    def arun (self, failok=False, log=None, **kwargs):
+        """Run the task asynchronously with the current keywords.
+
+:arg bool failok: if :const:`True`, no exception will be raised if the
+  task returns a nonzero exit code.
+:arg filelike log: where to log debugging information if the task
+  fails, or :const:`None` (the default) not to log this information.
+:arg kwargs: extra arguments to pass to the event loop's subprocess
+  creation function, and in turn to :class:`subprocess.Popen`.
+:returns: a coroutine yielding *self*
+:raises: :exc:`ImportError` if asynchronous execution is not available
+
+This is the asynchronous counterpart of :meth:`run`, for use with an
+:mod:`asyncio` event loop. Since this module is Python 2 code, that
+means the loop of the :mod:`trollius` backport of :mod:`asyncio`,
+which must be installed. The coroutine raises
+:exc:`TaskLaunchError` and :exc:`TaskFailError` under the same
+circumstances as :meth:`run`. For instance::
+
+  import trollius
+  loop = trollius.get_event_loop ()
+  loop.run_until_complete (TaskUVFlag (vis=v, flagval='f').arun ())
+
+To run many tasks concurrently, see :func:`gather`.
+"""
+        _checkAsync ()
+        return _arun (self, failok, log, kwargs)
+
+
+    def asnarf (self, send=None, failok=False, log=sys.stderr, **kwargs):
+        """Run the task asynchronously and retrieve its output.
+
+:arg str send: input to send the task on its standard input, or :const:`None`
+  not to do so
+:arg bool failok: if :const:`True`, no exception will be raised if the
+  task returns a nonzero exit code
+:arg log: where to log the task's output if it fails, or :const:`None`
+  not to log the output. Default is ``sys.stderr``.
+:arg kwargs: extra arguments to pass to the event loop's subprocess
+  creation function, and in turn to :class:`subprocess.Popen`.
+:returns: a coroutine yielding ``(stdout, stderr)``, as returned by
+  :meth:`snarf`
+:raises: :exc:`ImportError` if asynchronous execution is not available
+
+This is the asynchronous counterpart of :meth:`snarf`; see
+:meth:`arun` for the requirements.
+"""
+        _checkAsync ()
+        return _asnarf (self, send, failok, log, kwargs)
+
+
+    def stream (self, failok=False, log=sys.stderr, tail=100, **kwargs):
+        """Run the task and iterate over its output as it is written.
+
+:arg bool failok: if :const:`True`, no exception will be raised if the
+  task returns a nonzero exit code
+:arg log: where to log the end of the task's output if it fails, or
+  :const:`None` not to log it. Default is ``sys.stderr``.
+:arg int tail: the number of lines of each output stream to keep for
+  the log if the task fails
+:arg kwargs: extra arguments to pass to the :class:`MiriadSubprocess` constructor
+:raises: :exc:`TaskLaunchError` if there was an error launching the task.
+:raises: :exc:`TaskFailError` if the task returns a nonzero exit code
+:returns: a generator yielding ``(which, line)`` for each line of
+  output, where *which* is 1 for standard output and 2 for standard
+  error and *line* is a string without the trailing newline or
+  carriage return
+
+Unlike :meth:`snarf`, this doesn't hold on to the whole task output,
+and the output can be processed while the task is still running. The
+task is launched when this function is called. Lines are split as by
+:meth:`str.splitlines`, as with :meth:`snarf`, so a carriage return
+ends a line too. The lines of each stream are yielded in order, and lines from the two streams are
+interleaved in roughly the order in which they were written. If the
+task fails, :exc:`TaskFailError` is raised once all of its output has
+been yielded, after the last *tail* lines of each stream are written
+to *log* as with :meth:`snarf`. For instance::
+
+  for which, line in TaskUVIndex (vis=v).stream ():
+      if which == 1 and line.startswith ('Total number'):
+          print line
+
+Output is read in chunks of limited size, and the task is made to wait
+if its output isn't consumed, so memory use is bounded no matter how
+much output there is. (An extremely long line without a newline is
+yielded in pieces.) If iteration is abandoned, the task's output pipes
+are closed when the generator is garbage-collected, which will
+usually cause the task to die the next time it writes anything.
+"""
+        return _streamLines (self.launchpipe (**kwargs), failok, log, tail)
+
+
+# Streaming task output. This mustn't use try/finally, since that
+# isn't allowed in generators in Python 2.4.
+
+_streamChunk = 65536
+
+def _streamLines (proc, failok, log, ntail):
+    from collections import deque
+
+    fds = {proc.stdout.fileno (): 1, proc.stderr.fileno (): 2}
+    live = fds.keys ()
+    partial = {1: '', 2: ''}
+    tails = {1: deque (), 2: deque ()}
+    ndropped = {1: 0, 2: 0}
+
+    while len (live):
+        try:
+            ready = select.select (live, [], [])[0]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+
+        for fd in ready:
+            which = fds[fd]
+
+            try:
+                data = os.read (fd, _streamChunk)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue # select again
+                raise
+
+            if not len (data):
+                live.remove (fd)
+                lines = [partial[which]]
+                partial[which] = ''
+                if not len (lines[0]):
+                    continue
+            else:
+                lines = (partial[which] + data).split ('\n')
+                partial[which] = lines.pop ()
+                if len (partial[which]) >= _streamChunk:
+                    lines.append (partial[which])
+                    partial[which] = ''
+
+            # Split the lines as snarf's splitlines () would: CRLF
+            # ends a line, and so does a lone CR, as written by tasks
+            # that show progress.
+            crlines = []
+            for line in lines:
+                if line.endswith ('\r'):
+                    line = line[:-1]
+                crlines.extend (line.split ('\r'))
+
+            t = tails[which]
+            for line in crlines:
+                t.append (line)
+                if len (t) > ntail:
+                    t.popleft ()
+                    ndropped[which] += 1
+                yield which, line
+
+    proc.stdout.close ()
+    proc.stderr.close ()
+    proc.wait ()
+
+    if not failok:
+        kept = {}
+        for which in (1, 2):
+            lines = list (tails[which])
+            if ndropped[which]:
+                lines.insert (0, '[... %d earlier lines not kept ...]' % ndropped[which])
+            kept[which] = '\n'.join (lines)
+        proc.checkFailPipe (kept[1], kept[2], log)
+
+
+# Asynchronous execution. We're Python 2 code, so this is built on
+# trollius, the Python 2 port of asyncio, if it's available.
+
+if _asyncio is None:
+    def _coroutine (func):
+        return func
+else:
+    _coroutine = _asyncio.coroutine
+
+
+def _checkAsync ():
+    if _asyncio is None:
+        raise ImportError ('asynchronous task execution requires the '
+                           '"trollius" module')
+
+
+@_coroutine
+def _alaunch (task, kwargs):
+    cmd, env = task._launchArgs ()
+    miriad.trace (cmd)
+    tok = task._traceStart ('task', cmd)
+    # The child is reaped by the event loop's child watcher, so its
+    # usage is measured from our RUSAGE_CHILDREN totals.
+    start = time.time ()
+    before = resource.getrusage (resource.RUSAGE_CHILDREN)
+
+    try:
+        proc = yield _From (_asyncio.create_subprocess_exec (*cmd, close_fds=True,
+                                                             env=env, **kwargs))
+    except OSError, e:
+        miriad.traceEnd (tok, None, error=str (e))
+        if e.errno == 2:
+            raise TaskLaunchError (cmd, 'executable not found in $PATH')
+        raise TaskLaunchError (cmd, str (e))
+
+    raise _Return ((cmd, tok, proc, (start, before)))
+
+
+def _aabandoned (tok):
+    # End the trace of a task whose wait didn't finish, including
+    # because the coroutine was cancelled, which needn't raise an
+    # Exception.
+    e = sys.exc_info ()[1]
+    miriad.traceEnd (tok, None, error=str (e) or e.__class__.__name__)
+
+
+def _areaped (task, cmd, tok, returncode, launched):
+    start, before = launched
+    ru = _ruDelta (before, resource.getrusage (resource.RUSAGE_CHILDREN))
+    usage = _recordUsage (task._name, cmd, returncode, start, ru)
+    miriad.traceEnd (tok, returncode, **_usageTraceExtra (usage))
+
+
+@_coroutine
+def _arun (task, failok, log, kwargs):
+    cmd, tok, proc, launched = yield _From (_alaunch (task, kwargs))
+
+    try:
+        returncode = yield _From (proc.wait ())
+    except:
+        _aabandoned (tok)
+        raise
+
+    _areaped (task, cmd, tok, returncode, launched)
+
+    if not failok:
+        TaskResult (cmd, returncode).checkFailNoPipe (log)
+    raise _Return (task)
+
+
+@_coroutine
+def _asnarf (task, send, failok, log, kwargs):
+    if send is None:
+        stdin = file (os.devnull, 'r')
+    else:
+        stdin = _asyncio.subprocess.PIPE
+
+    kwargs = dict (kwargs, stdin=stdin, stdout=_asyncio.subprocess.PIPE,
+                   stderr=_asyncio.subprocess.PIPE)
+    cmd, tok, proc, launched = yield _From (_alaunch (task, kwargs))
+
+    try:
+        stdout, stderr = yield _From (proc.communicate (send))
+    except:
+        _aabandoned (tok)
+        raise
+
+    _areaped (task, cmd, tok, proc.returncode, launched)
+
+    if not failok:
+        TaskResult (cmd, proc.returncode).checkFailPipe (stdout, stderr, log)
+    raise _Return ((stdout.splitlines (), stderr.splitlines ()))
+
+
+@_coroutine
+def _limited (sem, coro):
+    yield _From (sem.acquire ())
+    try:
+        result = yield _From (coro)
+    finally:
+        sem.release ()
+    raise _Return (result)
+
+
+def gather (coros, limit=16, return_exceptions=False):
+    """Run many asynchronous tasks, only a limited number at a time.
+
+:arg coros: the coroutines to run, such as those returned by
+  :meth:`TaskBase.arun` and :meth:`TaskBase.asnarf`
+:type coros: iterable
+:arg int limit: the maximum number of coroutines to run at once
+:arg bool return_exceptions: as for :func:`asyncio.gather`: if
+  :const:`True`, exceptions are returned as results rather than
+  raised
+:returns: a future yielding the list of results, in the same order
+  as *coros*
+:raises: :exc:`ImportError` if asynchronous execution is not available
+
+This is :func:`asyncio.gather` with the coroutines' execution limited
+by an :class:`asyncio.Semaphore`, so that an event loop can get
+through hundreds of tasks without launching them all at once. For
+instance::
+
+  import trollius
+  loop = trollius.get_event_loop ()
+  stats = loop.run_until_complete (gather ([TaskImStat (in_=im).asnarf ()
+                                            for im in images], limit=8))
+
+The coroutines don't start running until the returned future is
+scheduled on an event loop.
+"""
+    _checkAsync ()
+    sem = _asyncio.Semaphore (limit)
+    return _asyncio.gather (*[_limited (sem, c) for c in coros],
+                            return_exceptions=return_exceptions)
+
+
+# Running tasks implemented as Python modules without starting a new
+# interpreter. MIRIAD's keyword and UVDAT state and the process's
+# standard output and error are all global, so only one such task
+# runs in a given process at a time.
+
+_pyModLock = threading.Lock ()
+
+
+def _callPyModTask (modname, args):
+    from mirtask import keys, uvdat
+
+    keys.reset ()
+    uvdat.reset ()
+    saveargv = sys.argv
+    sys.argv = [modname] + args
+
+    try:
+        try:
+            __import__ (modname)
+            sys.modules[modname].task (args)
+            return 0
+        except SystemExit, e:
+            # Same semantics as the interpreter's handling of an
+            # uncaught SystemExit.
+            if e.code is None:
+                return 0
+            if isinstance (e.code, int):
+                return e.code
+            print >>sys.stderr, e.code
+            return 1
+        except Exception:
+            import traceback
+            traceback.print_exc ()
+            return 1
+    finally:
+        sys.argv = saveargv
+        keys.reset ()
+        uvdat.reset ()
+
+
+def _runPyModTask (modname, args, output):
+    """Run the task implemented by the module *modname* in this process.
+*output* is None to leave the task output alone, 'null' to discard
+it, or 'pipe' to capture it. Returns (returncode, stdout, stderr),
+the latter two being None unless the output was captured. The
+redirection is done at the level of file descriptors so that output
+from MIRIAD's C and Fortran code is caught too."""
+
+    _pyModLock.acquire ()
+    try:
+        if output is None:
+            return _callPyModTask (modname, args), None, None
+
+        if output == 'pipe':
+            from tempfile import TemporaryFile
+            out = TemporaryFile ()
+            err = TemporaryFile ()
+        else:
+            out = err = file (os.devnull, 'w')
+
+        sys.stdout.flush ()
+        sys.stderr.flush ()
+        save1 = os.dup (1)
+        save2 = os.dup (2)
+
+        try:
+            os.dup2 (out.fileno (), 1)
+            os.dup2 (err.fileno (), 2)
+            code = _callPyModTask (modname, args)
+        finally:
+            sys.stdout.flush ()
+            sys.stderr.flush ()
+            os.dup2 (save1, 1)
+            os.dup2 (save2, 2)
+            os.close (save1)
+            os.close (save2)
+
+        if output != 'pipe':
+            out.close ()
+            return code, None, None
+
+        out.seek (0)
+        err.seek (0)
+        stdout, stderr = out.read (), err.read ()
+        out.close ()
+        err.close ()
+        return code, stdout, stderr
+    finally:
+        _pyModLock.release ()
+
+
+class PyModTask (TaskBase):
+    """:synopsis: launcher for tasks implemented as Python modules
+:arg kwargs: attributes to set on the object (with :meth:`set`)
+
+A launcher for tasks implemented as Python modules that provide a
+function ``task (args)``, where *args* is a list of command-line
+arguments, as the example ``chanaver`` does. Such tasks are normally
+installed with ``mirpymodtask``, which runs them with ``python -m
+modname``. Subclasses are defined as with :class:`TaskBase`, except
+that *_name* is the name of the module::
+
+  class TaskChanAver (PyModTask):
+      _name = 'chanaver'
+      _keywords = ['vis', 'out', 'naver', 'slop', 'select', 'line']
+      _options = ['nocal', 'nopass', 'nopol']
+
+:meth:`run`, :meth:`runsilent`, and :meth:`snarf` call the task
+function in the current interpreter rather than in a new process,
+which avoids the costs of starting up Python, importing NumPy, and
+loading the MIRIAD libraries every time. The task's output, including
+that written by MIRIAD's C and Fortran code, is redirected as it
+would be for a subprocess. A :exc:`SystemExit` raised by the task
+yields its exit code, and any other exception is printed and yields
+an exit code of 1, so that failures are reported with
+:exc:`TaskFailError` just as for other tasks. The MIRIAD keyword and
+UVDAT subsystems are reset after each run (see
+:func:`mirtask.keys.reset` and :func:`mirtask.uvdat.reset`), so that
+a task that fails doesn't break the next one.
+
+If :meth:`setPool` has been used to associate the task with a
+:class:`WorkerPool`, the task function is instead called in one of
+the pool's pre-forked worker processes, with its output streamed back
+as it is written. A :class:`multiprocessing.Pool` can be used in the
+same way, though its workers only warm up after their first job and
+the task output is only delivered at the end.
+
+The :meth:`launch` family of methods and the asynchronous
+:meth:`arun` and :meth:`asnarf` still start a new Python interpreter,
+since their tasks run concurrently with the caller.
+"""
+
+    _name = None
+    _pool = None
+
+    def setPool (self, pool):
+        """Run the task in a pool of worker processes.
+
+:arg pool: the pool, or :const:`None` to run in this process
+:type pool: :class:`WorkerPool` or :class:`multiprocessing.Pool`
+:returns: *self*
+"""
+        self._pool = pool
+        return self
+
+
+    def _execute (self, output):
+        cmd = self.commandLine ()
+        miriad.trace (cmd)
+        tok = self._traceStart ('pytask', cmd)
+        args = cmd[1:]
+
+        try:
+            if self._pool is None:
+                code, stdout, stderr = _runPyModTask (self._name, args, output)
+            elif isinstance (self._pool, WorkerPool):
+                code, stdout, stderr = self._pool.runTask (self._name, args, output)
+            else:
+                code, stdout, stderr = self._pool.apply (_runPyModTask,
+                                                         (self._name, args, output))
+        except Exception, e:
+            miriad.traceEnd (tok, None, error=str (e))
+            raise
+
+        miriad.traceEnd (tok, code)
+        return TaskResult (cmd, code), stdout, stderr
+
+
+    def commandLine (self):
+        cmd = super (PyModTask, self).commandLine ()
+        cmd[0] = self._name
+        return cmd
+
+
+    def _launchArgs (self):
+        cmd = [sys.executable, '-m'] + self.commandLine ()
+        env = dict (_childenv)
+        if 'PYTHONPATH' in os.environ:
+            env['PYTHONPATH'] = os.environ['PYTHONPATH']
+        return cmd, env
+
+
+    def launch (self, **kwargs):
+        proc = super (PyModTask, self).launch (**kwargs)
+        proc.taskname = self._name
+        return proc
+
+
+    def run (self, failok=False, log=None):
+        """Run the task with the current keywords.
+
+:arg bool failok: if :const:`True`, no exception will be raised if the
+  task fails
+:arg filelike log: where to log debugging information if the task
+  fails, or :const:`None` (the default) not to log this information
+:raises: :exc:`TaskFailError` if the task fails
+:returns: *self*
+"""
+        res, stdout, stderr = self._execute (None)
+        if not failok:
+            res.checkFailNoPipe (log)
+        return self
+
+
+    def runsilent (self, failok=False, log=None):
+        """Run the task with the current keywords, discarding its output.
+
+:arg bool failok: if :const:`True`, no exception will be raised if the
+  task fails
+:arg filelike log: where to log debugging information if the task
+  fails, or :const:`None` (the default) not to log this information
+:raises: :exc:`TaskFailError` if the task fails
+:returns: *self*
+"""
+        res, stdout, stderr = self._execute ('null')
+        if not failok:
+            res.checkFailNoPipe (log)
+        return self
+
+
+    def snarf (self, send=None, failok=False, log=sys.stderr):
+        """Run the task and retrieve its output.
+
+:arg str send: must be :const:`None`; tasks run this way can't be
+  sent input
+:arg bool failok: if :const:`True`, no exception will be raised if the
+  task fails
+:arg log: where to log the task's output if it fails, or :const:`None`
+  not to log the output. Default is ``sys.stderr``.
+:raises: :exc:`TaskFailError` if the task fails
+:returns: ``(stdout, stderr)``, both of which are arrays of strings of
+  the task's output split on line boundaries, as for
+  :meth:`TaskBase.snarf`
+"""
+        if send is not None:
+            raise ValueError ('cannot send input to a task run in-process')
+
+        res, stdout, stderr = self._execute ('pipe')
+        if not failok:
+            res.checkFailPipe (stdout, stderr, log)
+        return stdout.splitlines (), stderr.splitlines ()
+
+
+# A pool of pre-forked worker processes for PyModTask. Each worker has
+# its standard output and error connected to pipes that the parent
+# reads, a pipe on which it receives pickled jobs, and a pipe on which
+# it returns the exit code of each job as a packed int. A worker exits
+# when its job pipe is closed.
+
+_defaultPreload = ('numpy', 'mirtask', 'mirtask.util', 'mirtask.keys',
+                   'mirtask.uvdat', 'mirtask._miriad_f_uvdat')
+
+
+def _setCloexec (fd):
+    flags = fcntl.fcntl (fd, fcntl.F_GETFD)
+    fcntl.fcntl (fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+class _Worker (object):
+    pid = None
+    jobs = None
+    outfd = errfd = resfd = None
+    njobs = 0
+
+    def fds (self):
+        return (self.jobs.fileno (), self.outfd, self.errfd, self.resfd)
+
+    def closeFds (self):
+        # For use in a forked child: closing the jobs file object
+        # would flush whatever the parent had buffered in it into the
+        # worker's job pipe, so only the descriptors are closed.
+        for fd in self.fds ():
+            try:
+                os.close (fd)
+            except OSError:
+                pass
+
+    def close (self):
+        for fd in (self.outfd, self.errfd, self.resfd):
+            try:
+                os.close (fd)
+            except OSError:
+                pass
+        try:
+            self.jobs.close ()
+        except IOError:
+            pass
+
+
+# A worker reports the exit code of each job and the growth of its
+# usage totals over it, in the order of _ruFields.
+_resultFormat = '=i2d5q'
+_resultSize = struct.calcsize (_resultFormat)
+
+
+def _workerRUsage ():
+    # A worker's own usage plus that of any children it has reaped.
+    s = resource.getrusage (resource.RUSAGE_SELF)
+    c = resource.getrusage (resource.RUSAGE_CHILDREN)
+    values = []
+    for k in _ruFields:
+        if k == 'ru_maxrss':
+            values.append (max (s.ru_maxrss, c.ru_maxrss))
+        else:
+            values.append (getattr (s, k) + getattr (c, k))
+    return _RUsage (values)
+
+
+def _workerMain (jobfd, resfd, preload):
+    import cPickle
+
+    for name in preload:
+        try:
+            __import__ (name)
+        except ImportError:
+            # Only an optimization; the task will complain if it
+            # needs the module.
+            pass
+
+    jobs = os.fdopen (jobfd, 'rb')
+
+    while True:
+        try:
+            modname, args = cPickle.load (jobs)
+        except EOFError:
+            return
+
+        before = _workerRUsage ()
+        code = _callPyModTask (modname, args)
+        sys.stdout.flush ()
+        sys.stderr.flush ()
+        ru = _ruDelta (before, _workerRUsage ())
+        os.write (resfd, struct.pack (_resultFormat, code,
+                                      *[getattr (ru, k) for k in _ruFields]))
+
+
+class WorkerPool (object):
+    """:synopsis: a pool of warm worker processes for running Python tasks
+:arg int nworkers: the number of worker processes; defaults to the
+  number of CPUs
+:arg int maxjobs: the number of jobs a worker runs before it is
+  replaced by a fresh one, or :const:`None` never to replace workers.
+  Default is 100.
+:arg preload: names of modules that each worker imports when it
+  starts, before it receives any jobs
+:type preload: iterable of str
+
+The workers are forked when the pool is created and immediately import
+the *preload* modules -- by default NumPy and the parts of
+:mod:`mirtask` used by most tasks, including the MIRIAD UVDAT
+bindings -- so that by the time a job arrives, none of its time is
+spent on interpreter startup or library loading.
+
+Jobs are the names and arguments of tasks implemented as Python
+modules, as for :class:`PyModTask`, and can be submitted with
+:meth:`runTask` or by associating a :class:`PyModTask` with the pool
+using :meth:`PyModTask.setPool`. The task's standard output and error
+are streamed back to the caller as they are written. :meth:`runTask`
+may be called from several threads at once, in which case the jobs run
+concurrently in different workers.
+
+Since MIRIAD's Fortran code keeps state in static variables that a
+failed task may leave in a bad condition, each worker is replaced
+after running *maxjobs* jobs. A worker that dies while running a job,
+for instance because of a segmentation fault, is replaced too, and
+the job is reported as having failed with an exit code of the negated
+signal number, as for a subprocess.
+
+Call :meth:`close` when the pool is no longer needed to shut down the
+workers.
+"""
+
+    def __init__ (self, nworkers=None, maxjobs=100, preload=_defaultPreload):
+        if nworkers is None:
+            try:
+                import multiprocessing
+                nworkers = multiprocessing.cpu_count ()
+            except (ImportError, NotImplementedError):
+                nworkers = 1
+
+        if nworkers < 1:
+            raise ValueError ('need at least one worker, not %d' % nworkers)
+        if maxjobs is not None and maxjobs < 1:
+            raise ValueError ('maxjobs must be positive or None, not %d' % maxjobs)
+
+        from Queue import Queue
+
+        self.maxjobs = maxjobs
+        self.preload = tuple (preload)
+        self._workers = []
+        self._idle = Queue ()
+        self._lock = threading.Lock ()
+
+        for i in xrange (nworkers):
+            self._idle.put (self._spawn ())
+
+
+    def _spawn (self):
+        self._lock.acquire ()
+        try:
+            jobr, jobw = os.pipe ()
+            outr, outw = os.pipe ()
+            errr, errw = os.pipe ()
+            resr, resw = os.pipe ()
+
+            sys.stdout.flush ()
+            sys.stderr.flush ()
+            pid = os.fork ()
+
+            if pid == 0:
+                # Child. Drop everything belonging to the parent or to
+                # the other workers, so that pipes get EOFs when they
+                # should.
+                code = 1
+                try:
+                    try:
+                        for fd in (jobw, outr, errr, resr):
+                            os.close (fd)
+                        for w in self._workers:
+                            w.closeFds ()
+
+                        nullfd = os.open (os.devnull, os.O_RDONLY)
+                        os.dup2 (nullfd, 0)
+                        os.dup2 (outw, 1)
+                        os.dup2 (errw, 2)
+                        for fd in (nullfd, outw, errw):
+                            os.close (fd)
+
+                        _workerMain (jobr, resw, self.preload)
+                        code = 0
+                    except KeyboardInterrupt:
+                        pass
+                    except:
+                        import traceback
+                        traceback.print_exc ()
+                finally:
+                    os._exit (code)
+
+            for fd in (jobr, outw, errw, resw):
+                os.close (fd)
+
+            w = _Worker ()
+            w.pid = pid
+            w.jobs = os.fdopen (jobw, 'wb')
+            w.outfd = outr
+            w.errfd = errr
+            w.resfd = resr
+
+            for fd in w.fds ():
+                _setCloexec (fd)
+            for fd in (outr, errr):
+                fcntl.fcntl (fd, fcntl.F_SETFL,
+                             fcntl.fcntl (fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+            self._workers.append (w)
+            return w
+        finally:
+            self._lock.release ()
+
+
+    def _retire (self, w):
+        # Returns the worker's exit code in the style of
+        # Popen.returncode.
+        self._lock.acquire ()
+        try:
+            self._workers.remove (w)
+        finally:
+            self._lock.release ()
+
+        w.close ()
+
+        while True:
+            try:
+                pid, status = os.waitpid (w.pid, 0)
+                break
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    raise
+
+        if os.WIFSIGNALED (status):
+            return -os.WTERMSIG (status)
+        return os.WEXITSTATUS (status)
+
+
+    def _kill (self, w):
+        try:
+            os.kill (w.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self._retire (w)
+
+
+    def runTask (self, modname, args, output=None):
+        """Run a task in one of the workers and wait for it to finish.
+
+:arg str modname: the name of the module implementing the task
+:arg args: the task's command-line arguments
+:type args: list of str
+:arg output: what to do with the task's output; see below
+:returns: ``(returncode, stdout, stderr)``; the latter two are strings
+  if *output* is ``'pipe'`` and :const:`None` otherwise
+:raises: :exc:`ValueError` if the pool has been closed
+
+The task is run with ``task (args)`` just as by :class:`PyModTask`. If
+no worker is free, this waits for one. If *output* is :const:`None`,
+the task's standard output and error are copied to :data:`sys.stdout`
+and :data:`sys.stderr` as they arrive. If it is ``'null'``, they are
+discarded; if ``'pipe'``, they are collected and returned. Otherwise
+it should be a callable, which is called as ``output (which, data)``
+with each chunk of output as it arrives, *which* being 1 for standard
+output and 2 for standard error.
+
+The job's resource usage is recorded in :data:`usageTotals` under the
+name *modname*; see :class:`TaskUsage`.
+"""
+        idle = self._idle
+        if idle is None:
+            raise ValueError ('cannot run a task in a closed WorkerPool')
+
+        import cPickle
+
+        if output is None:
+            def sink (which, data):
+                if which == 1:
+                    sys.stdout.write (data)
+                    sys.stdout.flush ()
+                else:
+                    sys.stderr.write (data)
+                    sys.stderr.flush ()
+        elif output == 'null':
+            def sink (which, data):
+                pass
+        elif output == 'pipe':
+            chunks = {1: [], 2: []}
+            def sink (which, data):
+                chunks[which].append (data)
+        else:
+            sink = output
+
+        w = idle.get ()
+        replace = True
+        start = time.time ()
+
+        try:
+            try:
+                cPickle.dump ((modname, list (args)), w.jobs, 2)
+                w.jobs.flush ()
+            except IOError, e:
+                if e.errno != errno.EPIPE:
+                    raise
+                # The worker died since its last job. Its exit code
+                # is reported below.
+
+            code, ru = self._collect (w, sink)
+            w.njobs += 1
+
+            if code is None:
+                code = self._retire (w)
+                if code == 0:
+                    code = 1 # the worker exited without reporting
+                ru = _RUsage ([0] * len (_ruFields))
+            elif self.maxjobs is not None and w.njobs >= self.maxjobs:
+                self._retire (w)
+            else:
+                replace = False
+        finally:
+            if replace:
+                # If we got here through an exception, the worker may
+                # be partway through the job, and its leftover output
+                # and exit code would be taken for those of the next
+                # job, so it can't be reused. If no replacement can be
+                # started, the pool carries on with one worker fewer.
+                if w in self._workers:
+                    self._kill (w)
+                w = self._spawn ()
+            idle.put (w)
+
+        _recordUsage (modname, [modname] + list (args), code, start, ru)
+
+        if output != 'pipe':
+            return code, None, None
+        return code, ''.join (chunks[1]), ''.join (chunks[2])
+
+
+    def _collect (self, w, sink):
+        # Read the worker's output until it reports an exit code and
+        # usage, or dies, in which case return (None, None).
+
+        fdmap = {w.outfd: 1, w.errfd: 2}
+        res = ''
+
+        while True:
+            try:
+                ready = select.select ([w.outfd, w.errfd, w.resfd], [], [])[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd in ready:
+                if fd != w.resfd:
+                    self._drain (fd, fdmap[fd], sink)
+                    continue
+
+                data = os.read (fd, _resultSize - len (res))
+                if not len (data):
+                    code = ru = None
+                else:
+                    res += data
+                    if len (res) < _resultSize:
+                        continue
+                    values = struct.unpack (_resultFormat, res)
+                    code, ru = values[0], _RUsage (values[1:])
+
+                # Anything the task wrote is in the pipes by now.
+                self._drain (w.outfd, 1, sink)
+                self._drain (w.errfd, 2, sink)
+                return code, ru
+
+
+    def _drain (self, fd, which, sink):
+        while True:
+            try:
+                data = os.read (fd, 65536)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.EAGAIN:
+                    return
+                raise
+
+            if not len (data):
+                return
+            sink (which, data)
+
+
+    def close (self):
+        """Shut down the worker processes.
+
+:returns: :const:`None`
+
+Waits for running jobs to finish. After this has been called,
+:meth:`runTask` may not be used.
+"""
+        if self._idle is None:
+            return
+
+        n = len (self._workers)
+        idle, self._idle = self._idle, None
+
+        for i in xrange (n):
+            self._retire (idle.get ())
+
 
 class TaskCgDisp (TaskBase):
     _keywords = ['device', 'in_', 'type', 'region', 'xybin', 'chan',
@@ -17,7 +17,7 @@
 # You should have received a copy of the GNU General Public License
 # along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys, os, os.path
+import sys, os, os.path, threading, time
 from os.path import join
 from stat import ST_MTIME
 
@@ -70,6 +70,311 @@ default.
 __all__ = ['basicTrace', 'trace']
 
 
+# Structured tracing. Where launchTrace just gets the command line of
+# each operation, eventTrace gets a pair of events for each, with
+# timings, outcomes, and dataset sizes, which can be logged and
+# summarized to see where a pipeline spends its time.
+
+eventTrace = None
+
+_traceLock = threading.Lock ()
+_traceSerial = 0
+
+def _datasetBytes (path):
+    # The number of bytes stored in a dataset, not counting items that
+    # are symlinks, such as the visdata of lightweight copies; None if
+    # it doesn't exist.
+    try:
+        if not os.path.isdir (path):
+            return os.path.getsize (path)
+
+        n = 0
+        for f in os.listdir (path):
+            p = join (path, f)
+            if os.path.isfile (p) and not os.path.islink (p):
+                n += os.path.getsize (p)
+        return n
+    except OSError:
+        return None
+
+
+def traceStart (kind, name, command, datasets=None):
+    """Start tracing a timed operation.
+
+:arg str kind: the kind of operation, such as "task" or "copy"
+:arg str name: the name of the operation, such as the task name
+:arg command: the command line of the operation
+:type command: list of str
+:arg datasets: the datasets involved in the operation, keyed by their
+  roles, such as "vis" or "out"
+:type datasets: :class:`dict` mapping str to :class:`Data` or str
+:returns: a token to pass to :func:`traceEnd`, or :const:`None` if
+  :data:`eventTrace` is :const:`None`
+
+If :data:`eventTrace` is not :const:`None`, it is called with a
+"start" event. An event is a :class:`dict` with the following items:
+
+=========== ===========================================================
+Key         Meaning
+=========== ===========================================================
+event       "start" or "end"
+id          A serial number shared by the start and end events of an
+            operation
+pid         The ID of the process doing the tracing
+kind        *kind*
+name        *name*
+command     *command*
+start       When the operation started, in seconds since the epoch
+end         When the operation ended (end events only)
+duration    The duration of the operation in seconds (end events only)
+returncode  The exit code of the operation, 0 meaning success (end
+            events only)
+datasets    A :class:`dict` mapping each role in *datasets* to a
+            :class:`dict` giving the dataset *path*, its size in bytes
+            when the operation started (*bytesBefore*) and, in end
+            events, ended (*bytesAfter*). Sizes are :const:`None`
+            if the dataset didn't exist. Items that are symbolic
+            links, like the visdata of a lightweight copy, are not
+            counted.
+=========== ===========================================================
+
+End events may have further items, such as *error*, a description of
+an exception that prevented the operation from completing, or the
+resource usage items described in :class:`mirexec.TaskUsage`.
+"""
+    global _traceSerial
+
+    if eventTrace is None:
+        return None
+
+    _traceLock.acquire ()
+    try:
+        _traceSerial += 1
+        ident = _traceSerial
+    finally:
+        _traceLock.release ()
+
+    dsinfo = {}
+    for role, ds in (datasets or {}).iteritems ():
+        path = str (ds)
+        dsinfo[role] = {'path': path, 'bytesBefore': _datasetBytes (path)}
+
+    event = {'event': 'start', 'id': ident, 'pid': os.getpid (),
+             'kind': kind, 'name': name, 'command': [str (c) for c in command],
+             'start': time.time (), 'datasets': dsinfo}
+    eventTrace (event)
+    return event
+
+
+def traceEnd (token, returncode=0, **extra):
+    """Finish tracing a timed operation.
+
+:arg token: the return value of :func:`traceStart`
+:arg int returncode: the outcome of the operation; 0 means success
+:arg extra: extra items to add to the end event
+:returns: :const:`None`
+
+If *token* is not :const:`None`, :data:`eventTrace` is called with an
+"end" event; see :func:`traceStart`. (If :data:`eventTrace` has since
+been set to :const:`None`, nothing happens.)
+"""
+    if token is None or eventTrace is None:
+        return
+
+    end = time.time ()
+    event = dict (token)
+    event['event'] = 'end'
+    event['end'] = end
+    event['duration'] = end - token['start']
+    event['returncode'] = returncode
+    event['datasets'] = dsinfo = {}
+
+    for role, info in token['datasets'].iteritems ():
+        info = dict (info)
+        info['bytesAfter'] = _datasetBytes (info['path'])
+        dsinfo[role] = info
+
+    event.update (extra)
+    eventTrace (event)
+
+
+class JSONTraceWriter (object):
+    """:synopsis: write trace events as lines of JSON
+:arg dest: the file to write to, or the name of a file to append to
+:type dest: filelike or str
+
+Instances are callables suitable for :data:`eventTrace` that write
+each event as a line of JSON and flush the output. They are safe to
+use from multiple threads, and if the same file is opened in append
+mode by several processes, their lines will not be garbled. See
+:func:`jsonTrace`.
+"""
+
+    def __init__ (self, dest):
+        if isinstance (dest, basestring):
+            self.stream = open (dest, 'a')
+            self._ownstream = True
+        else:
+            self.stream = dest
+            self._ownstream = False
+
+        try:
+            import json
+        except ImportError:
+            import simplejson as json
+        self._dumps = json.dumps
+        self._lock = threading.Lock ()
+
+
+    def __call__ (self, event):
+        line = self._dumps (event, sort_keys=True) + '\n'
+
+        self._lock.acquire ()
+        try:
+            self.stream.write (line)
+            self.stream.flush ()
+        finally:
+            self._lock.release ()
+
+
+    def close (self):
+        """Close the output file if it was opened by this object.
+
+:returns: :const:`None`
+"""
+        if self._ownstream:
+            self.stream.close ()
+
+
+def jsonTrace (dest):
+    """Log structured trace events as lines of JSON.
+
+:arg dest: the file to write to, or the name of a file to append to
+:type dest: filelike or str
+:returns: the :class:`JSONTraceWriter` that was installed
+
+Sets :data:`eventTrace` to a :class:`JSONTraceWriter` writing to
+*dest*, so that every task launched by :mod:`mirexec` and every
+dataset copy, rename, deletion, and lightweight copy is logged with
+its timings, outcome, and dataset sizes. Use :func:`traceReport` to
+summarize the log::
+
+  miriad.jsonTrace ('pipeline.trace')
+  ... # run the pipeline
+  miriad.traceReport ('pipeline.trace')
+
+This is independent of :data:`launchTrace` and :func:`basicTrace`.
+"""
+    global eventTrace
+    eventTrace = JSONTraceWriter (dest)
+    return eventTrace
+
+
+def _mergedLength (intervals):
+    total = 0.
+    curstart = curend = None
+
+    for start, end in sorted (intervals):
+        if curend is None or start > curend:
+            if curend is not None:
+                total += curend - curstart
+            curstart, curend = start, end
+        else:
+            curend = max (curend, end)
+
+    if curend is not None:
+        total += curend - curstart
+    return total
+
+
+def traceReport (source, stream=None):
+    """Summarize where the time went in a log of trace events.
+
+:arg source: the events
+:type source: the name of a file written by :class:`JSONTraceWriter`,
+  or an iterable of event :class:`dict` objects
+:arg filelike stream: where to print the report; defaults to
+  :data:`sys.stdout`
+:returns: a :class:`dict` mapping ``(kind, name)`` to a :class:`dict`
+  with the number of operations (*count*), the number that failed
+  (*failures*), their total and longest durations (*total*, *max*),
+  the total size of the datasets they started with (*bytesIn*), and
+  the total growth of their datasets (*bytesOut*)
+
+The operations are grouped by kind and name and listed in order of
+decreasing total duration, with each group's share of the overall
+wall-clock time from the first start to the last end. Because
+operations may overlap, the shares may add up to more than 100%.
+The last line gives the time not covered by any traced operation,
+which is typically spent in the Python code driving the pipeline.
+"""
+    if stream is None:
+        stream = sys.stdout
+
+    if isinstance (source, basestring):
+        try:
+            import json
+        except ImportError:
+            import simplejson as json
+        events = (json.loads (l) for l in open (source) if len (l.strip ()))
+    else:
+        events = source
+
+    groups = {}
+    intervals = []
+
+    for ev in events:
+        if ev.get ('event') != 'end':
+            continue
+
+        key = (ev['kind'], ev['name'])
+        g = groups.get (key)
+        if g is None:
+            g = groups[key] = dict (count=0, failures=0, total=0., max=0.,
+                                    bytesIn=0, bytesOut=0)
+
+        g['count'] += 1
+        if ev.get ('returncode') != 0:
+            g['failures'] += 1
+        g['total'] += ev['duration']
+        g['max'] = max (g['max'], ev['duration'])
+
+        for info in ev.get ('datasets', {}).itervalues ():
+            before = info.get ('bytesBefore') or 0
+            after = info.get ('bytesAfter') or 0
+            g['bytesIn'] += before
+            g['bytesOut'] += max (after - before, 0)
+
+        intervals.append ((ev['start'], ev['end']))
+
+    if not len (intervals):
+        print >>stream, 'No completed operations were traced.'
+        return groups
+
+    wall = max (i[1] for i in intervals) - min (i[0] for i in intervals)
+    untraced = wall - _mergedLength (intervals)
+    pct = lambda t: 100. * t / max (wall, 1e-9)
+
+    print >>stream, '%-8s %-16s %6s %5s %10s %6s %10s %10s %10s' % \
+        ('kind', 'name', 'count', 'fail', 'total (s)', '%', 'max (s)',
+         'in (MB)', 'out (MB)')
+
+    for key in sorted (groups.iterkeys (), key=lambda k: groups[k]['total'],
+                       reverse=True):
+        g = groups[key]
+        print >>stream, '%-8s %-16s %6d %5d %10.2f %6.1f %10.2f %10.1f %10.1f' % \
+            (key[0], key[1], g['count'], g['failures'], g['total'],
+             pct (g['total']), g['max'], g['bytesIn'] / 1048576.,
+             g['bytesOut'] / 1048576.)
+
+    print >>stream, '%-38s %10.2f %6.1f' % ('(untraced)', untraced, pct (untraced))
+    print >>stream, '%-38s %10.2f %6.1f' % ('(wall clock)', wall, 100.)
+    return groups
+
+__all__ += ['traceStart', 'traceEnd', 'JSONTraceWriter',
+            'jsonTrace', 'traceReport']
+
+
 # Fundamental MIRIAD data set object.
 
 class Data (object):
@@ -202,11 +507,20 @@ called with a "[rename]" operation.
         self.checkExists ()
         dest = str (dest)
 
-        trace (['[rename]', 'from=%s' % self, 'to=%s' % dest])
+        cmd = ['[rename]', 'from=%s' % self, 'to=%s' % dest]
+        trace (cmd)
+        tok = traceStart ('data', 'rename', cmd, {'from': self.base})
 
-        os.rename (self.base, dest)
-        self.base = dest
+        try:
+            os.rename (self.base, dest)
+        except Exception, e:
+            traceEnd (tok, 1, error=str (e))
+            raise
 
+        self.base = dest
+        if tok is not None:
+            tok['datasets']['from']['path'] = dest
+        traceEnd (tok)
         return self
 
 
@@ -228,15 +542,22 @@ through the copy.
         self.checkExists ()
         dest = str (dest)
 
-        trace (['[copy]', 'from=%s' % self, 'to=%s' % dest])
+        cmd = ['[copy]', 'from=%s' % self, 'to=%s' % dest]
+        trace (cmd)
+        tok = traceStart ('data', 'copy', cmd, {'from': self.base, 'to': dest})
 
         from shutil import copy
 
-        os.mkdir (dest)
+        try:
+            os.mkdir (dest)
 
-        for f in os.listdir (self.base):
-            copy (self.path (f), os.path.join (dest, f))
+            for f in os.listdir (self.base):
+                copy (self.path (f), os.path.join (dest, f))
+        except Exception, e:
+            traceEnd (tok, 1, error=str (e))
+            raise
 
+        traceEnd (tok)
         return self
 
 
@@ -255,16 +576,22 @@ a symbolic link, only the link is deleted.
         if not self.exists:
             return self
 
-        trace (['[delete]', 'in=%s' % self])
-
-        if os.path.islink (self.base):
-            os.remove (self.base)
-            return self
-
-        for e in os.listdir (self.base):
-            os.remove (self.path (e))
-        os.rmdir (self.base)
+        cmd = ['[delete]', 'in=%s' % self]
+        trace (cmd)
+        tok = traceStart ('data', 'delete', cmd, {'in': self.base})
 
+        try:
+            if os.path.islink (self.base):
+                os.remove (self.base)
+            else:
+                for name in os.listdir (self.base):
+                    os.remove (self.path (name))
+                os.rmdir (self.base)
+        except Exception, e:
+            traceEnd (tok, 1, error=str (e))
+            raise
+
+        traceEnd (tok)
         return self
 
     def apply (self, task, **params):
@@ -719,6 +1046,8 @@ both *self* and *dest* are relative and *forceabs* is :const:`False`.
             srcrelpath = os.path.relpath (self.base, dest.base)
 
         dest.delete ()
+        tok = traceStart ('data', 'lwcp', ['[lwcp]', 'vis=%s' % self, 'out=%s' % dest],
+                          {'vis': self.base, 'out': dest.base})
 
         try:
             success = False
@@ -739,6 +1068,7 @@ both *self* and *dest* are relative and *forceabs* is :const:`False`.
         finally:
             if not success:
                 dest.delete ()
+            traceEnd (tok, int (not success))
 
 
 __all__ += ['VisData']
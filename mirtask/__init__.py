@@ -17,10 +17,64 @@
 # You should have received a copy of the GNU General Public License
 # along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
 
+import os, sys
 import numpy as N
-from mirtask import _miriad_c, _miriad_f, util
+from mirtask import _miriad_c
 from mirtask._miriad_c import MiriadError
 
+
+class _LazyModule (object):
+    """A stand-in for a module that imports it when one of its
+    attributes is first used. The f2py-generated _miriad_f_*
+    modules are large and link the whole MIRIAD Fortran library, and
+    many programs never need them, so we don't want to pay for loading
+    them up front.
+    Once the real module is loaded, attributes fetched through the
+    proxy are cached on it."""
+
+    def __init__ (self, name):
+        self.__dict__['_lazyName'] = name
+        self.__dict__['_lazyModule'] = None
+
+    def _lazyLoad (self):
+        mod = self.__dict__['_lazyModule']
+        if mod is None:
+            name = self.__dict__['_lazyName']
+            __import__ (name)
+            mod = sys.modules[name]
+            self.__dict__['_lazyModule'] = mod
+        return mod
+
+    def __getattr__ (self, name):
+        val = getattr (self._lazyLoad (), name)
+        self.__dict__[name] = val
+        return val
+
+    def __setattr__ (self, name, value):
+        setattr (self._lazyLoad (), name, value)
+        self.__dict__[name] = value
+
+    def __repr__ (self):
+        if self.__dict__['_lazyModule'] is None:
+            return '<unloaded module %r>' % self.__dict__['_lazyName']
+        return repr (self.__dict__['_lazyModule'])
+
+
+# These must be set up before any of our submodules are imported, so
+# that their "from mirtask import _miriad_f_uvdat" and so on pick up
+# the proxies rather than importing the real things. When a proxy
+# loads its real module, the import machinery rebinds the attribute
+# of mirtask to it. _miriad_f is the old all-in-one binding, now a
+# Python module that gathers up the split ones, and is kept for the
+# sake of external code that uses it.
+_miriad_f_uvdat = _LazyModule ('mirtask._miriad_f_uvdat')
+_miriad_f_coord = _LazyModule ('mirtask._miriad_f_coord')
+_miriad_f_fit = _LazyModule ('mirtask._miriad_f_fit')
+_miriad_f_grid = _LazyModule ('mirtask._miriad_f_grid')
+_miriad_f = _LazyModule ('mirtask._miriad_f')
+
+from mirtask import util
+
 __all__ = 'util MiriadError'.split ()
 
 
@@ -218,7 +272,7 @@ Note that *args* should not start with an ``argv[0]`` entry.
             args = sys.argv[1:]
 
         prefix = ident + ': '
-        date = util.jdToFull (_miriad_f.todayjul (), 'T')
+        date = util.jdToFull (_miriad_f_coord.todayjul (), 'T')
         _miriad_c.hiswrite (self.tno, prefix + 'Executed on: ' + date)
         _miriad_c.hiswrite (self.tno, prefix + 'Command line inputs follow:')
 
@@ -646,7 +700,164 @@ written to the item.
 __all__ += ['DataSet', 'DataItem']
 
 
+# UV flag buffer formats. MIRIAD itself uses one int per channel; the
+# other formats are converted to and from that in _miriad_c.
+
+FLAGS_INT = 'int'
+FLAGS_BOOL = 'bool'
+FLAGS_PACKED = 'packed'
+
+def flagsBuffer (nchan, flagtype=FLAGS_INT):
+    """Allocate a buffer for UV data flags.
+
+:arg int nchan: the number of channels the buffer must hold
+:arg str flagtype: the buffer format; see below
+:returns: a zeroed ndarray
+
+The UV reading and writing functions accept flags in three formats.
+If *flagtype* is :const:`FLAGS_INT`, the buffer is an array of
+*nchan* 32-bit ints, as used natively by MIRIAD. If it is
+:const:`FLAGS_BOOL`, the buffer is an array of *nchan* bools. If it
+is :const:`FLAGS_PACKED`, the buffer is an array of ``(nchan + 7) //
+8`` uint8 values holding one bit per channel, most significant bit
+first, as with :func:`numpy.packbits` and :func:`numpy.unpackbits`.
+In all cases, a nonzero flag means that the channel is good.
+"""
+    if flagtype == FLAGS_INT:
+        return N.zeros (nchan, dtype=N.intc)
+    if flagtype == FLAGS_BOOL:
+        return N.zeros (nchan, dtype=N.bool)
+    if flagtype == FLAGS_PACKED:
+        return N.zeros ((nchan + 7) // 8, dtype=N.uint8)
+    raise ValueError ('unknown flag buffer type "%s"' % flagtype)
+
+
+def convertFlags (src, dest, n):
+    """Convert UV flags from one buffer format to another.
+
+:arg src: the flags to convert
+:type src: ndarray of int32, bool, or packed uint8
+:arg dest: the buffer to receive the converted flags
+:type dest: ndarray of int32, bool, or packed uint8
+:arg int n: the number of channels to convert
+:returns: *dest*
+
+The formats are described in :func:`flagsBuffer`. The conversion is
+done in C.
+"""
+    _miriad_c.convflags (src, dest, n)
+    return dest
+
+
+def _defaultFlagsLength (data, flags):
+    if flags.dtype == N.uint8:
+        return data.size
+    return flags.size
+
+__all__ += ['FLAGS_INT', 'FLAGS_BOOL', 'FLAGS_PACKED', 'flagsBuffer',
+            'convertFlags']
+
+
+# I/O statistics, kept by _miriad_c.
+
+def enableIoStats (enable=True):
+    """Turn the collection of I/O statistics on or off.
+
+:arg bool enable: whether to collect statistics
+:returns: whether statistics were being collected before the call
+
+Statistics are not collected by default, unless the environment
+variable :envvar:`MIRPY_IOSTATS` is set to a nonempty value when
+:mod:`mirtask` is first imported. Collecting them costs two reads of
+the system clock per call into MIRIAD, which is small compared to the
+cost of the calls themselves, so it is reasonable to leave collection
+on in production. See :func:`ioStats`.
+"""
+    return _miriad_c.iostats_enable (bool (enable))
+
+
+def ioStats ():
+    """Get the I/O statistics collected since the last reset.
+
+:returns: a :class:`dict` mapping entry point names to :class:`dict`
+  objects with items *calls*, the number of calls made, *bytes*, the
+  number of bytes of data they moved, and *nsec*, the total time spent
+  in them in nanoseconds
+
+The entry points are the low-level routines of :mod:`mirtask._miriad_c`
+that move data into and out of MIRIAD. Most are named after the
+MIRIAD routines they call: "hio_read" and "hio_write" (the reads and
+writes of :class:`DataItem`), "rdhd" and "wrhd" (header items),
+"uvread" and "uvwrite" (UV records, counting the visibility data
+only, as the single-precision floats that MIRIAD moves, even for
+:meth:`UVDataSet.lowlevelReadRaw` and :meth:`UVDataSet.writeRaw`), "uvgetvr" (UV variables), "xyread", "xywrite", "xyflgrd", and
+"xyflgwr" (image rows and their flags), and "xyzread" and "xyzwrite"
+(image profiles and subcubes). An entry point is only counted when
+its call into MIRIAD completes without error.
+
+Statistics are only collected after they are enabled with
+:func:`enableIoStats`. They are shared by all threads and all datasets.
+For instance::
+
+  mirtask.enableIoStats ()
+  mirtask.resetIoStats ()
+  ... # do some work
+  for name, st in sorted (mirtask.ioStats ().iteritems ()):
+      if st['calls']:
+          print name, st['calls'], st['bytes'], 1e-9 * st['nsec']
+"""
+    result = {}
+
+    for name, (calls, nbytes, nsec) in _miriad_c.iostats_get ().iteritems ():
+        result[name] = dict (calls=calls, bytes=nbytes, nsec=nsec)
+
+    return result
+
+
+def resetIoStats ():
+    """Reset the I/O statistics to zero.
+
+:returns: :const:`None`
+
+Whether statistics are collected is not changed. See :func:`ioStats`.
+"""
+    _miriad_c.iostats_reset ()
+
+
+if len (os.environ.get ('MIRPY_IOSTATS', '')):
+    enableIoStats ()
+
+__all__ += ['enableIoStats', 'ioStats', 'resetIoStats']
+
+
+# UV variables that uvwrite() itself writes, and so whose values
+# can't be tracked by the output variable cache.
+_uncachedVars = frozenset (('coord', 'time', 'baseline', 'corr', 'wcorr',
+                            'nchan', 'nwide', 'tscale'))
+
+# UV variables that VARCOPY never writes; UVDAT leaves the
+# polarization variables to the caller.
+_varcopySkips = frozenset (('pol', 'npol'))
+
+
+def _countBy (groups, weights, ngroups):
+    # N.bincount (groups, weights, minlength=ngroups), which needs
+    # NumPy 1.6. Old versions of bincount also reject empty input.
+    res = N.zeros (ngroups, dtype=N.double)
+    if groups.size:
+        sums = N.bincount (groups, weights)
+        res[:sums.size] = sums
+    return res
+
+
 class UVDataSet (DataSet):
+    # The last value written to each output variable, as (kind,
+    # value), so that rewriting an unchanged value can be skipped.
+    # Created on demand since UVDatDataSet doesn't call our __init__.
+    _varCache = None
+    # The variables marked for copying with trackVar().
+    _copyVars = None
+
     def __init__ (self, path, mode):
         # Technically, 'old' mode is read-only with regard to the
         # UV data, but you can still write non-UV items.
@@ -689,11 +900,13 @@ class UVDataSet (DataSet):
         """Read a visibility record from the file. This function should
         be avoided in favor of the uvdat routines except for certain
         low-level manipulations. Length defaults to the length of the
-        flags array.
+        flags array, or of the data array if the flags are bit-packed.
+        The flags may be in any of the formats described in
+        :func:`flagsBuffer`.
 
         Returns: the number of items read."""
 
-        if length is None: length = flags.size
+        if length is None: length = _defaultFlagsLength (data, flags)
 
         self._checkOpen ()
         return _miriad_c.uvread (self.tno, preamble, data, flags, length)
@@ -701,21 +914,239 @@ class UVDataSet (DataSet):
     def write (self, preamble, data, flags, length=None):
         """Write a visibility record consisting of the given preamble,
         data, flags, and length. Length defaults to the length of the
-        flags array."""
+        flags array, or of the data array if the flags are bit-packed.
+        The flags may be in any of the formats described in
+        :func:`flagsBuffer`."""
 
-        if length is None: length = flags.size
+        if length is None: length = _defaultFlagsLength (data, flags)
 
         self._checkOpen ()
         _miriad_c.uvwrite (self.tno, preamble, data, flags, length)
 
+    def lowlevelReadRaw (self, preamble, data, flags, length=None):
+        """Read a visibility record without expanding scaled correlations.
+
+:arg preamble: the buffer for the preamble
+:type preamble: double ndarray of 4 or 5 elements
+:arg data: the buffer for the correlation data
+:type data: int16 ndarray
+:arg flags: the buffer for the flags, in one of the formats described
+  in :func:`flagsBuffer`
+:arg int length: the maximum number of channels to read; defaults to
+  half the size of *data*
+:returns: ``(nread, scale)``
+:raises: :exc:`ValueError` if the correlation data are not stored as
+  scaled 16-bit integers ("corr" of type "j"), or if line processing
+  has been set up
+
+This is like :meth:`lowlevelRead`, but returns correlations in the
+form in which they are stored: *data* receives ``2 * nread`` int16
+values holding the real and imaginary parts of each channel, and
+*scale* is the factor by which they must be multiplied to obtain the
+correlations. This halves the memory used by the data compared to
+complex64 buffers and involves no requantization. *nread* is zero at
+the end of the dataset.
+
+It is not faster than :meth:`lowlevelRead`, though: MIRIAD always
+decodes a record to floats as it reads it, so this reads the record
+in that way, discards the floats, and then fetches the stored integers
+and scale factor from the "corr" and "tscale" variables, which is
+slightly more work. The checks for the correlation type and for line
+processing are made before the record is read, except that a channel
+range ending before the last channel of the record can only be
+detected afterward, in which case the record has been consumed when
+the :exc:`ValueError` is raised.
+"""
+        if length is None: length = data.size // 2
+
+        self._checkOpen ()
+        return _miriad_c.uvread_raw (self.tno, preamble, data, flags, length)
+
+    def writeRaw (self, preamble, data, flags, scale, length=None):
+        """Write a visibility record of scaled 16-bit correlations.
+
+:arg preamble: the preamble
+:type preamble: double ndarray of 4 or 5 elements
+:arg data: the correlations as interleaved real and imaginary parts
+:type data: int16 ndarray
+:arg flags: the flags, in one of the formats described in
+  :func:`flagsBuffer`
+:arg float scale: the scale factor of the correlations
+:arg int length: the number of channels to write; defaults to half
+  the size of *data*
+:returns: *self*
+:raises: :exc:`ValueError` if the peak magnitude of *data* is neither
+  32767 nor zero
+
+This is the inverse of :meth:`lowlevelReadRaw`. The dataset's
+correlation type should have been set to "j" with
+:meth:`setCorrelationType`. MIRIAD always picks the stored scale
+factor itself, from the peak magnitude of the data, and requantizes
+the data to it. The integers are only stored unchanged, and *scale*
+only stored as given (to within float rounding), if their peak
+magnitude is exactly 32767, which is the case for all nonzero records
+read from a MIRIAD dataset. Other data, including any containing
+-32768, would be rescaled with a loss of precision, so they are
+refused. Records that are entirely zero are also accepted.
+"""
+        if length is None: length = data.size // 2
+
+        self._checkOpen ()
+        _miriad_c.uvwrite_raw (self.tno, preamble, data, flags, scale, length)
+        return self
+
     def rewriteFlags (self, flags):
         """Rewrite the channel flagging data for the current
-        visibility record. 'flags' should be a 1D integer ndarray of the
-        same length and dtype returned by a uvread call."""
+        visibility record. 'flags' should be a 1D ndarray in one of the
+        formats described in :func:`flagsBuffer`, holding at least as
+        many channels as were returned by the last uvread call."""
 
         self._checkOpen ()
         _miriad_c.uvflgwr (self.tno, flags)
 
+    def flagStatistics (self, groupby=('baseline', 'chan')):
+        """Tabulate how much of the data in this dataset are flagged.
+
+:arg groupby: how to group the flag counts; a sequence of any of
+  "baseline", "pol", and "chan"
+:returns: ``(labels, ngood, ntotal)``; see below
+:raises: :exc:`ValueError` if *groupby* contains an unknown key
+
+This computes flag statistics much more cheaply than reading the
+dataset with :meth:`lowlevelRead` or :mod:`mirtask.uvdat`. The
+visibility data are never decoded: the per-record metadata are
+obtained by scanning through the variables of each record, and the
+flags are read in bulk directly from the bit-packed "flags" item. The
+dataset is rewound before and after the scan. Only the raw flags of
+the spectral channels are considered; no UV data selection, line
+processing, or calibration is applied.
+
+*ngood* and *ntotal* are int64 arrays giving the number of unflagged
+channels and the total number of channels in each group. Their axes
+correspond to the entries in *groupby*, in order. *labels* is a list
+with one array for each of the non-"chan" entries in *groupby*, giving
+the sorted values of the grouping variable indexing the corresponding
+axis: MIRIAD-encoded baseline numbers for "baseline" (see
+:func:`mirtask.util.decodeBaseline`) and polarization codes for
+"pol". The "chan" axis is indexed by zero-based channel number and is
+as long as the largest record. For example, to get the flagged
+fraction of each channel of each baseline::
+
+  labels, ngood, ntotal = handle.flagStatistics ()
+  fflagged = 1. - ngood / N.maximum (ntotal, 1.)
+"""
+        groupby = tuple (groupby)
+        for key in groupby:
+            if key not in ('baseline', 'pol', 'chan'):
+                raise ValueError ('unknown flag statistics grouping "%s"' % key)
+
+        self._checkOpen ()
+
+        # Metadata-only scan. The "corr" variable is written in every
+        # record, so each successful scan advances by one record
+        # without the correlation data being decoded.
+
+        bls, pols, nchans = [], [], []
+        self.rewind ()
+        try:
+            while self.scanUntilChange ('corr'):
+                bls.append (self.getScalar ('baseline', 0.))
+                pols.append (self.getScalar ('pol', 1))
+                nchans.append (self.getScalar ('nchan', 0))
+        finally:
+            self.rewind ()
+
+        nchans = N.asarray (nchans, dtype=N.int64)
+        ntot = nchans.sum ()
+        starts = N.cumsum (nchans) - nchans
+
+        # Bulk read of the flags. The mask format stores 31 flags in the
+        # low bits of each int, after a one-int item header.
+
+        if not self.hasItem ('flags'):
+            bits = N.ones (ntot, dtype=N.bool)
+        else:
+            nwords = (ntot + 30) // 31
+            bits = N.empty (nwords * 31, dtype=N.bool)
+            shifts = N.arange (31, dtype=N.int32)
+            item = self.getItem ('flags', 'r')
+            chunk = 65536
+
+            try:
+                for ofs in xrange (0, nwords, chunk):
+                    n = min (chunk, nwords - ofs)
+                    words = item.read (4 * (1 + ofs), N.int32, n)
+                    bits[ofs*31:(ofs+n)*31] = ((words[:,None] >> shifts) & 1).ravel ()
+            finally:
+                item.close ()
+
+            bits = bits[:ntot]
+
+        # Group the records.
+
+        labels = []
+        recgroup = N.zeros (nchans.size, dtype=N.int64)
+        shape = []
+
+        for key in groupby:
+            if key == 'chan':
+                continue
+            vals = N.asarray (bls if key == 'baseline' else pols)
+            # N.unique's return_inverse needs NumPy 1.3.
+            uniq = N.unique (vals)
+            inv = N.searchsorted (uniq, vals)
+            labels.append (uniq)
+            recgroup = recgroup * uniq.size + inv
+            shape.append (uniq.size)
+
+        ngroups = int (N.prod (shape))
+
+        if 'chan' not in groupby:
+            ok = nchans > 0
+            recgood = N.add.reduceat (bits, starts[ok], dtype=N.int64) if ok.any () \
+                else N.zeros (0, dtype=N.int64)
+            ngood = _countBy (recgroup[ok], recgood, ngroups)
+            ntotal = _countBy (recgroup, nchans, ngroups)
+            return (labels, ngood.astype (N.int64).reshape (shape),
+                    ntotal.astype (N.int64).reshape (shape))
+
+        maxchan = int (nchans.max ()) if nchans.size else 0
+        ngood = N.zeros ((ngroups, maxchan), dtype=N.int64)
+        ntotal = N.zeros ((ngroups, maxchan), dtype=N.int64)
+
+        # Records usually all have the same number of channels, in which
+        # case the flags can be viewed as a 2D array without copying.
+
+        for n in N.unique (nchans):
+            if n == 0:
+                continue
+
+            sel = N.nonzero (nchans == n)[0]
+            if sel.size == nchans.size:
+                block = bits.reshape ((-1, n))
+            else:
+                block = bits[starts[sel][:,None] + N.arange (n)]
+
+            groups = recgroup[sel]
+            order = N.argsort (groups, kind='mergesort')
+            groups = groups[order]
+            edges = N.nonzero (N.diff (groups))[0] + 1
+            firsts = N.concatenate (([0], edges))
+
+            ngood[groups[firsts],:n] += N.add.reduceat (block[order], firsts,
+                                                        axis=0, dtype=N.int64)
+            ntotal[groups[firsts],:n] += N.diff (N.concatenate ((firsts, [groups.size])))[:,None]
+
+        # Put the channel axis where it was requested.
+
+        shape.append (maxchan)
+        ngood = ngood.reshape (shape)
+        ntotal = ntotal.reshape (shape)
+        chanax = groupby.index ('chan')
+        perm = range (len (shape) - 1)
+        perm.insert (chanax, len (shape) - 1)
+        return labels, ngood.transpose (perm), ntotal.transpose (perm)
+
 
     # UV variables
 
@@ -1040,6 +1471,9 @@ no checking is performed.
         self._checkOpen ()
         _miriad_c.uvcopyvr (self.tno, output.tno)
 
+        if self._copyVars is not None:
+            output._forgetVars (self._copyVars)
+
     def updated (self):
         """Return true if any user-specified 'important variables' have
         been updated in the last chunk of data read."""
@@ -1053,7 +1487,7 @@ no checking is performed.
         'wide', or 'velocity'. Maps to Miriad's varinit() call."""
 
         self._checkOpen ()
-        _miriad_f.varinit (self.tno, linetype)
+        _miriad_f_uvdat.varinit (self.tno, linetype)
 
     def initVarsAsOutput (self, input, linetype):
         """Initialize this dataset as the output file for the UV
@@ -1061,14 +1495,15 @@ no checking is performed.
         or 'velocity'. Maps to Miriad's varonit() call."""
 
         self._checkOpen ()
-        _miriad_f.varonit (input.tno, self.tno, linetype)
+        _miriad_f_uvdat.varonit (input.tno, self.tno, linetype)
 
     def copyLineVars (self, output):
         """Copy UV variables to the output dataset that describe the
         current line in the input set."""
 
         self._checkOpen ()
-        _miriad_f.varcopy (self.tno, output.tno)
+        _miriad_f_uvdat.varcopy (self.tno, output.tno)
+        output._forgetVars (None)
 
     def makeVarTracker (self):
         """Create a UVVarTracker object, which can be used to track
@@ -1170,6 +1605,11 @@ no checking is performed.
         self._checkOpen ()
         _miriad_c.uvtrack (self.tno, varname, switches)
 
+        if copy:
+            if self._copyVars is None:
+                self._copyVars = set ()
+            self._copyVars.add (varname)
+
     def scanUntilChange (self, varname):
         """Scan through the UV data until the given variable changes. Reads
         to the end of the record in which the variable changes. Returns False
@@ -1178,50 +1618,136 @@ no checking is performed.
         self._checkOpen ()
         return _miriad_c.uvscan (self.tno, varname) == 0
 
-    def writeVarInt (self, name, val):
-        """Write an integer UV variable. val can either be a single value or
-        an ndarray for array variables."""
+    def _forgetVars (self, names):
+        """Drop entries from the output variable cache after the
+        variables may have been written behind its back. If names is
+        None, drop everything that VARCOPY might have written."""
+
+        if self._varCache is None:
+            return
 
+        if names is None:
+            self._varCache = dict ((k, v) for k, v in self._varCache.iteritems ()
+                                   if k in _varcopySkips)
+        else:
+            for name in names:
+                self._varCache.pop (name, None)
+
+    def _putVar (self, name, kind, val, conv, dtype, putter):
         self._checkOpen ()
 
-        if not isinstance (val, N.ndarray):
-            v2 = N.ndarray (1, dtype=N.int32)
-            v2[0] = int (val)
-            val = v2
+        cache = self._varCache
+        if cache is None:
+            cache = self._varCache = {}
+
+        isarray = isinstance (val, N.ndarray)
+        if not isarray:
+            val = conv (val)
+
+        old = cache.get (name)
+        if old is not None and old[0] == kind:
+            oldval = old[1]
+            if isarray:
+                if isinstance (oldval, N.ndarray) and oldval.shape == val.shape \
+                        and oldval.dtype == val.dtype and (oldval == val).all ():
+                    return
+            elif not isinstance (oldval, N.ndarray) and oldval == val:
+                return
+
+        if isarray:
+            buf = val
+            val = val.copy ()
+        elif dtype is None:
+            buf = val
+        else:
+            buf = N.empty (1, dtype=dtype)
+            buf[0] = val
 
-        _miriad_c.uvputvri (self.tno, name, val)
+        putter (self.tno, name, buf)
 
-    def writeVarFloat (self, name, val):
-        """Write an float UV variable. val can either be a single value or
-        an ndarray for array variables."""
+        if name not in _uncachedVars:
+            cache[name] = (kind, val)
 
-        self._checkOpen ()
+    def writeVarInt (self, name, val):
+        """Write an integer UV variable. val can either be a single value or
+        an ndarray for array variables. Nothing is done if val is the
+        same as the last value written to the variable through this
+        object."""
+
+        self._putVar (name, 'i', val, int, N.int32, _miriad_c.uvputvri)
 
-        if not isinstance (val, N.ndarray):
-            v2 = N.ndarray (1, dtype=N.float32)
-            v2[0] = float (val)
-            val = v2
+    def writeVarFloat (self, name, val):
+        """Write an float UV variable. val can either be a single value or
+        an ndarray for array variables. Nothing is done if val is the
+        same as the last value written to the variable through this
+        object."""
 
-        _miriad_c.uvputvrr (self.tno, name, val)
+        self._putVar (name, 'r', val, float, N.float32, _miriad_c.uvputvrr)
 
     def writeVarDouble (self, name, val):
         """Write a double UV variable. val can either be a single value or
-        an ndarray for array variables."""
+        an ndarray for array variables. Nothing is done if val is the
+        same as the last value written to the variable through this
+        object."""
 
-        self._checkOpen ()
+        self._putVar (name, 'd', val, float, N.float64, _miriad_c.uvputvrd)
 
-        if not isinstance (val, N.ndarray):
-            v2 = N.ndarray (1, dtype=N.float64)
-            v2[0] = float (val)
-            val = v2
+    def writeVarString (self, name, val):
+        """Write a string UV variable. val will be stringified. Nothing
+        is done if val is the same as the last value written to the
+        variable through this object."""
 
-        _miriad_c.uvputvrd (self.tno, name, val)
+        self._putVar (name, 'a', val, str, None, _miriad_c.uvputvra)
 
-    def writeVarString (self, name, val):
-        """Write a string UV variable. val will be stringified."""
+    def writeVars (self, vars):
+        """Write several UV variables.
 
-        self._checkOpen ()
-        _miriad_c.uvputvra (self.tno, name, str (val))
+:arg vars: the variables to write
+:type vars: dict mapping variable names to values
+:returns: *self*
+:raises: :exc:`ValueError` if the type of a value can't be mapped to
+  a MIRIAD variable type
+
+The variable types are inferred from the values. Strings are written
+with :meth:`writeVarString`; Python ints and bools and integer
+ndarrays and Numpy scalars with :meth:`writeVarInt`; Python floats
+and float64 ndarrays and scalars with :meth:`writeVarDouble`; and
+float32 ndarrays and scalars with :meth:`writeVarFloat`. Use the
+latter to write "real" variables such as "inttime". As with the
+individual methods, variables whose values are unchanged are not
+rewritten.
+"""
+        for name, val in vars.iteritems ():
+            if isinstance (val, basestring):
+                self.writeVarString (name, val)
+                continue
+
+            if isinstance (val, (N.ndarray, N.generic)):
+                dt = val.dtype
+            elif isinstance (val, (bool, int, long)):
+                dt = N.dtype (N.int32)
+            elif isinstance (val, float):
+                dt = N.dtype (N.float64)
+            else:
+                raise ValueError ('cannot write value %r of UV variable "%s"'
+                                  % (val, name))
+
+            if isinstance (val, N.generic):
+                val = val.item ()
+
+            if dt.kind in 'biu':
+                if isinstance (val, N.ndarray) and dt != N.int32:
+                    val = val.astype (N.int32)
+                self.writeVarInt (name, val)
+            elif dt == N.float32:
+                self.writeVarFloat (name, val)
+            elif dt == N.float64:
+                self.writeVarDouble (name, val)
+            else:
+                raise ValueError ('cannot write value %r of UV variable "%s"'
+                                  % (val, name))
+
+        return self
 
 
 class UVVarTracker (object):
@@ -55,6 +55,156 @@ check_iostat (int iostat)
 #define CHECK_IOSTAT(iostat) if (check_iostat (iostat)) return NULL
 
 
+/* I/O statistics. When enabled, the calls into MIRIAD that move data
+ * are counted and timed, per entry point, so that the time spent in
+ * MIRIAD's I/O can be separated from that spent in Python. Disabled,
+ * they cost one test of a flag per call; enabled, two reads of the
+ * clock. All updates happen with the GIL held, so no locking is
+ * needed. */
+
+#include <time.h>
+#include <sys/time.h>
+
+enum {
+    IOS_HIO_READ,
+    IOS_HIO_WRITE,
+    IOS_RDHD,
+    IOS_WRHD,
+    IOS_UVREAD,
+    IOS_UVWRITE,
+    IOS_UVGETVR,
+    IOS_XYREAD,
+    IOS_XYWRITE,
+    IOS_XYFLGRD,
+    IOS_XYFLGWR,
+    IOS_XYZREAD,
+    IOS_XYZWRITE,
+    IOS_NUM
+};
+
+static const char *iostat_names[IOS_NUM] = {
+    "hio_read", "hio_write", "rdhd", "wrhd", "uvread", "uvwrite",
+    "uvgetvr", "xyread", "xywrite", "xyflgrd", "xyflgwr", "xyzread",
+    "xyzwrite"
+};
+
+typedef struct {
+    unsigned PY_LONG_LONG calls;
+    unsigned PY_LONG_LONG bytes;
+    unsigned PY_LONG_LONG nsec;
+} iostat_counter;
+
+static iostat_counter iostats[IOS_NUM];
+static int iostats_enabled = 0;
+
+static unsigned PY_LONG_LONG
+iostat_now (void)
+{
+#if HAVE_CLOCK_GETTIME && defined(CLOCK_MONOTONIC)
+    struct timespec ts;
+
+    clock_gettime (CLOCK_MONOTONIC, &ts);
+    return (unsigned PY_LONG_LONG) ts.tv_sec * 1000000000 + ts.tv_nsec;
+#else
+    struct timeval tv;
+
+    gettimeofday (&tv, NULL);
+    return (unsigned PY_LONG_LONG) tv.tv_sec * 1000000000 + tv.tv_usec * 1000;
+#endif
+}
+
+static void
+iostat_add (int which, long nbytes, unsigned PY_LONG_LONG t0)
+{
+    iostat_counter *c = &iostats[which];
+
+    c->nsec += iostat_now () - t0;
+    c->calls++;
+    if (nbytes > 0)
+	c->bytes += nbytes;
+}
+
+/* Make a MIRIAD call, recording it in counter *which* as moving
+ * *nbytes* bytes; *nbytes* is evaluated after the call, so it may
+ * depend on the call's outputs. If the call invokes the bug handler,
+ * it is not recorded. */
+
+#define IOSTAT_CALL(which, nbytes, call) do {			\
+	if (iostats_enabled) {					\
+	    unsigned PY_LONG_LONG _ios_t0 = iostat_now ();	\
+	    call;						\
+	    iostat_add (which, nbytes, _ios_t0);		\
+	} else {						\
+	    call;						\
+	}							\
+    } while (0)
+
+/* The same, for calls that report errors through an iostat variable
+ * rather than the bug handler: the call is only recorded if *iostat*
+ * is zero after it. */
+
+#define IOSTAT_CALL_CHECKED(which, nbytes, iostat, call) do {	\
+	if (iostats_enabled) {					\
+	    unsigned PY_LONG_LONG _ios_t0 = iostat_now ();	\
+	    call;						\
+	    if ((iostat) == 0)					\
+		iostat_add (which, nbytes, _ios_t0);		\
+	} else {						\
+	    call;						\
+	}							\
+    } while (0)
+
+
+/* The size of a value returned by an accessor, for the entry points
+ * whose MIRIAD calls are scattered over many code paths and are
+ * timed as a whole. */
+
+static long
+iostat_value_nbytes (PyObject *value)
+{
+    if (value == NULL)
+	return 0;
+    if (PyString_Check (value))
+	return (long) PyString_GET_SIZE (value);
+    if (PyArray_Check (value))
+	return (long) PyArray_NBYTES (value);
+    if (PyArray_IsScalar (value, Generic)) {
+	PyArray_Descr *descr = PyArray_DescrFromScalar (value);
+	long n = descr->elsize;
+
+	Py_DECREF (descr);
+	return n;
+    }
+    return 0;
+}
+
+
+static PyObject *
+iostat_wrap (int which, PyObject *(*func) (PyObject *, PyObject *),
+	     PyObject *self, PyObject *args, int valuearg)
+{
+    unsigned PY_LONG_LONG t0;
+    PyObject *result;
+
+    if (!iostats_enabled)
+	return func (self, args);
+
+    t0 = iostat_now ();
+    result = func (self, args);
+
+    if (result != NULL) {
+	PyObject *value = result;
+
+	if (valuearg >= 0 && valuearg < PyTuple_GET_SIZE (args))
+	    value = PyTuple_GET_ITEM (args, valuearg);
+
+	iostat_add (which, iostat_value_nbytes (value), t0);
+    }
+
+    return result;
+}
+
+
 /* Array-checking utilities */
 
 static int
@@ -153,6 +303,173 @@ check_complexf_array (PyObject *array, char *argname)
 }
 
 
+/* Flag-array utilities. MIRIAD's UV routines exchange flags as one int
+ * per channel, but callers may also supply boolean arrays (one byte
+ * per channel) or uint8 arrays of bits packed most-significant-bit
+ * first, as produced by numpy.packbits. These are converted through
+ * a scratch buffer of ints that is grown as needed and never freed. */
+
+#define FLAGS_INT 0
+#define FLAGS_BOOL 1
+#define FLAGS_PACKED 2
+
+static int *flag_scratch = NULL;
+static size_t flag_scratch_size = 0;
+
+static int
+check_flags_array (PyObject *array, char *argname, int n)
+{
+    int kind, needed;
+
+    if (!PyArray_ISCONTIGUOUS (array)) {
+	PyErr_Format (PyExc_ValueError, "%s must be a contiguous ndarray", argname);
+	return -1;
+    }
+
+    if (PyArray_ISBOOL (array))
+	kind = FLAGS_BOOL;
+    else if (PyArray_TYPE (array) == NPY_UINT8)
+	kind = FLAGS_PACKED;
+    else if (check_int_array (array, argname))
+	return -1;
+    else
+	kind = FLAGS_INT;
+
+    if (n < 0)
+	return kind;
+
+    needed = (kind == FLAGS_PACKED) ? (n + 7) / 8 : n;
+
+    if (PyArray_SIZE (array) < needed) {
+	PyErr_Format (PyExc_ValueError, "%s array must have at least %d elements",
+		      argname, needed);
+	return -1;
+    }
+
+    return kind;
+}
+
+
+static void *
+grow_scratch (void *buf, size_t *cursize, size_t needed)
+{
+    void *newbuf;
+
+    if (needed <= *cursize)
+	return buf;
+
+    newbuf = PyMem_Realloc (buf, needed);
+    if (newbuf == NULL) {
+	PyErr_NoMemory ();
+	return NULL;
+    }
+
+    *cursize = needed;
+    return newbuf;
+}
+
+
+static int *
+get_flag_scratch (int n)
+{
+    int *newbuf;
+
+    newbuf = grow_scratch (flag_scratch, &flag_scratch_size, n * sizeof (int));
+    if (newbuf != NULL)
+	flag_scratch = newbuf;
+    return newbuf;
+}
+
+
+static void
+flags_from_int (const int *src, PyObject *dest, int kind, int n)
+{
+    int i;
+
+    if (kind == FLAGS_INT) {
+	memcpy (PyArray_DATA (dest), src, n * sizeof (int));
+    } else if (kind == FLAGS_BOOL) {
+	npy_bool *d = (npy_bool *) PyArray_DATA (dest);
+
+	for (i = 0; i < n; i++)
+	    d[i] = (src[i] != 0);
+    } else {
+	npy_uint8 *d = (npy_uint8 *) PyArray_DATA (dest);
+
+	memset (d, 0, (n + 7) / 8);
+	for (i = 0; i < n; i++)
+	    if (src[i])
+		d[i >> 3] |= 0x80 >> (i & 7);
+    }
+}
+
+
+static void
+flags_to_int (PyObject *src, int kind, int *dest, int n)
+{
+    int i;
+
+    if (kind == FLAGS_INT) {
+	memcpy (dest, PyArray_DATA (src), n * sizeof (int));
+    } else if (kind == FLAGS_BOOL) {
+	npy_bool *s = (npy_bool *) PyArray_DATA (src);
+
+	for (i = 0; i < n; i++)
+	    dest[i] = (s[i] != 0);
+    } else {
+	npy_uint8 *s = (npy_uint8 *) PyArray_DATA (src);
+
+	for (i = 0; i < n; i++)
+	    dest[i] = (s[i >> 3] >> (7 - (i & 7))) & 1;
+    }
+}
+
+
+/* Get an int flags buffer for passing into MIRIAD: the array itself if
+ * it is of the native type, otherwise the scratch buffer, optionally
+ * filled with the converted contents of the array. */
+
+static int *
+flags_as_int (PyObject *array, int kind, int n, int convert)
+{
+    int *buf;
+
+    if (kind == FLAGS_INT)
+	return (int *) PyArray_DATA (array);
+
+    if ((buf = get_flag_scratch (n)) == NULL)
+	return NULL;
+
+    if (convert)
+	flags_to_int (array, kind, buf, n);
+
+    return buf;
+}
+
+
+static PyObject *
+py_convflags (PyObject *self, PyObject *args)
+{
+    int n, skind, dkind, *ibuf;
+    PyObject *src, *dest;
+
+    if (!PyArg_ParseTuple (args, "O!O!i", &PyArray_Type, &src,
+			   &PyArray_Type, &dest, &n))
+	return NULL;
+
+    if ((skind = check_flags_array (src, "src", n)) < 0)
+	return NULL;
+
+    if ((dkind = check_flags_array (dest, "dest", n)) < 0)
+	return NULL;
+
+    if ((ibuf = flags_as_int (src, skind, n, 1)) == NULL)
+	return NULL;
+
+    flags_from_int (ibuf, dest, dkind, n);
+    Py_RETURN_NONE;
+}
+
 /* hio.c */
 
 static PyObject *
@@ -369,7 +686,9 @@ py_hio_generic (PyObject *self, PyObject *args)
 	return NULL;
     }
 
-    hio_c (ihandle, iswrite, mirtype, PyArray_DATA (buf), offset, nbytes, &iostat);
+    IOSTAT_CALL_CHECKED (iswrite ? IOS_HIO_WRITE : IOS_HIO_READ, nbytes, iostat,
+			 hio_c (ihandle, iswrite, mirtype, PyArray_DATA (buf),
+				offset, nbytes, &iostat));
     CHECK_IOSTAT(iostat);
     Py_RETURN_NONE;
 }
@@ -424,7 +743,7 @@ py_hisclose (PyObject *self, PyObject *args)
 
 
 static PyObject *
-py_wrhd_generic (PyObject *self, PyObject *args)
+wrhd_generic_impl (PyObject *self, PyObject *args)
 {
     int tno, v;
     char *itemname;
@@ -472,9 +791,15 @@ py_wrhd_generic (PyObject *self, PyObject *args)
     Py_RETURN_NONE;
 }
 
+static PyObject *
+py_wrhd_generic (PyObject *self, PyObject *args)
+{
+    return iostat_wrap (IOS_WRHD, wrhd_generic_impl, self, args, 2);
+}
+
 
 static PyObject *
-py_rdhd_generic (PyObject *self, PyObject *args)
+rdhd_generic_impl (PyObject *self, PyObject *args)
 {
     int tno, n, iostat, hdhandle;
     char *itemname;
@@ -562,6 +887,12 @@ py_rdhd_generic (PyObject *self, PyObject *args)
     return result;
 }
 
+static PyObject *
+py_rdhd_generic (PyObject *self, PyObject *args)
+{
+    return iostat_wrap (IOS_RDHD, rdhd_generic_impl, self, args, -1);
+}
+
 
 static PyObject *
 py_hdcopy (PyObject *self, PyObject *args)
@@ -781,7 +1112,8 @@ py_uvgetvra (PyObject *self, PyObject *args)
 	return NULL;
 
     MTS_CHECK_BUG;
-    uvgetvra_c (tno, var, value, BUFSZ);
+    IOSTAT_CALL (IOS_UVGETVR, (long) strlen (value),
+		 uvgetvra_c (tno, var, value, BUFSZ));
 
     return Py_BuildValue ("s", value);
 }
@@ -805,7 +1137,8 @@ py_uvgetvri (PyObject *self, PyObject *args)
 
     dims[0] = n;
     retval = PyArray_SimpleNew (1, dims, NPY_INT);
-    uvgetvri_c (tno, var, PyArray_DATA (retval), n);
+    IOSTAT_CALL (IOS_UVGETVR, (long) PyArray_NBYTES (retval),
+		 uvgetvri_c (tno, var, PyArray_DATA (retval), n));
     return retval;
 }
 
@@ -832,7 +1165,8 @@ py_uvgetvrj (PyObject *self, PyObject *args)
 
     dims[0] = n;
     retval = PyArray_SimpleNew (1, dims, NPY_INT);
-    uvgetvrj_c (tno, var, PyArray_DATA (retval), n);
+    IOSTAT_CALL (IOS_UVGETVR, (long) PyArray_NBYTES (retval),
+		 uvgetvrj_c (tno, var, PyArray_DATA (retval), n));
     return retval;
 }
 
@@ -851,7 +1185,8 @@ py_uvgetvrr (PyObject *self, PyObject *args)
 
     dims[0] = n;
     retval = PyArray_SimpleNew (1, dims, NPY_FLOAT);
-    uvgetvrr_c (tno, var, PyArray_DATA (retval), n);
+    IOSTAT_CALL (IOS_UVGETVR, (long) PyArray_NBYTES (retval),
+		 uvgetvrr_c (tno, var, PyArray_DATA (retval), n));
     return retval;
 }
 
@@ -870,7 +1205,8 @@ py_uvgetvrd (PyObject *self, PyObject *args)
 
     dims[0] = n;
     retval = PyArray_SimpleNew (1, dims, NPY_DOUBLE);
-    uvgetvrd_c (tno, var, PyArray_DATA (retval), n);
+    IOSTAT_CALL (IOS_UVGETVR, (long) PyArray_NBYTES (retval),
+		 uvgetvrd_c (tno, var, PyArray_DATA (retval), n));
     return retval;
 }
 
@@ -889,13 +1225,14 @@ py_uvgetvrc (PyObject *self, PyObject *args)
 
     dims[0] = n;
     retval = PyArray_SimpleNew (1, dims, NPY_CFLOAT);
-    uvgetvrc_c (tno, var, PyArray_DATA (retval), n);
+    IOSTAT_CALL (IOS_UVGETVR, (long) PyArray_NBYTES (retval),
+		 uvgetvrc_c (tno, var, PyArray_DATA (retval), n));
     return retval;
 }
 
 
 static PyObject *
-py_uvrdvr_generic (PyObject *self, PyObject *args)
+uvrdvr_generic_impl (PyObject *self, PyObject *args)
 {
     int tno, length, updated;
     char *var, type;
@@ -954,6 +1291,12 @@ py_uvrdvr_generic (PyObject *self, PyObject *args)
     return result;
 }
 
+static PyObject *
+py_uvrdvr_generic (PyObject *self, PyObject *args)
+{
+    return iostat_wrap (IOS_UVGETVR, uvrdvr_generic_impl, self, args, -1);
+}
+
 
 /* skip uvputvr_c generic versions */
 
@@ -1007,7 +1350,7 @@ py_uvscan (PyObject *self, PyObject *args)
 static PyObject *
 py_uvread (PyObject *self, PyObject *args)
 {
-    int tno, n, size, nread;
+    int tno, n, size, nread, kind, *iflags;
     PyObject *preamble, *data, *flags;
 
     if (!PyArg_ParseTuple (args, "iO!O!O!i", &tno, &PyArray_Type, &preamble,
@@ -1020,7 +1363,7 @@ py_uvread (PyObject *self, PyObject *args)
     if (check_complexf_array (data, "data"))
 	return NULL;
 
-    if (check_int_array (flags, "flags"))
+    if ((kind = check_flags_array (flags, "flags", n)) < 0)
 	return NULL;
 
     /* higher-level checks */
@@ -1032,13 +1375,6 @@ py_uvread (PyObject *self, PyObject *args)
 	return NULL;
     }
 
-    size = PyArray_SIZE (flags);
-    if (size < n) {
-	PyErr_Format (PyExc_ValueError, "flags array must have at least %d elements",
-		      n);
-	return NULL;
-    }
-
     size = PyArray_SIZE (data);
     if (size < n) {
 	PyErr_Format (PyExc_ValueError, "data array must have at least %d elements",
@@ -1046,10 +1382,17 @@ py_uvread (PyObject *self, PyObject *args)
 	return NULL;
     }
 
+    if ((iflags = flags_as_int (flags, kind, n, 0)) == NULL)
+	return NULL;
+
     /* finally ... */
     MTS_CHECK_BUG;
-    uvread_c (tno, PyArray_DATA (preamble), PyArray_DATA (data),
-	      PyArray_DATA (flags), n, &nread);
+    IOSTAT_CALL (IOS_UVREAD, nread * 2 * (long) sizeof (float),
+		 uvread_c (tno, PyArray_DATA (preamble), PyArray_DATA (data),
+			   iflags, n, &nread));
+
+    if (kind != FLAGS_INT)
+	flags_from_int (iflags, flags, kind, nread);
 
     return PyInt_FromLong ((long) nread);
 }
@@ -1057,7 +1400,7 @@ py_uvread (PyObject *self, PyObject *args)
 static PyObject *
 py_uvwrite (PyObject *self, PyObject *args)
 {
-    int tno, n, size;
+    int tno, n, size, kind, *iflags;
     PyObject *preamble, *data, *flags;
 
     if (!PyArg_ParseTuple (args, "iO!O!O!i", &tno, &PyArray_Type, &preamble,
@@ -1070,7 +1413,7 @@ py_uvwrite (PyObject *self, PyObject *args)
     if (check_complexf_array (data, "data"))
 	return NULL;
 
-    if (check_int_array (flags, "flags"))
+    if ((kind = check_flags_array (flags, "flags", n)) < 0)
 	return NULL;
 
     /* higher-level checks */
@@ -1082,13 +1425,6 @@ py_uvwrite (PyObject *self, PyObject *args)
 	return NULL;
     }
 
-    size = PyArray_SIZE (flags);
-    if (size < n) {
-	PyErr_Format (PyExc_ValueError, "flags array must have at least %d elements",
-		      n);
-	return NULL;
-    }
-
     size = PyArray_SIZE (data);
     if (size < n) {
 	PyErr_Format (PyExc_ValueError, "data array must have at least %d elements",
@@ -1096,11 +1432,217 @@ py_uvwrite (PyObject *self, PyObject *args)
 	return NULL;
     }
 
+    if ((iflags = flags_as_int (flags, kind, n, 1)) == NULL)
+	return NULL;
+
     /* finally ... */
     MTS_CHECK_BUG;
-    uvwrite_c (tno, PyArray_DATA (preamble), PyArray_DATA (data),
-	       PyArray_DATA (flags), n);
+    IOSTAT_CALL (IOS_UVWRITE, n * 2 * (long) sizeof (float),
+		 uvwrite_c (tno, PyArray_DATA (preamble), PyArray_DATA (data),
+			    iflags, n));
+
+    Py_RETURN_NONE;
+}
+
+/* Raw access to scaled 16-bit correlations. uvread_c always expands
+ * these to floats, so we let it do so into a scratch buffer (which takes
+ * care of the preamble and flags) and then fetch the stored integers
+ * and scale factor from the "corr" and "tscale" variables; this is
+ * more work than a plain uvread, not less. On write, uvwrite_c
+ * requantizes the data with a scale set by their peak magnitude, so
+ * only integers whose peak magnitude is exactly 32767, as MIRIAD always
+ * produces, are written back unchanged. Anything else is refused
+ * rather than silently rescaled. */
+
+static float *corr_scratch = NULL;
+static size_t corr_scratch_size = 0;
+static int *corrint_scratch = NULL;
+static size_t corrint_scratch_size = 0;
+
+static int
+check_int16_array (PyObject *array, char *argname, int n)
+{
+    if (PyArray_TYPE (array) != NPY_INT16) {
+	PyErr_Format (PyExc_ValueError, "%s must be an int16 ndarray", argname);
+	return 1;
+    }
+
+    if (!PyArray_ISCONTIGUOUS (array)) {
+	PyErr_Format (PyExc_ValueError, "%s must be a contiguous ndarray", argname);
+	return 1;
+    }
+
+    if (PyArray_SIZE (array) < 2 * n) {
+	PyErr_Format (PyExc_ValueError, "%s array must have at least %d elements",
+		      argname, 2 * n);
+	return 1;
+    }
+
+    return 0;
+}
+
+
+static float *
+get_corr_scratch (int n)
+{
+    float *newbuf;
+
+    newbuf = grow_scratch (corr_scratch, &corr_scratch_size, 2 * n * sizeof (float));
+    if (newbuf != NULL)
+	corr_scratch = newbuf;
+    return newbuf;
+}
+
+
+static PyObject *
+py_uvread_raw (PyObject *self, PyObject *args)
+{
+    int tno, n, i, nread, length, updated, kind, *iflags, *ints;
+    char type;
+    float scale, *fdata;
+    double line[6];
+    npy_int16 *out;
+    PyObject *preamble, *data, *flags;
+
+    if (!PyArg_ParseTuple (args, "iO!O!O!i", &tno, &PyArray_Type, &preamble,
+			   &PyArray_Type, &data, &PyArray_Type, &flags, &n))
+	return NULL;
+
+    if (check_double_array (preamble, "preamble"))
+	return NULL;
+
+    if (PyArray_SIZE (preamble) != 4 && PyArray_SIZE (preamble) != 5) {
+	PyErr_SetString (PyExc_ValueError, "preamble array must have 4 or 5 elements");
+	return NULL;
+    }
+
+    if (check_int16_array (data, "data", n))
+	return NULL;
+
+    if ((kind = check_flags_array (flags, "flags", n)) < 0)
+	return NULL;
+
+    if ((fdata = get_corr_scratch (n)) == NULL)
+	return NULL;
+
+    if ((iflags = flags_as_int (flags, kind, n, 0)) == NULL)
+	return NULL;
+
+    /* Check what we can before consuming the record. The type of a
+     * variable is fixed by the vartable, so it's known even before the
+     * first read. Line processing that averages or skips channels is
+     * visible in the line parameters; only a channel range that stops
+     * short of the end of the record must wait for the length of the
+     * record to be known. */
+
+    MTS_CHECK_BUG;
+    uvprobvr_c (tno, "corr", &type, &length, &updated);
+
+    if (type != 'j') {
+	PyErr_Format (PyExc_ValueError, "raw correlation reads require \"corr\" "
+		      "of type j, not %c", type);
+	return NULL;
+    }
+
+    uvinfo_c (tno, "line", line);
+
+    if (line[0] != 0 && (line[0] != 1 || line[2] != 1 || line[3] != 1 ||
+			 line[4] != 1)) {
+	PyErr_SetString (PyExc_ValueError, "raw correlation reads cannot be "
+			 "combined with line processing");
+	return NULL;
+    }
+
+    IOSTAT_CALL (IOS_UVREAD, nread * 2 * (long) sizeof (float),
+		 uvread_c (tno, PyArray_DATA (preamble), fdata, iflags, n, &nread));
+
+    if (nread == 0)
+	return Py_BuildValue ("if", 0, 0.);
+
+    uvprobvr_c (tno, "corr", &type, &length, &updated);
+
+    if (length != 2 * nread) {
+	PyErr_SetString (PyExc_ValueError, "raw correlation reads cannot be "
+			 "combined with line processing; the record has been "
+			 "consumed");
+	return NULL;
+    }
+
+    /* As in py_uvgetvrj, MIRIAD expands the int2s to platform ints. */
+
+    ints = grow_scratch (corrint_scratch, &corrint_scratch_size,
+			 length * sizeof (int));
+    if (ints == NULL)
+	return NULL;
+    corrint_scratch = ints;
+
+    uvgetvr_c (tno, H_INT2, "corr", (char *) ints, length);
+    uvgetvr_c (tno, H_REAL, "tscale", (char *) &scale, 1);
+
+    out = (npy_int16 *) PyArray_DATA (data);
+    for (i = 0; i < length; i++)
+	out[i] = (npy_int16) ints[i];
+
+    if (kind != FLAGS_INT)
+	flags_from_int (iflags, flags, kind, nread);
+
+    return Py_BuildValue ("if", nread, scale);
+}
+
+static PyObject *
+py_uvwrite_raw (PyObject *self, PyObject *args)
+{
+    int tno, n, i, kind, peak, *iflags;
+    float scale, *fdata;
+    npy_int16 *in;
+    PyObject *preamble, *data, *flags;
+
+    if (!PyArg_ParseTuple (args, "iO!O!O!fi", &tno, &PyArray_Type, &preamble,
+			   &PyArray_Type, &data, &PyArray_Type, &flags, &scale, &n))
+	return NULL;
+
+    if (check_double_array (preamble, "preamble"))
+	return NULL;
+
+    if (PyArray_SIZE (preamble) != 4 && PyArray_SIZE (preamble) != 5) {
+	PyErr_SetString (PyExc_ValueError, "preamble array must have 4 or 5 elements");
+	return NULL;
+    }
 
+    if (check_int16_array (data, "data", n))
+	return NULL;
+
+    if ((kind = check_flags_array (flags, "flags", n)) < 0)
+	return NULL;
+
+    in = (npy_int16 *) PyArray_DATA (data);
+    peak = 0;
+    for (i = 0; i < 2 * n; i++) {
+	if (in[i] > peak)
+	    peak = in[i];
+	else if (-in[i] > peak)
+	    peak = -in[i];
+    }
+
+    if (peak != 0 && peak != 32767) {
+	PyErr_Format (PyExc_ValueError, "raw correlations must have a peak "
+		      "magnitude of 32767 to be written without requantization, "
+		      "but it is %d", peak);
+	return NULL;
+    }
+
+    if ((fdata = get_corr_scratch (n)) == NULL)
+	return NULL;
+
+    if ((iflags = flags_as_int (flags, kind, n, 1)) == NULL)
+	return NULL;
+
+    for (i = 0; i < 2 * n; i++)
+	fdata[i] = scale * in[i];
+
+    MTS_CHECK_BUG;
+    IOSTAT_CALL (IOS_UVWRITE, n * 2 * (long) sizeof (float),
+		 uvwrite_c (tno, PyArray_DATA (preamble), fdata, iflags, n));
     Py_RETURN_NONE;
 }
 
@@ -1146,17 +1688,27 @@ py_uvset (PyObject *self, PyObject *args)
 static PyObject *
 py_uvflgwr (PyObject *self, PyObject *args)
 {
-    int tno;
+    int tno, n, kind, *iflags;
     PyObject *flags;
 
     if (!PyArg_ParseTuple (args, "iO!", &tno, &PyArray_Type, &flags))
 	return NULL;
 
-    if (check_int_array (flags, "flags"))
+    if ((kind = check_flags_array (flags, "flags", -1)) < 0)
+	return NULL;
+
+    /* uvflgwr_c knows how many flags to write from the last read; we
+     * just convert everything that we've been given. */
+
+    n = PyArray_SIZE (flags);
+    if (kind == FLAGS_PACKED)
+	n *= 8;
+
+    if ((iflags = flags_as_int (flags, kind, n, 1)) == NULL)
 	return NULL;
 
     MTS_CHECK_BUG;
-    uvflgwr_c (tno, PyArray_DATA (flags));
+    uvflgwr_c (tno, iflags);
     Py_RETURN_NONE;
 }
 
@@ -1357,7 +1909,8 @@ py_xyread (PyObject *self, PyObject *args)
 	return NULL;
 
     MTS_CHECK_BUG;
-    xyread_c (tno, index, PyArray_DATA (data));
+    IOSTAT_CALL (IOS_XYREAD, (long) PyArray_NBYTES (data),
+		 xyread_c (tno, index, PyArray_DATA (data)));
     Py_RETURN_NONE;
 }
 
@@ -1375,7 +1928,8 @@ py_xywrite (PyObject *self, PyObject *args)
 	return NULL;
 
     MTS_CHECK_BUG;
-    xywrite_c (tno, index, PyArray_DATA (data));
+    IOSTAT_CALL (IOS_XYWRITE, (long) PyArray_NBYTES (data),
+		 xywrite_c (tno, index, PyArray_DATA (data)));
     Py_RETURN_NONE;
 }
 
@@ -1393,7 +1947,8 @@ py_xyflgrd (PyObject *self, PyObject *args)
 	return NULL;
 
     MTS_CHECK_BUG;
-    xyflgrd_c (tno, index, PyArray_DATA (flags));
+    IOSTAT_CALL (IOS_XYFLGRD, (long) PyArray_NBYTES (flags),
+		 xyflgrd_c (tno, index, PyArray_DATA (flags)));
     Py_RETURN_NONE;
 }
 
@@ -1411,7 +1966,8 @@ py_xyflgwr (PyObject *self, PyObject *args)
 	return NULL;
 
     MTS_CHECK_BUG;
-    xyflgwr_c (tno, index, PyArray_DATA (flags));
+    IOSTAT_CALL (IOS_XYFLGWR, (long) PyArray_NBYTES (flags),
+		 xyflgwr_c (tno, index, PyArray_DATA (flags)));
     Py_RETURN_NONE;
 }
 
@@ -1703,8 +2259,9 @@ py_xyzread (PyObject *self, PyObject *args)
 	return NULL;
 
     MTS_CHECK_BUG;
-    xyzread_c (tno, PyArray_DATA (coords), PyArray_DATA (data), PyArray_DATA (mask),
-	       &ndata);
+    IOSTAT_CALL (IOS_XYZREAD, ndata * (long) sizeof (float),
+		 xyzread_c (tno, PyArray_DATA (coords), PyArray_DATA (data),
+			    PyArray_DATA (mask), &ndata));
     return Py_BuildValue ("i", ndata);
 }
 
@@ -1741,7 +2298,9 @@ py_xyzprfrd (PyObject *self, PyObject *args)
 	return NULL;
 
     MTS_CHECK_BUG;
-    xyzprfrd_c (tno, profnum, PyArray_DATA (data), PyArray_DATA (mask), &ndata);
+    IOSTAT_CALL (IOS_XYZREAD, ndata * (long) sizeof (float),
+		 xyzprfrd_c (tno, profnum, PyArray_DATA (data), PyArray_DATA (mask),
+			     &ndata));
     return Py_BuildValue ("i", ndata);
 }
 
@@ -1766,8 +2325,9 @@ py_xyzwrite (PyObject *self, PyObject *args)
 	return NULL;
 
     MTS_CHECK_BUG;
-    xyzwrite_c (tno, PyArray_DATA (coords), PyArray_DATA (data), PyArray_DATA (mask),
-		&ndata);
+    IOSTAT_CALL (IOS_XYZWRITE, ndata * (long) sizeof (float),
+		 xyzwrite_c (tno, PyArray_DATA (coords), PyArray_DATA (data),
+			     PyArray_DATA (mask), &ndata));
     /* even though ndata is a pointer arg, it's not modified when writing */
     Py_RETURN_NONE;
 }
@@ -1790,7 +2350,9 @@ py_xyzprfwr (PyObject *self, PyObject *args)
 	return NULL;
 
     MTS_CHECK_BUG;
-    xyzprfwr_c (tno, profnum, PyArray_DATA (data), PyArray_DATA (mask), &ndata);
+    IOSTAT_CALL (IOS_XYZWRITE, ndata * (long) sizeof (float),
+		 xyzprfwr_c (tno, profnum, PyArray_DATA (data), PyArray_DATA (mask),
+			     &ndata));
     /* even though ndata is a pointer arg, it's not modified when writing */
     Py_RETURN_NONE;
 }
@@ -2190,6 +2752,60 @@ py_mirwcs_compute_freq (PyObject *self, PyObject *args)
 }
 
 
+/* I/O statistics */
+
+static PyObject *
+py_iostats_enable (PyObject *self, PyObject *args)
+{
+    int enable, prev;
+
+    if (!PyArg_ParseTuple (args, "i", &enable))
+	return NULL;
+
+    prev = iostats_enabled;
+    iostats_enabled = (enable != 0);
+    return PyBool_FromLong (prev);
+}
+
+
+static PyObject *
+py_iostats_get (PyObject *self, PyObject *args)
+{
+    int i;
+    PyObject *result, *item;
+
+    if (!PyArg_ParseTuple (args, ""))
+	return NULL;
+
+    if ((result = PyDict_New ()) == NULL)
+	return NULL;
+
+    for (i = 0; i < IOS_NUM; i++) {
+	item = Py_BuildValue ("(KKK)", iostats[i].calls, iostats[i].bytes,
+			      iostats[i].nsec);
+	if (item == NULL || PyDict_SetItemString (result, iostat_names[i], item)) {
+	    Py_XDECREF (item);
+	    Py_DECREF (result);
+	    return NULL;
+	}
+	Py_DECREF (item);
+    }
+
+    return result;
+}
+
+
+static PyObject *
+py_iostats_reset (PyObject *self, PyObject *args)
+{
+    if (!PyArg_ParseTuple (args, ""))
+	return NULL;
+
+    memset (iostats, 0, sizeof (iostats));
+    Py_RETURN_NONE;
+}
+
+
 /* vtable */
 
 static PyMethodDef methods[] = {
@@ -2249,13 +2865,18 @@ static PyMethodDef methods[] = {
     DEF(uvtrack, "(int tno, str name, str switches) => void"),
     DEF(uvscan, "(int tno, str var) => int retval"),
     DEF(uvread, "(int tno, double-ndarray preamble, float-ndarray data,\n"
-	" int-ndarray flags, int n) => int retval"),
+	" flags-ndarray flags, int n) => int retval"),
     DEF(uvwrite, "(int tno, double-ndarray preamble, float-ndarray data,\n"
-	" int-ndarray flags, int n) => void"),
+	" flags-ndarray flags, int n) => void"),
+    DEF(uvread_raw, "(int tno, double-ndarray preamble, int16-ndarray data,\n"
+	" flags-ndarray flags, int n) => (int nread, float scale)"),
+    DEF(uvwrite_raw, "(int tno, double-ndarray preamble, int16-ndarray data,\n"
+	" flags-ndarray flags, float scale, int n) => void"),
     DEF(uvselect, "(int tno, str object, double p1, double p2, int flag) => None"),
     DEF(uvset, "(int tno, str object, str type, int n, double p1,\n"
 	" double p2, double p3) => void"),
-    DEF(uvflgwr, "(int tno, int-ndarray flags) => void"),
+    DEF(uvflgwr, "(int tno, flags-ndarray flags) => void"),
+    DEF(convflags, "(flags-ndarray src, flags-ndarray dest, int n) => void"),
     DEF(uvinfo, "(int tno, str object, double-ndarray data) => void"),
     DEF(uvchkshadow, "(int tno, double diameter_meters) => bool"),
     DEF(probe_uvchkshadow, "() => bool"),
@@ -2338,6 +2959,12 @@ static PyMethodDef methods[] = {
     DEF(mirwcs_celset, "(_Wcsprm params) => error-string or None"),
     DEF(mirwcs_compute_freq, "(str spectype, double specval, double restfreq) => double"),
 
+    /* I/O statistics */
+
+    DEF(iostats_enable, "(bool enable) => bool wasenabled"),
+    DEF(iostats_get, "() => dict of name: (int ncalls, int nbytes, int nsec)"),
+    DEF(iostats_reset, "() => void"),
+
     /* Done. Sentinel. */
 
     {NULL, NULL, 0, NULL}
@@ -0,0 +1,28 @@
+"""The MIRIAD Fortran routines wrapped by miriad-python, all in one
+module, as they used to be. The wrappers are now built as separate
+extensions, _miriad_f_uvdat, _miriad_f_coord, _miriad_f_fit, and
+_miriad_f_grid, so that programs only load the ones they need. Code in
+this package should import those directly; importing this module loads
+them all."""
+
+# Copyright 2009-2012 Peter Williams
+#
+# This file is part of miriad-python.
+#
+# Miriad-python is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Miriad-python is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
+
+from mirtask._miriad_f_uvdat import *
+from mirtask._miriad_f_coord import *
+from mirtask._miriad_f_fit import *
+from mirtask._miriad_f_grid import *
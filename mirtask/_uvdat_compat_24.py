@@ -18,7 +18,7 @@ See _uvdat_compat_default.py for the reference implementations."""
 # You should have received a copy of the GNU General Public License
 # along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
 
-from mirtask import _miriad_f
+from mirtask import _miriad_f_uvdat
 
 def _inputSets (UVDatDataSet):
     """Generate a sequence of DataSet objects representing the
@@ -27,7 +27,7 @@ visdata input sets."""
     try:
         while True:
             if ds is not None and ds.isOpen (): ds.close ()
-            (status, tin) = _miriad_f.uvdatopn ()
+            (status, tin) = _miriad_f_uvdat.uvdatopn ()
             if not status: break
             ds = UVDatDataSet (tin)
             yield ds
@@ -39,13 +39,26 @@ visdata input sets."""
         raise RuntimeError ('No input UV data sets?')
 
 
-def _read_gen (saveFlags, UVDatDataSet, maxchan):
-    from mirtask._miriad_f import uvdatopn, uvdatrd
+def _read_gen (saveFlags, UVDatDataSet, maxchan, flagtype='int'):
+    from mirtask._miriad_f_uvdat import uvdatopn, uvdatrd
+    from mirtask import flagsBuffer, convertFlags
     from numpy import zeros, double, complex64, int32
     inp = None
     preamble = zeros (5, dtype=double)
     data = zeros (maxchan, dtype=complex64)
     flags = zeros (maxchan, dtype=int32)
+    if flagtype == 'int':
+        oflags = None
+    else:
+        oflags = flagsBuffer (maxchan, flagtype)
+        nbits = (flagtype == 'packed')
+    def outflags (nread):
+        if oflags is None:
+            return flags[:nread]
+        convertFlags (flags, oflags, nread)
+        if nbits:
+            return oflags[:(nread + 7) // 8]
+        return oflags[:nread]
     try:
         if saveFlags:
             while True:
@@ -60,7 +73,7 @@ def _read_gen (saveFlags, UVDatDataSet, maxchan):
                     nread = uvdatrd (preamble, data, flags, maxchan)
                     if nread == 0:
                         break
-                    f = flags[:nread]
+                    f = outflags (nread)
                     yield inp, preamble, data[:nread], f
                     rewrite (f)
         else:
@@ -75,7 +88,7 @@ def _read_gen (saveFlags, UVDatDataSet, maxchan):
                     nread = uvdatrd (preamble, data, flags, maxchan)
                     if nread == 0:
                         break
-                    yield inp, preamble, data[:nread], flags[:nread]
+                    yield inp, preamble, data[:nread], outflags (nread)
     except:
         if inp is not None and inp.isOpen ():
             inp.close ()
@@ -20,7 +20,7 @@ us to use the ideal functions if possible but fall back if necessary."""
 # You should have received a copy of the GNU General Public License
 # along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
 
-from mirtask import _miriad_f
+from mirtask import _miriad_f_uvdat
 
 def _inputSets (UVDatDataSet):
     """Generate a sequence of DataSet objects representing the
@@ -33,7 +33,7 @@ visdata input sets."""
             if ds is not None and ds.isOpen ():
                 ds.close ()
 
-            (status, tin) = _miriad_f.uvdatopn ()
+            (status, tin) = _miriad_f_uvdat.uvdatopn ()
 
             if not status:
                 break
@@ -48,8 +48,9 @@ visdata input sets."""
         raise RuntimeError ('No input UV data sets?')
 
 
-def _read_gen (saveFlags, UVDatDataSet, maxchan):
-    from mirtask._miriad_f import uvdatopn, uvdatrd
+def _read_gen (saveFlags, UVDatDataSet, maxchan, flagtype='int'):
+    from mirtask._miriad_f_uvdat import uvdatopn, uvdatrd
+    from mirtask import flagsBuffer, convertFlags
     from numpy import zeros, double, complex64, int32
 
     inp = None
@@ -57,6 +58,22 @@ def _read_gen (saveFlags, UVDatDataSet, maxchan):
     data = zeros (maxchan, dtype=complex64)
     flags = zeros (maxchan, dtype=int32)
 
+    # For other flag formats, uvdatrd still fills the int buffer, which
+    # is then converted in C. Each yielded slice covers nread channels.
+    if flagtype == 'int':
+        oflags = None
+    else:
+        oflags = flagsBuffer (maxchan, flagtype)
+        nbits = (flagtype == 'packed')
+
+    def outflags (nread):
+        if oflags is None:
+            return flags[:nread]
+        convertFlags (flags, oflags, nread)
+        if nbits:
+            return oflags[:(nread + 7) // 8]
+        return oflags[:nread]
+
     try:
         if saveFlags:
             while True:
@@ -75,7 +92,7 @@ def _read_gen (saveFlags, UVDatDataSet, maxchan):
                     if nread == 0:
                         break
 
-                    f = flags[:nread]
+                    f = outflags (nread)
                     yield inp, preamble, data[:nread], f
                     rewrite (f)
         else:
@@ -94,7 +111,7 @@ def _read_gen (saveFlags, UVDatDataSet, maxchan):
                     if nread == 0:
                         break
 
-                    yield inp, preamble, data[:nread], flags[:nread]
+                    yield inp, preamble, data[:nread], outflags (nread)
     finally:
         if inp is not None and inp.isOpen ():
             inp.close ()
@@ -0,0 +1,301 @@
+'''mirtask.imager - grid and Fourier transform UV data into images'''
+
+# Copyright 2009-2012 Peter Williams
+#
+# This file is part of miriad-python.
+#
+# Miriad-python is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Miriad-python is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as N
+from mirtask import util
+
+__all__ = ['Imager']
+
+# The MIRIAD gridding parameters; see util.sphGridFunc.
+DEFAULT_NSAMP = 2047
+DEFAULT_WIDTH = 6
+DEFAULT_ALPHA = 1.0
+
+
+class Imager (object):
+    """:synopsis: a quick-look imager for UV data
+
+:arg imsize: the image size in pixels; an integer for a square image
+  or a pair ``(nx, ny)``
+:arg float cell: the pixel size in radians
+:arg int width: the width of the gridding function in pixels
+:arg float alpha: the spheroidal parameter of the gridding function
+
+This class makes dirty maps and beams in-process, in the same way that
+INVERT does in its simplest mode: visibilities are convolved onto a
+regular UV grid with MIRIAD's spheroidal gridding function (see
+:func:`mirtask.util.sphGridFunc`), the grid is Fourier transformed
+with :mod:`numpy.fft`, and the results are divided by the gridding
+correction function (see :func:`mirtask.util.sphCorrFunc`). The
+visibilities are multi-frequency synthesized and naturally weighted.
+No mosaicking, w-term corrections, or Stokes processing are done.
+
+Typical usage is::
+
+  im = Imager (256, 1e-5)
+  im.addRecords (uvdat.setupAndRead (vis, '3', False))
+  im.writeImages (ImData ('map'), ImData ('beam'))
+
+Call :meth:`reset` to image another dataset with the same setup.
+"""
+
+    nx = ny = None
+    cell = None
+    ra = dec = None
+    """The phase center of the gridded data in radians, taken from the
+    first record passed to :meth:`addRecords`, or :const:`None`."""
+    freq = None
+    """The frequency of the first record passed to :meth:`addRecords`
+    in GHz, or :const:`None`."""
+
+    def __init__ (self, imsize, cell, width=DEFAULT_WIDTH, alpha=DEFAULT_ALPHA):
+        imsize = N.atleast_1d (imsize)
+        if imsize.size == 1:
+            self.nx = self.ny = int (imsize[0])
+        else:
+            self.nx, self.ny = int (imsize[0]), int (imsize[1])
+
+        if self.nx < 2 * width or self.ny < 2 * width:
+            raise ValueError ('image size must be at least %d pixels' % (2 * width))
+        if cell <= 0:
+            raise ValueError ('cell size must be positive (got %f)' % cell)
+
+        self.cell = float (cell)
+        self.width = width
+        self._kernel = util.sphGridFunc (DEFAULT_NSAMP, width, alpha).astype (N.double)
+        self._kscale = DEFAULT_NSAMP // width
+        self._xcorr = util.sphCorrFunc (self.nx, width, alpha).astype (N.double)
+        self._ycorr = util.sphCorrFunc (self.ny, width, alpha).astype (N.double)
+        self.reset ()
+
+
+    def reset (self):
+        """Discard all gridded data.
+
+:returns: *self*
+"""
+        self._vis = N.zeros (self.nx * self.ny, dtype=N.complex128)
+        self._wts = N.zeros (self.nx * self.ny, dtype=N.double)
+        self.sumwt = 0.
+        self.ngridded = 0
+        self.ra = self.dec = self.freq = None
+        return self
+
+
+    def grid (self, u, v, data, weights):
+        """Convolve visibilities onto the UV grid.
+
+:arg u: the *u* coordinates of the visibilities in wavelengths
+:type u: 1D double ndarray
+:arg v: the *v* coordinates of the visibilities in wavelengths
+:type v: 1D double ndarray
+:arg data: the visibilities
+:type data: 1D complex ndarray
+:arg weights: the weights of the visibilities
+:type weights: 1D double ndarray
+:returns: *self*
+
+Each visibility and its Hermitian conjugate are gridded. Visibilities
+whose gridding kernel would fall off the edge of the grid are
+discarded. All of the arguments must have the same size; this is
+most efficient when they contain many visibilities at once.
+"""
+        nx, ny, width = self.nx, self.ny, self.width
+        half = width // 2
+
+        u = N.concatenate ((u, -u))
+        v = N.concatenate ((v, -v))
+        data = N.concatenate ((data, N.conj (data)))
+        weights = N.concatenate ((weights, weights))
+
+        # Pixel coordinates of the visibilities. u is negated so that
+        # RA increases to the left, as it does with INVERT.
+        px = -u * (nx * self.cell) + nx // 2
+        py = v * (ny * self.cell) + ny // 2
+
+        ok = ((px >= half) & (px < nx - half - 1) &
+              (py >= half) & (py < ny - half - 1) & (weights > 0))
+        if not ok.all ():
+            px, py, data, weights = px[ok], py[ok], data[ok], weights[ok]
+
+        if px.size == 0:
+            return self
+
+        x0 = N.floor (px).astype (N.int) - half + 1
+        y0 = N.floor (py).astype (N.int) - half + 1
+        offsets = N.arange (width)
+
+        # (npts, width) arrays of pixel indices and kernel values
+        xx = x0[:,None] + offsets
+        yy = y0[:,None] + offsets
+        mid = DEFAULT_NSAMP // 2
+        kx = self._kernel[N.clip (N.round (self._kscale * (xx - px[:,None])).astype (N.int) + mid,
+                                  0, DEFAULT_NSAMP - 1)]
+        ky = self._kernel[N.clip (N.round (self._kscale * (yy - py[:,None])).astype (N.int) + mid,
+                                  0, DEFAULT_NSAMP - 1)]
+
+        # (npts, width, width) products, flattened for bincount
+        idx = (yy[:,:,None] * nx + xx[:,None,:]).ravel ()
+        k = (ky[:,:,None] * kx[:,None,:] * weights[:,None,None]).reshape ((-1, width * width))
+        kd = k * data[:,None]
+
+        # bincount's result stops at the largest index; its minlength
+        # argument would pad it, but needs NumPy 1.6.
+        sums = N.bincount (idx, kd.real.ravel ())
+        self._vis.real[:sums.size] += sums
+        sums = N.bincount (idx, kd.imag.ravel ())
+        self._vis.imag[:sums.size] += sums
+        sums = N.bincount (idx, k.ravel ())
+        self._wts[:sums.size] += sums
+        self.sumwt += weights.sum ()
+        self.ngridded += weights.size
+        return self
+
+
+    def addRecords (self, gen, useVariance=False, blocksize=65536):
+        """Grid the UV records yielded by a generator.
+
+:arg gen: the source of UV data
+:type gen: iterable of ``(handle, preamble, data, flags)``, as
+  yielded by :func:`mirtask.uvdat.read`
+:arg bool useVariance: weight the visibilities by the inverse of their
+  variance rather than uniformly; default :const:`False`
+:arg int blocksize: the number of visibilities to buffer before
+  gridding them
+:returns: *self*
+
+The *u* and *v* coordinates are taken from the first two preamble
+elements, which should be in nanoseconds (i.e., the "w" UVDAT
+option should not be used), and scaled by the sky frequency of each
+channel. Flagged channels are ignored.
+"""
+        us, vs, ds, ws = [], [], [], []
+        nbuf = 0
+
+        for inp, preamble, data, flags in gen:
+            good = flags != 0
+            if not good.any ():
+                continue
+
+            freqs = inp.getSkyFrequencies (maxnread=data.size, trustmaxnread=True)
+
+            if self.freq is None:
+                self.freq = freqs[0]
+                self.ra = inp.getScalar ('ra')
+                self.dec = inp.getScalar ('dec')
+
+            if useVariance:
+                var = inp.getVariance ()
+                if var <= 0:
+                    continue
+                w = 1. / var
+            else:
+                w = 1.
+
+            f = freqs[good]
+            us.append (preamble[0] * f)
+            vs.append (preamble[1] * f)
+            ds.append (data[good].astype (N.complex128))
+            ws.append (N.repeat (w, f.size))
+            nbuf += f.size
+
+            if nbuf >= blocksize:
+                self.grid (N.concatenate (us), N.concatenate (vs),
+                           N.concatenate (ds), N.concatenate (ws))
+                us, vs, ds, ws = [], [], [], []
+                nbuf = 0
+
+        if nbuf:
+            self.grid (N.concatenate (us), N.concatenate (vs),
+                       N.concatenate (ds), N.concatenate (ws))
+
+        return self
+
+
+    def _transform (self, grid):
+        g = grid.reshape ((self.ny, self.nx))
+        img = N.fft.fftshift (N.fft.ifft2 (N.fft.ifftshift (g))).real
+        # Normalize so that the beam has a peak of one
+        img *= self.nx * self.ny / self._wts.sum ()
+
+        xc = self._xcorr / self._xcorr[self.nx // 2]
+        yc = self._ycorr / self._ycorr[self.ny // 2]
+        img /= yc[:,None] * xc[None,:]
+        return img.astype (N.float32)
+
+
+    def makeMap (self):
+        """Compute the dirty map and beam.
+
+:returns: ``(map, beam)``, two float32 arrays of shape ``(ny, nx)``
+:raises: :exc:`RuntimeError` if nothing has been gridded
+
+The map is in units of Jy/beam and the beam has a peak of one at
+pixel ``(ny // 2, nx // 2)``. Both are in MIRIAD's bottom-to-top
+row ordering, ready to be passed to :meth:`mirtask.XYDataSet.writePlane`.
+"""
+        if self.sumwt <= 0:
+            raise RuntimeError ('no visibilities have been gridded')
+
+        return (self._transform (self._vis),
+                self._transform (self._wts.astype (N.complex128)))
+
+
+    def _setHeader (self, hnd, btype):
+        hnd.setScalarItem ('ctype1', str, 'RA---SIN')
+        hnd.setScalarItem ('ctype2', str, 'DEC--SIN')
+        hnd.setScalarItem ('crpix1', N.float64, self.nx // 2 + 1)
+        hnd.setScalarItem ('crpix2', N.float64, self.ny // 2 + 1)
+        hnd.setScalarItem ('cdelt1', N.float64, -self.cell)
+        hnd.setScalarItem ('cdelt2', N.float64, self.cell)
+        if self.ra is not None:
+            hnd.setScalarItem ('crval1', N.float64, self.ra)
+        if self.dec is not None:
+            hnd.setScalarItem ('crval2', N.float64, self.dec)
+        hnd.setScalarItem ('btype', str, btype)
+        hnd.setScalarItem ('bunit', str, 'JY/BEAM')
+
+
+    def writeImages (self, map, beam=None):
+        """Write the dirty map and beam to new image datasets.
+
+:arg map: the map dataset to create
+:type map: :class:`miriad.ImData`
+:arg beam: the beam dataset to create, or :const:`None` to skip it
+:type beam: :class:`miriad.ImData`
+:returns: *self*
+
+The images are written with :meth:`mirtask.XYDataSet.writePlane` and
+given a basic celestial coordinate system in their headers.
+"""
+        mapdata, beamdata = self.makeMap ()
+
+        for ds, data, btype in ((map, mapdata, 'intensity'),
+                                (beam, beamdata, 'beam')):
+            if ds is None:
+                continue
+
+            hnd = ds.open ('c', N.asarray ([self.nx, self.ny], dtype=N.intc))
+            try:
+                hnd.writePlane (N.ma.asarray (data), axes=[])
+                self._setHeader (hnd, btype)
+            finally:
+                hnd.close ()
+
+        return self
@@ -0,0 +1,345 @@
+'''mirtask.immath - evaluate MATHS-style image expressions in-process'''
+
+# Copyright 2009-2012 Peter Williams
+#
+# This file is part of miriad-python.
+#
+# Miriad-python is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Miriad-python is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import numpy as N
+from mirtask.imparallel import planeCoords
+
+__all__ = ['ExpressionError', 'compileExpr', 'evaluate']
+
+
+class ExpressionError (ValueError):
+    """An error raised when an image expression can't be parsed."""
+    pass
+
+
+def _sign (a, b):
+    return N.abs (a) * N.where (b < 0, -1., 1.)
+
+def _step (a):
+    return N.where (a > 0, 1., 0.)
+
+def _anint (a):
+    # Fortran ANINT rounds halves away from zero, unlike N.round.
+    return N.trunc (a + N.copysign (0.5, a))
+
+_functions = {
+    'abs': N.abs, 'aint': N.trunc, 'anint': _anint, 'acos': N.arccos,
+    'asin': N.arcsin, 'atan': N.arctan, 'atan2': N.arctan2, 'cos': N.cos,
+    'cosh': N.cosh, 'exp': N.exp, 'log': N.log, 'log10': N.log10,
+    'max': N.maximum, 'min': N.minimum, 'sign': _sign, 'sin': N.sin,
+    'sinh': N.sinh, 'sqrt': N.sqrt, 'step': _step, 'tan': N.tan,
+    'tanh': N.tanh,
+}
+
+_relops = {'.gt.': '>', '.ge.': '>=', '.lt.': '<', '.le.': '<=',
+           '.eq.': '==', '.ne.': '!='}
+
+_tokenre = re.compile (r'''\s*(?:
+  (?P<dataset><[^<>]+>) |
+  (?P<number>(?:\d+(?:\.(?![a-z])\d*|\.(?=[ed][-+]?\d))?|\.\d+)
+             (?:[ed][-+]?\d+)?) |
+  (?P<dotop>\.(?:gt|ge|lt|le|eq|ne|and|or|not)\.) |
+  (?P<ident>[a-z_][a-z0-9_]*) |
+  (?P<punct>\*\*|[-+*/(),])
+)''', re.VERBOSE | re.IGNORECASE)
+
+
+def _tokenize (text):
+    tokens = []
+    pos = 0
+    text = text.rstrip ()
+
+    while pos < len (text):
+        m = _tokenre.match (text, pos)
+        if m is None:
+            raise ExpressionError ('cannot parse expression "%s" at "%s"'
+                                   % (text, text[pos:]))
+        kind = m.lastgroup
+        val = m.group (kind)
+        if kind != 'dataset':
+            val = val.lower ()
+        tokens.append ((kind, val))
+        pos = m.end ()
+
+    tokens.append (('end', None))
+    return tokens
+
+
+class _Parser (object):
+    """A recursive-descent parser translating a MATHS expression into
+    Python source with explicit parenthesization. Datasets become
+    variables named _d0, _d1, ... in order of first appearance."""
+
+    def __init__ (self, text):
+        self.text = text
+        self.tokens = _tokenize (text)
+        self.pos = 0
+        self.datasets = []
+
+    def peek (self):
+        return self.tokens[self.pos]
+
+    def next (self):
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
+
+    def expect (self, val):
+        kind, v = self.next ()
+        if v != val:
+            raise ExpressionError ('expected "%s" in expression "%s"' % (val, self.text))
+
+    def parse (self):
+        code = self.orexpr ()
+        if self.peek ()[0] != 'end':
+            raise ExpressionError ('unexpected "%s" in expression "%s"'
+                                   % (self.peek ()[1], self.text))
+        return code
+
+    def orexpr (self):
+        code = self.andexpr ()
+        while self.peek ()[1] == '.or.':
+            self.next ()
+            code = 'N.logical_or (%s, %s)' % (code, self.andexpr ())
+        return code
+
+    def andexpr (self):
+        code = self.notexpr ()
+        while self.peek ()[1] == '.and.':
+            self.next ()
+            code = 'N.logical_and (%s, %s)' % (code, self.notexpr ())
+        return code
+
+    def notexpr (self):
+        if self.peek ()[1] == '.not.':
+            self.next ()
+            return 'N.logical_not (%s)' % self.notexpr ()
+        return self.relexpr ()
+
+    def relexpr (self):
+        code = self.sumexpr ()
+        op = _relops.get (self.peek ()[1])
+        if op is not None:
+            self.next ()
+            code = '(%s %s %s)' % (code, op, self.sumexpr ())
+        return code
+
+    def sumexpr (self):
+        code = self.termexpr ()
+        while self.peek ()[1] in ('+', '-'):
+            op = self.next ()[1]
+            code = '(%s %s %s)' % (code, op, self.termexpr ())
+        return code
+
+    def termexpr (self):
+        code = self.unary ()
+        while self.peek ()[1] in ('*', '/'):
+            op = self.next ()[1]
+            code = '(%s %s %s)' % (code, op, self.unary ())
+        return code
+
+    def unary (self):
+        if self.peek ()[1] in ('+', '-'):
+            op = self.next ()[1]
+            return '(%s%s)' % (op, self.unary ())
+        return self.power ()
+
+    def power (self):
+        code = self.atom ()
+        if self.peek ()[1] == '**':
+            self.next ()
+            code = '(%s ** %s)' % (code, self.unary ())
+        return code
+
+    def atom (self):
+        kind, val = self.next ()
+
+        if kind == 'number':
+            return repr (float (val.replace ('d', 'e')))
+
+        if kind == 'dataset':
+            name = val[1:-1].strip ()
+            if name not in self.datasets:
+                self.datasets.append (name)
+            return '_d%d' % self.datasets.index (name)
+
+        if val == '(':
+            code = self.orexpr ()
+            self.expect (')')
+            return code
+
+        if kind == 'ident':
+            if val == 'pi':
+                return repr (N.pi)
+            if val not in _functions:
+                raise ExpressionError ('unknown function "%s" in expression "%s"'
+                                       % (val, self.text))
+            self.expect ('(')
+            args = [self.orexpr ()]
+            while self.peek ()[1] == ',':
+                self.next ()
+                args.append (self.orexpr ())
+            self.expect (')')
+            return '_f_%s (%s)' % (val, ', '.join (args))
+
+        if kind == 'end':
+            raise ExpressionError ('unexpected end of expression "%s"' % self.text)
+        raise ExpressionError ('unexpected "%s" in expression "%s"' % (val, self.text))
+
+
+def compileExpr (text):
+    """Compile a MATHS-style image expression.
+
+:arg str text: the expression
+:returns: ``(func, names)``
+:raises: :exc:`ExpressionError` if the expression can't be parsed
+
+The expression syntax is that of the MIRIAD task MATHS: datasets are
+referenced as ``<name>``; the operators ``+ - * / **``, the Fortran
+relational operators (``.gt.`` etc.), and ``.and.``, ``.or.``, and
+``.not.`` are supported; and so are the MATHS functions ``abs``,
+``aint``, ``anint``, ``acos``, ``asin``, ``atan``, ``atan2``, ``cos``,
+``cosh``, ``exp``, ``log``, ``log10``, ``max``, ``min``, ``sign``,
+``sin``, ``sinh``, ``sqrt``, ``step``, ``tan``, and ``tanh``, and the
+constant ``pi``. The pixel coordinate variables ``x``, ``y``, and ``z``
+are not supported.
+
+*names* is the list of dataset names referenced in the expression, in
+order of first appearance, and *func* is a function that takes one
+array argument per name, in the same order, and returns the value of
+the expression evaluated elementwise. Logical results are returned as
+boolean arrays.
+"""
+    p = _Parser (text)
+    code = p.parse ()
+    args = ', '.join ('_d%d' % i for i in xrange (len (p.datasets)))
+
+    env = {'__builtins__': {}, 'N': N}
+    for name, func in _functions.iteritems ():
+        env['_f_' + name] = func
+
+    exec 'def _evaluate (%s):\n    return %s\n' % (args, code) in env
+    return env['_evaluate'], p.datasets
+
+
+# Header items that are maintained by the XY layer or that describe
+# data rather than metadata, and so shouldn't be copied to outputs.
+_nocopyItems = frozenset (('image', 'mask', 'history', 'naxis', 'naxis1',
+                           'naxis2', 'naxis3', 'naxis4', 'naxis5', 'naxis6',
+                           'naxis7'))
+
+
+def _resolve (name, inputs):
+    from miriad import ImData
+
+    ds = inputs.get (name, name)
+    if not isinstance (ds, ImData):
+        ds = ImData (str (ds))
+    return ds
+
+
+def evaluate (expr, inputs, out, mask=None):
+    """Evaluate a MATHS-style image expression and write the result.
+
+:arg str expr: the expression; see :func:`compileExpr`
+:arg inputs: a mapping from the names used in *expr* and *mask* to
+  datasets; names not in the mapping are treated as paths
+:type inputs: dict of :class:`miriad.ImData` or paths, or :const:`None`
+:arg out: the output dataset, which must not yet exist
+:type out: :class:`miriad.ImData`
+:arg str mask: an optional expression; output pixels where it is false
+  are masked, as with the *mask* keyword of MATHS
+:returns: *out*
+:raises: :exc:`ExpressionError` if an expression can't be parsed
+:raises: :exc:`ValueError` if the inputs don't all have the same shape
+
+This does in-process what would otherwise be done by running MATHS.
+The inputs are read and the output written one plane at a time, so
+memory use is bounded by the plane size rather than the image size.
+An output pixel is masked if the corresponding pixel of any input is
+masked, if the mask expression is false, or if the result isn't
+finite. Logical results are written as 1 or 0. The output takes its
+shape and header from the first dataset referenced in *expr*.
+"""
+    if inputs is None:
+        inputs = {}
+
+    func, names = compileExpr (expr)
+    if not len (names):
+        raise ExpressionError ('expression "%s" references no datasets' % expr)
+
+    if mask is not None:
+        mfunc, mnames = compileExpr (mask)
+        allnames = names + [n for n in mnames if n not in names]
+    else:
+        allnames = names
+
+    handles = {}
+    try:
+        for name in allnames:
+            handles[name] = _resolve (name, inputs).open ('rw')
+
+        first = handles[names[0]]
+        axes = first.axes
+        for name in allnames:
+            if handles[name].axes.size != axes.size or \
+                    (handles[name].axes != axes).any ():
+                raise ValueError ('image "%s" has a different shape than "%s"'
+                                  % (name, names[0]))
+
+        outhnd = out.open ('c', axes)
+        try:
+            for item in first.itemNames ():
+                if item not in _nocopyItems:
+                    first.copyItem (outhnd, item)
+
+            shape = (axes[1], axes[0])
+            bufs = {}
+            for name in allnames:
+                bufs[name] = N.ma.masked_array (N.empty (shape, dtype=N.float32),
+                                                N.empty (shape, dtype=N.bool),
+                                                copy=False)
+
+            for c in planeCoords (axes):
+                bad = N.zeros (shape, dtype=N.bool)
+                for name in allnames:
+                    handles[name].readPlane (axes=c, buf=bufs[name])
+                    bad |= bufs[name].mask
+
+                olderr = N.seterr (all='ignore')
+                try:
+                    result = func (*[bufs[n].data for n in names])
+                    result = N.asarray (result, dtype=N.float32)
+                    bad |= ~N.isfinite (result)
+
+                    if mask is not None:
+                        mres = mfunc (*[bufs[n].data for n in mnames])
+                        bad |= ~N.asarray (mres, dtype=N.bool)
+                finally:
+                    N.seterr (**olderr)
+
+                outhnd.writePlane (N.ma.masked_array (result, bad), axes=c)
+        finally:
+            outhnd.close ()
+    finally:
+        for h in handles.itervalues ():
+            h.close ()
+
+    return out
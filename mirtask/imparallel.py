@@ -0,0 +1,172 @@
+'''mirtask.imparallel - process image planes in parallel'''
+
+# Copyright 2009-2012 Peter Williams
+#
+# This file is part of miriad-python.
+#
+# Miriad-python is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Miriad-python is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as N
+
+__all__ = ['planeCoords', 'mapPlanes']
+
+
+def planeCoords (axes):
+    """Enumerate the planes of an image.
+
+:arg axes: the axis sizes of the image, as in :attr:`mirtask.XYDataSet.axes`
+:type axes: int ndarray
+:returns: a list of tuples of pixel coordinates of the non-plane axes,
+  suitable for passing to :meth:`mirtask.XYDataSet.setPlane`
+
+The planes are listed in the order in which they are stored on disk,
+so that ``axes[2]`` varies most quickly.
+"""
+    outer = tuple (int (x) for x in axes[2:])
+    return [tuple (reversed (idx)) for idx in N.ndindex (*reversed (outer))]
+
+
+# State of each worker process. MIRIAD's I/O handle tables are
+# process-global, so every worker opens its own handle on the input
+# after it has been forked.
+
+_workerHandle = None
+_workerFunc = None
+_workerCoords = None
+
+
+def _initWorker (path, func, coords):
+    global _workerHandle, _workerFunc, _workerCoords
+    from miriad import ImData
+
+    _workerHandle = ImData (path).open ('rw')
+    _workerFunc = func
+    _workerCoords = coords
+
+
+def _processRange (bounds):
+    start, stop = bounds
+    results = []
+
+    for i in xrange (start, stop):
+        axes = _workerCoords[i]
+        data = _workerHandle.readPlane (axes=axes)
+        results.append ((i, _workerFunc (data, axes)))
+
+    return results
+
+
+def _splitRanges (nplanes, nproc):
+    # A few ranges per worker so that uneven per-plane costs get
+    # balanced, but each range still covers contiguous planes.
+    nranges = min (nplanes, 4 * nproc)
+    edges = N.linspace (0, nplanes, nranges + 1).astype (N.int)
+    return [(edges[i], edges[i+1]) for i in xrange (nranges)
+            if edges[i+1] > edges[i]]
+
+
+def mapPlanes (imdata, func, nproc=None, out=None, planes=None):
+    """Apply a function to every plane of an image, in parallel.
+
+:arg imdata: the input image
+:type imdata: :class:`miriad.ImData` or path
+:arg func: the function to apply; called as ``func (data, axes)``
+:type func: callable
+:arg int nproc: the number of worker processes; :const:`None`
+  (the default) means one per CPU
+:arg out: a pre-created output image with the same plane shape as
+  *imdata*, or :const:`None` (the default)
+:type out: :class:`miriad.ImData` or :const:`None`
+:arg planes: the plane coordinates to process, or :const:`None` (the
+  default) for all planes as listed by :func:`planeCoords`
+:type planes: list of tuples of int
+:returns: a list of the values returned by *func*, in the order of
+  *planes*, or :const:`None` if *out* was given
+
+The planes are divided into contiguous ranges that are handed out to
+a pool of worker processes. Each worker opens its own handle on
+*imdata*, reads the planes in its range with
+:meth:`mirtask.XYDataSet.readPlane`, and calls *func* with the masked
+plane data and the plane coordinates. *func* must be picklable, which
+in practice means that it must be defined at the top level of a
+module.
+
+If *out* is not :const:`None`, *func* should return a masked array
+of the same shape as its input, and the returned planes are written
+into *out* at the same coordinates. The writing is done in the
+calling process as results arrive, because MIRIAD's I/O layer buffers
+item data and headers per process and so cannot safely have several
+processes writing into one dataset.
+
+If *nproc* is 1, everything happens in the calling process.
+"""
+    from miriad import ImData
+
+    if not isinstance (imdata, ImData):
+        imdata = ImData (str (imdata))
+
+    if planes is None:
+        h = imdata.open ('rw')
+        planes = planeCoords (h.axes)
+        h.close ()
+    else:
+        planes = [tuple (p) for p in planes]
+
+    if out is not None:
+        if not isinstance (out, ImData):
+            out = ImData (str (out))
+        outhnd = out.open ('rw')
+        results = None
+    else:
+        outhnd = None
+        results = [None] * len (planes)
+
+    def handle (i, result):
+        if outhnd is None:
+            results[i] = result
+        else:
+            outhnd.writePlane (result, axes=planes[i])
+
+    try:
+        if nproc == 1 or len (planes) < 2:
+            h = imdata.open ('rw')
+            try:
+                for i, axes in enumerate (planes):
+                    handle (i, func (h.readPlane (axes=axes), axes))
+            finally:
+                h.close ()
+        else:
+            from multiprocessing import Pool, cpu_count
+
+            if nproc is None:
+                nproc = cpu_count ()
+
+            ranges = _splitRanges (len (planes), nproc)
+            pool = Pool (nproc, _initWorker, (str (imdata), func, planes))
+
+            try:
+                for chunk in pool.imap_unordered (_processRange, ranges):
+                    for i, result in chunk:
+                        handle (i, result)
+                pool.close ()
+            except:
+                pool.terminate ()
+                raise
+            finally:
+                pool.join ()
+    finally:
+        if outhnd is not None:
+            outhnd.close ()
+
+    return results
@@ -0,0 +1,258 @@
+'''mirtask.imstats - compute image statistics without running IMSTAT'''
+
+# Copyright 2009-2012 Peter Williams
+#
+# This file is part of miriad-python.
+#
+# Miriad-python is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Miriad-python is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import numpy as N
+from mirtask.imparallel import planeCoords
+
+__all__ = ['statsDType', 'parseRegion', 'planeStats']
+
+
+_basicFields = [('npix', N.int64), ('sum', N.double), ('mean', N.double),
+                ('rms', N.double), ('std', N.double), ('min', N.double),
+                ('max', N.double)]
+_robustFields = [('median', N.double), ('mad', N.double)]
+
+def statsDType (robust=False):
+    """Get the structured dtype of the statistics returned by :func:`planeStats`.
+
+:arg bool robust: whether the robust statistics fields are included
+:returns: a Numpy structured dtype
+
+The fields are:
+
+======== ==============================================================
+Field    Meaning
+======== ==============================================================
+npix     The number of unmasked pixels
+sum      The sum of the unmasked pixel values
+mean     The mean of the unmasked pixel values
+rms      The root-mean-square of the pixel values (about zero)
+std      The standard deviation of the pixel values (about the mean)
+min      The smallest unmasked pixel value
+max      The largest unmasked pixel value
+median   (robust only) The median of the unmasked pixel values
+mad      (robust only) The median absolute deviation from the median
+======== ==============================================================
+
+Statistics of empty selections are NaN.
+"""
+    if robust:
+        return N.dtype (_basicFields + _robustFields)
+    return N.dtype (_basicFields)
+
+
+_boxre = re.compile (r'^box\(([-+\d,\s]+)\)(?:\(([-+\d,\s]+)\))?$')
+_imagesre = re.compile (r'^images?\(([-+\d,\s]+)\)$')
+
+def _ints (text, nexpect):
+    vals = [int (x) for x in text.split (',')]
+    if len (vals) != nexpect:
+        raise ValueError ('expected %d values in region, got "%s"' % (nexpect, text))
+    return vals
+
+
+def parseRegion (region, axes):
+    """Parse a simple region specification.
+
+:arg region: the region; see below
+:arg axes: the axis sizes of the image being analyzed
+:type axes: int ndarray
+:returns: ``(rowslice, colslice, mask, zrange)``
+:raises: :exc:`ValueError` if the region can't be understood
+
+*region* may be :const:`None`, meaning the whole image; a boolean
+array of shape ``(axes[1], axes[0])`` whose :const:`True` entries
+select pixels in every plane; or a string using a subset of the
+MIRIAD region syntax in absolute pixels:
+
+* ``box(xmin,ymin,xmax,ymax)``, optionally followed by ``(zmin,zmax)``
+* ``images(zmin,zmax)``
+* ``quarter``, optionally followed by ``(zmin,zmax)``
+
+As in MIRIAD, the pixel numbers in region strings are one-based and
+inclusive, and a leading "abspixel," is accepted. *rowslice* and
+*colslice* index into a plane, *mask* is :const:`None` or a boolean
+array of the shape of the sliced plane, and *zrange* is :const:`None`
+or a zero-based, half-open range of indices along ``axes[2]``.
+"""
+    ncol, nrow = int (axes[0]), int (axes[1])
+    full = (slice (0, nrow), slice (0, ncol))
+
+    if region is None:
+        return full + (None, None)
+
+    if not isinstance (region, basestring):
+        mask = N.asarray (region, dtype=N.bool)
+        if mask.shape != (nrow, ncol):
+            raise ValueError ('region mask must have shape (%d, %d)' % (nrow, ncol))
+        return full + (mask, None)
+
+    text = region.replace (' ', '').lower ()
+    if text.startswith ('abspixel,'):
+        text = text[9:]
+
+    if text.startswith ('quarter'):
+        xlo, ylo = ncol // 4 + 1, nrow // 4 + 1
+        text = 'box(%d,%d,%d,%d)%s' % (xlo, ylo, xlo + ncol // 2 - 1,
+                                       ylo + nrow // 2 - 1, text[7:])
+
+    m = _imagesre.match (text)
+    if m is not None:
+        zmin, zmax = _ints (m.group (1), 2)
+        return full + (None, (zmin - 1, zmax))
+
+    m = _boxre.match (text)
+    if m is None:
+        raise ValueError ('unsupported region "%s"' % region)
+
+    xmin, ymin, xmax, ymax = _ints (m.group (1), 4)
+    if xmin < 1 or ymin < 1 or xmax > ncol or ymax > nrow \
+            or xmin > xmax or ymin > ymax:
+        raise ValueError ('region box %s outside of image' % m.group (1))
+
+    if m.group (2) is None:
+        zrange = None
+    else:
+        zmin, zmax = _ints (m.group (2), 2)
+        zrange = (zmin - 1, zmax)
+
+    return (slice (ymin - 1, ymax), slice (xmin - 1, xmax), None, zrange)
+
+
+def _fillStats (rec, n, s, s2, lo, hi):
+    rec['npix'] = n
+
+    if n == 0:
+        for f in ('sum', 'mean', 'rms', 'std', 'min', 'max'):
+            rec[f] = N.nan
+        return
+
+    mean = s / n
+    rec['sum'] = s
+    rec['mean'] = mean
+    rec['rms'] = N.sqrt (s2 / n)
+    rec['std'] = N.sqrt (max (s2 / n - mean**2, 0.))
+    rec['min'] = lo
+    rec['max'] = hi
+
+
+def _fillRobust (rec, vals):
+    if vals.size == 0:
+        rec['median'] = rec['mad'] = N.nan
+        return
+
+    med = N.median (vals)
+    rec['median'] = med
+    rec['mad'] = N.median (N.abs (vals - med))
+
+
+def planeStats (handle, region=None, robust=False, maxsample=4000000):
+    """Compute per-plane and whole-cube statistics of an image.
+
+:arg handle: the opened image
+:type handle: :class:`mirtask.XYDataSet`
+:arg region: the region to analyze; see :func:`parseRegion`
+:arg bool robust: whether to compute medians and median absolute
+  deviations as well; default :const:`False`
+:arg int maxsample: the maximum number of pixel values retained for
+  the whole-cube robust statistics
+:returns: ``(planes, total, coords)``; see below
+
+This computes what one would usually get by running IMSTAT and
+parsing its output, but without launching a task or losing precision
+in a textual roundtrip. The image is read one plane at a time with
+:meth:`~mirtask.XYDataSet.readPlane`, so memory use is bounded by the
+plane size. Masked pixels are ignored. Sums are accumulated in double
+precision.
+
+The per-plane robust statistics are exact. The whole-cube median and
+MAD are exact if the selection contains at most *maxsample* pixels;
+otherwise they are estimated from a regular subsample of the unmasked
+pixels of every plane, gathered in the same pass.
+
+*planes* is a structured array of dtype ``statsDType (robust)`` with
+one entry per analyzed plane, and *total* is a zero-dimensional array
+of the same dtype holding the statistics of the whole selection.
+*coords* is the list of the coordinates of the analyzed planes, as
+would be passed to :meth:`~mirtask.XYDataSet.setPlane`.
+"""
+    axes = handle.axes
+    rows, cols, regmask, zrange = parseRegion (region, axes)
+
+    coords = planeCoords (axes)
+    if zrange is not None:
+        coords = [c for c in coords
+                  if zrange[0] <= (c[0] if len (c) else 0) < zrange[1]]
+
+    dtype = statsDType (robust)
+    planes = N.zeros (len (coords), dtype=dtype)
+    total = N.zeros ((), dtype=dtype)
+
+    ncol, nrow = axes[:2]
+    buf = N.ma.masked_array (N.empty ((nrow, ncol), dtype=N.float32),
+                             N.empty ((nrow, ncol), dtype=N.bool), copy=False)
+
+    npixsel = (rows.stop - rows.start) * (cols.stop - cols.start) * len (coords)
+    stride = max (1, -(-npixsel // maxsample))
+    samples = []
+
+    tn = 0
+    ts = ts2 = 0.
+    tlo, thi = N.inf, -N.inf
+
+    for i, c in enumerate (coords):
+        handle.readPlane (axes=c, buf=buf)
+        good = ~buf.mask[rows,cols]
+        if regmask is not None:
+            good &= regmask
+
+        vals = buf.data[rows,cols][good].astype (N.double)
+        n = vals.size
+
+        if n:
+            s = vals.sum ()
+            s2 = N.dot (vals, vals)
+            lo, hi = vals.min (), vals.max ()
+        else:
+            s = s2 = 0.
+            lo, hi = N.nan, N.nan
+
+        _fillStats (planes[i], n, s, s2, lo, hi)
+
+        if robust:
+            _fillRobust (planes[i], vals)
+            samples.append (vals[::stride].copy ())
+
+        if n:
+            tn += n
+            ts += s
+            ts2 += s2
+            tlo = min (tlo, lo)
+            thi = max (thi, hi)
+
+    _fillStats (total, tn, ts, ts2, tlo, thi)
+
+    if robust:
+        if len (samples):
+            _fillRobust (total, N.concatenate (samples))
+        else:
+            _fillRobust (total, N.empty (0))
+
+    return planes, total, coords
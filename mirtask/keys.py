@@ -17,8 +17,9 @@
 
 '''mirtask.keys - process task arguments in the MIRIAD style'''
 
+import threading
 import numpy as N
-from mirtask import _miriad_c, _miriad_f, MiriadError
+from mirtask import _miriad_c, _miriad_f_uvdat, MiriadError
 
 
 class KeyHolder (object):
@@ -37,7 +38,7 @@ arguments to a task.
 
 def _mkeya (key, nmax, bufsz=120):
     value = N.chararray ((nmax, bufsz))
-    n = _miriad_f.mkeya (key, value, nmax)
+    n = _miriad_f_uvdat.mkeya (key, value, nmax)
     ret = []
 
     for i in xrange (n):
@@ -53,7 +54,7 @@ def _mkeya (key, nmax, bufsz=120):
 
 def _mkeyf (key, nmax, bufsz=120):
     value = N.chararray ((nmax, bufsz))
-    n = _miriad_f.mkeyf (key, value, nmax)
+    n = _miriad_f_uvdat.mkeyf (key, value, nmax)
     ret = []
 
     for i in xrange (n):
@@ -76,7 +77,7 @@ def _keymatch (key, types, maxout):
     tarr = [str (t).ljust (ml, ' ') for t in types]
     out = N.chararray ((maxout, ml))
     # f2py thinks maxout is optional here, not surew why.
-    nout = _miriad_f.keymatch (key, tarr, out, len (types), maxout)
+    nout = _miriad_f_uvdat.keymatch (key, tarr, out, len (types), maxout)
     ret = []
 
     for i in xrange (nout):
@@ -158,7 +159,7 @@ _typeinfo = {
     'd': _make_getters (float, False, _miriad_c.keyd, _miriad_c.mkeyd),
     'f': _make_getters (str, False, _miriad_c.keyf, _mkeyf),
     'a': _make_getters (str, False, _get_string, _mkeya),
-    't': _make_getters (str, True, _miriad_f.keyt, _miriad_f.mkeyt),
+    't': _make_getters (str, True, _miriad_f_uvdat.keyt, _miriad_f_uvdat.mkeyt),
 }
 
 _formatinfo = {
@@ -185,6 +186,46 @@ def _check_misc (name, kind, format):
 
 KT_SINGLE, KT_MULTI, KT_KEYMATCH, KT_CUSTOM = range (4)
 
+# MIRIAD keeps the parsed command-line arguments in static state that
+# lives from KEYINI to KEYFIN. KeySpec.process always runs the whole
+# cycle, under a lock so that threads don't trample each other, and
+# if it is interrupted by an error, the state is torn down by reset()
+# so that the next call starts afresh.
+
+_keyLock = threading.RLock ()
+_keysActive = False
+
+
+def reset ():
+    """Discard any pending MIRIAD keyword-handling state.
+
+:returns: :const:`True` if there was state to discard
+
+This calls MIRIAD's KEYFIN if keyword processing was started but
+never finished, so that the keyword-handling subsystem can be used
+again in the same process. It is called automatically if
+:meth:`KeySpec.process` is interrupted by an error and when an
+in-process task run by :class:`mirexec.PyModTask` finishes, so it
+rarely needs to be called directly. Any warnings about unused
+keywords that KEYFIN issues in this case are not raised as errors.
+"""
+    global _keysActive
+
+    _keyLock.acquire ()
+    try:
+        if not _keysActive:
+            return False
+
+        _keysActive = False
+        try:
+            _miriad_c.keyfin ()
+        except MiriadError:
+            pass
+        return True
+    finally:
+        _keyLock.release ()
+
+
 class KeySpec (object):
     """:synopsis: Specifies the structure of keywords expected by a task.
 
@@ -347,7 +388,7 @@ argument, the *name* of the keyword. The keyword will take on whatever
 value is returned by *handler*.
 
 The intended usage is for *handler* to manually invoke the lowlevel
-MIRIAD value-fetching routines found in :mod:`mirtask._miriad_f`, but
+MIRIAD value-fetching routines found in :mod:`mirtask._miriad_f_uvdat`, but
 you can obtain a value however you like.
 
 This function returns *self* for convenience in chaining calls.
@@ -505,6 +546,21 @@ issued.
 
 
     def _process (self, args):
+        _keyLock.acquire ()
+        try:
+            try:
+                res = self._processLocked (args)
+            except:
+                reset ()
+                raise
+
+            return res
+        finally:
+            _keyLock.release ()
+
+
+    def _processLocked (self, args):
+        global _keysActive
         from sys import argv
 
         if args is None:
@@ -512,6 +568,7 @@ issued.
         else:
             _miriad_c.keyini ([argv[0]] + list (args))
 
+        _keysActive = True
         res = KeyHolder ()
 
         for name, info in self._keywords.iteritems ():
@@ -549,7 +606,7 @@ issued.
         for name in names:
             optarr.append (name.ljust (ml, ' '))
 
-        present = _miriad_f.options ('options', optarr)
+        present = _miriad_f_uvdat.options ('options', optarr)
 
         for i, name in enumerate (names):
             setattr (res, name, present[i] != 0)
@@ -568,12 +625,13 @@ issued.
                 if not res.nopol:
                     f += 'e'
 
-            _miriad_f.uvdatinp (self._uvdatViskey, f)
+            _miriad_f_uvdat.uvdatinp (self._uvdatViskey, f)
 
         # All done. Check for any unexhausted keywords.
 
+        _keysActive = False
         _miriad_c.keyfin ()
         return res
 
 
-__all__ = ['KeyHolder', 'KeySpec']
+__all__ = ['KeyHolder', 'KeySpec', 'reset']
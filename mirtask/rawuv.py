@@ -0,0 +1,482 @@
+'''mirtask.rawuv - decode UV data directly from the visdata item'''
+
+# Copyright 2009-2012 Peter Williams
+#
+# This file is part of miriad-python.
+#
+# Miriad-python is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Miriad-python is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
+
+import mmap, os.path, struct
+import numpy as N
+
+__all__ = ['RawUVError', 'RawUVReader', 'parallelMap']
+
+
+class RawUVError (Exception):
+    """An error raised when a visdata stream can't be decoded."""
+    pass
+
+
+# The visdata format, from subs/uvio.c. The stream is a sequence of
+# entries, each starting with a four-byte header whose first byte is
+# a variable number (a line index into the vartable item) and whose
+# third byte is the entry kind. A size entry is followed by a
+# big-endian int giving the length of the variable's value in bytes.
+# A data entry's value starts at the next multiple of the variable's
+# element size and the following entry starts at the next multiple
+# of eight bytes. An end-of-record entry occupies eight bytes.
+
+_VAR_SIZE = 0
+_VAR_DATA = 1
+_VAR_EOR = 2
+_HDR_SIZE = 4
+_ALIGN = 8
+
+_extSize = {'a': 1, 'b': 1, 'j': 2, 'i': 4, 'r': 4, 'd': 8, 'c': 8}
+_extDType = {'j': '>i2', 'i': '>i4', 'r': '>f4', 'd': '>f8', 'c': '>c8'}
+_natDType = {'j': N.int16, 'i': N.int32, 'r': N.float32, 'd': N.double,
+             'c': N.complex64}
+
+# The flags item is a MIRIAD mask: a four-byte item header followed by
+# big-endian ints that each hold 31 flags in their low bits.
+
+_MASK_BITS = 31
+_MASK_OFFSET = 4
+
+
+def _roundup (n, m):
+    return ((n + m - 1) // m) * m
+
+
+def _mapfile (path):
+    f = open (path, 'rb')
+    try:
+        if os.fstat (f.fileno ()).st_size == 0:
+            return None
+        return mmap.mmap (f.fileno (), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close ()
+
+
+class RawUVReader (object):
+    """:synopsis: decode UV data without going through UVIO
+
+:arg str path: the path of the UV dataset
+:arg int vislen: the number of valid bytes in the visdata item, or
+  :const:`None` to use the "vislen" header item if it can be read
+  and the file size otherwise
+
+This class parses the "vartable" item of a UV dataset and
+memory-maps its "visdata" and "flags" items, decoding the variable
+updates and correlation records with Numpy. It is read-only and
+shares no state with MIRIAD's I/O libraries, so any number of
+processes can use it on one dataset at once.
+
+Because UV variables keep their values until they are updated,
+records can't be decoded starting from an arbitrary position in the
+stream. :meth:`index` therefore makes one fast pass over the entry
+headers, splitting the stream at record boundaries into chunks that
+each carry a snapshot of the variable state at their start. The
+chunks can then be decoded independently, for instance by the workers
+of :func:`parallelMap`.
+
+The decoded correlation data, flags, and preambles are identical to
+those returned by :meth:`mirtask.UVDataSet.lowlevelRead` on a dataset
+for which no selection or line processing has been set up: scaled
+16-bit correlations are multiplied by "tscale" in single precision
+just as UVIO does. Only the spectral ("corr") data are decoded, not
+the wideband data.
+"""
+
+    def __init__ (self, path, vislen=None):
+        self.path = path
+        self.vartypes = []
+        self.varnames = []
+        self.varindex = {}
+
+        for line in open (os.path.join (path, 'vartable')):
+            line = line.strip ()
+            if not len (line):
+                continue
+            vtype, name = line.split (None, 1)
+            self.vartypes.append (vtype)
+            self.varnames.append (name)
+            self.varindex[name] = len (self.varnames) - 1
+
+        for required in ('corr', 'coord', 'time', 'baseline'):
+            if required not in self.varindex:
+                raise RawUVError ('dataset %s has no "%s" UV variable'
+                                  % (path, required))
+
+        self._corr = self.varindex['corr']
+        self._vis = _mapfile (os.path.join (path, 'visdata'))
+
+        fpath = os.path.join (path, 'flags')
+        if os.path.exists (fpath):
+            self._flags = _mapfile (fpath)
+        else:
+            self._flags = None
+
+        if self._vis is None:
+            size = 0
+        else:
+            size = len (self._vis)
+
+        if vislen is None:
+            vislen = self._readVislen (size)
+        self.vislen = min (vislen, size)
+        self._start = self._findStart ()
+
+
+    def _readVislen (self, default):
+        # The visdata file can extend past the last record, so prefer
+        # the length recorded in the header. That takes the usual I/O
+        # layer, but only once and only in the process that indexes.
+        try:
+            from mirtask import UVDataSet
+        except ImportError:
+            return default
+
+        h = UVDataSet (self.path, 'rw')
+        try:
+            return int (h.getScalarItem ('vislen', default))
+        finally:
+            h.close ()
+
+
+    def _validHeader (self, ofs):
+        if ofs + _HDR_SIZE > self.vislen:
+            return False
+        idx, pad1, kind, pad2 = struct.unpack_from ('4B', self._vis, ofs)
+        return pad1 == 0 and pad2 == 0 and kind <= _VAR_EOR \
+            and (kind == _VAR_EOR or idx < len (self.varnames))
+
+
+    def _findStart (self):
+        # Be tolerant of an item header preceding the stream.
+        if self.vislen == 0 or self._validHeader (0):
+            return 0
+        if self._validHeader (_ALIGN):
+            return _ALIGN
+        raise RawUVError ('cannot find the start of the visdata stream in %s'
+                          % self.path)
+
+
+    def _walk (self, ofs, stop, lengths, dataofs, onrecord):
+        """Advance through ``[ofs, stop)``, updating *lengths* and
+        *dataofs* in place and calling ``onrecord (nextofs)`` at the end
+        of each record. Stops early if *onrecord* returns True. Returns
+        the offset at which scanning stopped."""
+
+        vis = self._vis
+        unpack = struct.unpack_from
+        sizes = [_extSize[t] for t in self.vartypes]
+        nvars = len (sizes)
+
+        while ofs < stop:
+            idx, pad1, kind, pad2 = unpack ('4B', vis, ofs)
+
+            if kind == _VAR_DATA and idx < nvars:
+                dofs = ofs + _roundup (_HDR_SIZE, sizes[idx])
+                dataofs[idx] = dofs
+                ofs = _roundup (dofs + lengths[idx], _ALIGN)
+            elif kind == _VAR_SIZE and idx < nvars:
+                lengths[idx] = unpack ('>i', vis, ofs + _HDR_SIZE)[0]
+                ofs += _HDR_SIZE + 4
+            elif kind == _VAR_EOR:
+                ofs += _ALIGN
+                if onrecord (ofs):
+                    break
+            else:
+                raise RawUVError ('corrupt visdata entry at offset %d in %s'
+                                  % (ofs, self.path))
+
+        return ofs
+
+
+    def _nchan (self, lengths):
+        vtype = self.vartypes[self._corr]
+        if vtype == 'c':
+            return lengths[self._corr] // _extSize[vtype]
+        return lengths[self._corr] // (2 * _extSize[vtype])
+
+
+    def index (self, chunkrecs=16384):
+        """Split the UV data into independently decodable chunks.
+
+:arg int chunkrecs: the number of records per chunk
+:returns: a list of chunk descriptors
+
+The descriptors are picklable and can be passed to :meth:`records`
+or :meth:`readChunk`, in this process or another. Only the entry
+headers are examined, so this is much faster than decoding the data.
+"""
+        nvars = len (self.varnames)
+        lengths = [0] * nvars
+        dataofs = [-1] * nvars
+        chunks = []
+        state = {'start': self._start, 'rec0': 0, 'flag0': 0, 'nrec': 0,
+                 'nflag': 0, 'snap': (tuple (lengths), tuple (dataofs))}
+
+        def onrecord (ofs):
+            state['nrec'] += 1
+            state['nflag'] += self._nchan (lengths)
+
+            if state['nrec'] - state['rec0'] == chunkrecs:
+                chunks.append ((state['start'], ofs, state['rec0'], state['nrec'],
+                                state['flag0'], state['nflag']) + state['snap'])
+                state['start'] = ofs
+                state['rec0'] = state['nrec']
+                state['flag0'] = state['nflag']
+                state['snap'] = (tuple (lengths), tuple (dataofs))
+
+        self._walk (self._start, self.vislen, lengths, dataofs, onrecord)
+
+        if state['nrec'] > state['rec0']:
+            chunks.append ((state['start'], self.vislen, state['rec0'], state['nrec'],
+                            state['flag0'], state['nflag']) + state['snap'])
+
+        return chunks
+
+
+    def _wholeChunk (self):
+        nvars = len (self.varnames)
+        return (self._start, self.vislen, 0, None, 0, None,
+                (0,) * nvars, (-1,) * nvars)
+
+
+    def _readFlags (self, first, stop):
+        n = stop - first
+        if self._flags is None:
+            return N.ones (n, dtype=N.bool)
+
+        w0 = first // _MASK_BITS
+        w1 = (stop + _MASK_BITS - 1) // _MASK_BITS
+        words = N.frombuffer (self._flags, dtype='>i4', count=w1 - w0,
+                              offset=_MASK_OFFSET + 4 * w0).astype (N.int32)
+        bits = (words[:,None] >> N.arange (_MASK_BITS, dtype=N.int32)) & 1
+        start = first - w0 * _MASK_BITS
+        return bits.ravel ()[start:start+n].astype (N.bool)
+
+
+    def value (self, name, lengths, dataofs):
+        """Decode the value of a UV variable from a state snapshot.
+
+:arg str name: the variable name
+:arg lengths: the current value lengths of the variables
+:arg dataofs: the current value offsets of the variables
+:returns: a native-endian ndarray, or a string for character
+  variables, or :const:`None` if the variable hasn't been set
+"""
+        idx = self.varindex[name]
+        if dataofs[idx] < 0:
+            return None
+
+        vtype = self.vartypes[idx]
+        if vtype == 'a':
+            return self._vis[dataofs[idx]:dataofs[idx]+lengths[idx]]
+
+        count = lengths[idx] // _extSize[vtype]
+        return N.frombuffer (self._vis, dtype=_extDType[vtype], count=count,
+                             offset=dataofs[idx]).astype (_natDType[vtype])
+
+
+    def _decodeCorr (self, lengths, dataofs):
+        idx = self._corr
+        vtype = self.vartypes[idx]
+        nchan = self._nchan (lengths)
+
+        if vtype == 'r':
+            raw = N.frombuffer (self._vis, dtype='>f4', count=2 * nchan,
+                                offset=dataofs[idx])
+            return raw.astype (N.float32).view (N.complex64)
+
+        if vtype == 'j':
+            raw = N.frombuffer (self._vis, dtype='>i2', count=2 * nchan,
+                                offset=dataofs[idx])
+            tscale = self.value ('tscale', lengths, dataofs)
+            if tscale is None:
+                raise RawUVError ('scaled correlations but no "tscale" in %s'
+                                  % self.path)
+            return (raw.astype (N.float32) * tscale[0]).view (N.complex64)
+
+        if vtype == 'c':
+            return N.frombuffer (self._vis, dtype='>c8', count=nchan,
+                                 offset=dataofs[idx]).astype (N.complex64)
+
+        raise RawUVError ('unsupported "corr" type %s in %s' % (vtype, self.path))
+
+
+    def records (self, chunk=None, uvw=False):
+        """Decode UV records.
+
+:arg chunk: a descriptor returned by :meth:`index`, or :const:`None`
+  (the default) for the whole dataset
+:arg bool uvw: whether the preamble should include *w*, as with the
+  "uvw/time/baseline" preamble type; default :const:`False`
+:returns: a generator of ``(state, preamble, data, flags)``
+
+*preamble* is a double ndarray of 4 or 5 elements, *data* is a
+complex64 ndarray, and *flags* is a bool ndarray. New arrays are
+yielded for each record. *state* is a ``(lengths, dataofs)`` pair
+describing the current variable values, which can be passed to
+:meth:`value` to get the values of other UV variables.
+"""
+        if chunk is None:
+            chunk = self._wholeChunk ()
+
+        start, stop, rec0, rec1, flag0, flag1, snaplen, snapofs = chunk
+        lengths = list (snaplen)
+        dataofs = list (snapofs)
+        ci = self.varindex['coord']
+        ti = self.varindex['time']
+        bi = self.varindex['baseline']
+
+        if flag1 is not None:
+            allflags = self._readFlags (flag0, flag1)
+        else:
+            allflags = None
+
+        state = {'ofs': start, 'flag': 0, 'gotrec': False}
+        npre = uvw and 5 or 4
+        vis = self._vis
+
+        def onrecord (ofs):
+            state['ofs'] = ofs
+            state['gotrec'] = True
+            return True
+
+        while state['ofs'] < stop:
+            state['gotrec'] = False
+            self._walk (state['ofs'], stop, lengths, dataofs, onrecord)
+            if not state['gotrec']:
+                break # truncated final record
+
+            pre = N.zeros (npre, dtype=N.double)
+            coord = N.frombuffer (vis, dtype='>f8', count=lengths[ci] // 8,
+                                  offset=dataofs[ci])
+            nc = min (coord.size, npre - 2)
+            pre[:nc] = coord[:nc]
+            pre[-2] = N.frombuffer (vis, dtype='>f8', count=1, offset=dataofs[ti])[0]
+            pre[-1] = N.frombuffer (vis, dtype='>f4', count=1, offset=dataofs[bi])[0]
+
+            data = self._decodeCorr (lengths, dataofs)
+            nchan = data.size
+
+            if allflags is not None:
+                flags = allflags[state['flag']:state['flag']+nchan]
+            else:
+                flags = self._readFlags (flag0 + state['flag'],
+                                         flag0 + state['flag'] + nchan)
+            state['flag'] += nchan
+
+            yield (tuple (lengths), tuple (dataofs)), pre, data, flags
+
+
+    def readChunk (self, chunk=None, uvw=False):
+        """Decode a chunk of UV records into arrays.
+
+:arg chunk: a descriptor returned by :meth:`index`, or :const:`None`
+  (the default) for the whole dataset
+:arg bool uvw: whether the preambles should include *w*
+:returns: ``(preambles, nchans, data, flags)``
+
+*preambles* is a double ndarray of shape ``(nrec, 4)`` or ``(nrec,
+5)``, *nchans* gives the number of channels in each record, and
+*data* and *flags* are the concatenated complex64 correlation data
+and bool flags of all of the records.
+"""
+        pres, nchans, datas, flagses = [], [], [], []
+
+        for state, pre, data, flags in self.records (chunk, uvw):
+            pres.append (pre)
+            nchans.append (data.size)
+            datas.append (data)
+            flagses.append (flags)
+
+        npre = uvw and 5 or 4
+
+        if not len (pres):
+            return (N.zeros ((0, npre), dtype=N.double), N.zeros (0, dtype=N.int),
+                    N.zeros (0, dtype=N.complex64), N.zeros (0, dtype=N.bool))
+
+        return (N.vstack (pres), N.asarray (nchans, dtype=N.int),
+                N.concatenate (datas), N.concatenate (flagses))
+
+
+# Parallel decoding. Each worker maps the dataset itself.
+
+_workerReader = None
+_workerFunc = None
+
+
+def _initWorker (path, vislen, func):
+    global _workerReader, _workerFunc
+    _workerReader = RawUVReader (path, vislen)
+    _workerFunc = func
+
+
+def _processChunk (chunk):
+    return _workerFunc (_workerReader, chunk)
+
+
+def _defaultFunc (reader, chunk):
+    return reader.readChunk (chunk)
+
+
+def parallelMap (path, func=None, nproc=None, chunkrecs=16384):
+    """Decode a UV dataset in parallel.
+
+:arg str path: the path of the UV dataset
+:arg func: the function to apply to each chunk, called as
+  ``func (reader, chunk)`` where *reader* is a :class:`RawUVReader`;
+  :const:`None` (the default) means to return the result of
+  :meth:`RawUVReader.readChunk`
+:arg int nproc: the number of worker processes; :const:`None` (the
+  default) means one per CPU
+:arg int chunkrecs: the number of records per chunk
+:returns: a list of the results of *func* for each chunk, in stream order
+
+The dataset is indexed in the calling process with
+:meth:`RawUVReader.index` and the chunks are decoded in a pool of
+worker processes. *func* must be picklable, which in practice means
+that it must be defined at the top level of a module. If *nproc* is
+1, everything happens in the calling process.
+"""
+    if func is None:
+        func = _defaultFunc
+
+    reader = RawUVReader (path)
+    chunks = reader.index (chunkrecs)
+
+    if nproc == 1 or len (chunks) < 2:
+        return [func (reader, c) for c in chunks]
+
+    from multiprocessing import Pool, cpu_count
+
+    if nproc is None:
+        nproc = cpu_count ()
+
+    pool = Pool (nproc, _initWorker, (path, reader.vislen, func))
+
+    try:
+        results = pool.map (_processChunk, chunks, 1)
+        pool.close ()
+    except:
+        pool.terminate ()
+        raise
+    finally:
+        pool.join ()
+
+    return results
@@ -20,7 +20,7 @@
 import numpy as N
 from mirtask import MiriadError
 
-__all__ = ['GainsReader', 'readBandpass' ]
+__all__ = ['GainsReader', 'readBandpass', 'BandpassApplier']
 
 class GainsReader (object):
     """Read in gains from a Miriad data set. Code based on gplist.for."""
@@ -162,10 +162,12 @@ def readBandpass (dset):
         hdfreq.readInto (ofs, freqbuf)
         ofs += 8 * 2
 
-        # This could be more efficient, but it's not a huge deal.
-        for j in xrange (0, nschans[i]):
-            freqs[n] = freqbuf[0] + j * freqbuf[1]
-            n += 1
+        nschan = nschans[i]
+        if n + nschan > nchan0:
+            break
+
+        freqs[n:n+nschan] = freqbuf[0] + N.arange (nschan) * freqbuf[1]
+        n += nschan
 
     if nschans.sum () != nchan0:
         raise RuntimeError ('Disagreeing number of channels and spectral window widths '
@@ -182,3 +184,151 @@ def readBandpass (dset):
     hdbpass.close ()
 
     return nschans, freqs, gains
+
+
+# Feed indices for each polarization code, as in uvgnfac. Indexed by
+# "pol + 8" like util._polToFPol; -1 indicates a polarization that
+# can't be associated with a pair of feeds.
+
+_polToFeeds = N.asarray ([[1, 0], [0, 1], [1, 1], [0, 0], # YX XY YY XX
+                          [1, 0], [0, 1], [1, 1], [0, 0], # LR RL LL RR
+                          [-1, -1], # II
+                          [-1, -1], [-1, -1], [-1, -1], [-1, -1], # I Q U V
+                          [-1, -1], [-1, -1]], # QQ UU
+                         dtype=N.int)
+
+
+class BandpassApplier (object):
+    """Apply the bandpass table of a UV dataset to blocks of data.
+
+:arg dset: an open UV dataset with a bandpass table
+
+This class reads in the bandpass table of *dset* using
+:func:`readBandpass` and applies it to UV data read through some
+other path, so that a bandpass can be applied without relying on the
+UVDAT subsystem. The frequencies of the table channels are kept in
+*freqs* and the solutions in *gains*, as returned by
+:func:`readBandpass`.
+
+MIRIAD stores bandpass solutions as the factors by which the data
+should be multiplied, i.e., the inverses of the antenna-feed
+bandpass responses. Applying the table therefore divides the data
+by the bandpass responses.
+"""
+
+    nschans = None
+    freqs = None
+    gains = None
+
+    _lastfreqs = None
+    _interp = None
+
+    def __init__ (self, dset):
+        self.nschans, self.freqs, self.gains = readBandpass (dset)
+        self._sortidx = N.argsort (self.freqs, kind='mergesort')
+
+
+    def interpolate (self, freqs):
+        """Interpolate the bandpass solutions onto a set of frequencies.
+
+:arg freqs: the sky frequencies of the data channels, in GHz
+:type freqs: 1D double ndarray
+:returns: ``(nants, nfeeds, nchan)`` complex64 ndarray of bandpass
+  factors
+
+The solutions are linearly interpolated in their real and imaginary
+parts. Channels that fall outside of the frequency range of the table,
+or that neighbor a flagged (zero) solution, get a factor of zero. The
+result for the most recent *freqs* is cached, so repeated calls with
+the same frequencies are cheap.
+"""
+        freqs = N.asarray (freqs, dtype=N.double)
+
+        if self._lastfreqs is not None and \
+                self._lastfreqs.shape == freqs.shape and \
+                (self._lastfreqs == freqs).all ():
+            return self._interp
+
+        nants, nfeeds, nchan = self.gains.shape
+        sfreqs = self.freqs[self._sortidx]
+        sgains = self.gains[:,:,self._sortidx]
+        svalid = (sgains != 0).astype (N.double)
+        result = N.empty ((nants, nfeeds, freqs.size), dtype=N.complex64)
+
+        for i in xrange (nants):
+            for j in xrange (nfeeds):
+                g = sgains[i,j]
+                valid = N.interp (freqs, sfreqs, svalid[i,j], left=0., right=0.)
+                result[i,j].real = N.interp (freqs, sfreqs, g.real)
+                result[i,j].imag = N.interp (freqs, sfreqs, g.imag)
+                result[i,j][valid < 0.999999] = 0
+
+        self._lastfreqs = freqs.copy ()
+        self._interp = result
+        return result
+
+
+    def apply (self, data, flags, ant1, ant2, pols, freqs):
+        """Apply the bandpass to a block of UV data in place.
+
+:arg data: the visibilities; modified in-place
+:type data: complex ndarray of shape ``(nrec, nchan)``
+:arg flags: the flags, nonzero meaning good data; modified in-place
+:type flags: integer or bool ndarray of shape ``(nrec, nchan)``
+:arg ant1: the first (one-based) antenna number of each record
+:type ant1: integer ndarray of shape ``(nrec, )``
+:arg ant2: the second (one-based) antenna number of each record
+:type ant2: integer ndarray of shape ``(nrec, )``
+:arg pols: the MIRIAD polarization code of each record
+:type pols: integer ndarray of shape ``(nrec, )``
+:arg freqs: the sky frequencies of the data channels, in GHz
+:type freqs: double ndarray of shape ``(nchan, )``
+:returns: *data*
+:raises: :exc:`ValueError` if a record has a Stokes polarization
+
+The bandpass factor for each record is ``g[ant1,f1] *
+conj(g[ant2,f2])``, where the feeds *f1* and *f2* are derived from
+the polarization code in the same way as in MIRIAD's ``uvgnfac``.
+Channels with a zero bandpass factor, and records with antennas
+not present in the table, are flagged. One-dimensional *data* and
+*flags* are treated as a single record.
+"""
+        data = N.atleast_2d (data)
+        flags = N.atleast_2d (flags)
+        ant1 = N.atleast_1d (N.asarray (ant1, dtype=N.int)) - 1
+        ant2 = N.atleast_1d (N.asarray (ant2, dtype=N.int)) - 1
+        pols = N.atleast_1d (N.asarray (pols, dtype=N.int))
+
+        if data.shape != flags.shape:
+            raise ValueError ('data and flags must have the same shape')
+        if ant1.size != data.shape[0] or ant2.size != data.shape[0] \
+                or pols.size != data.shape[0]:
+            raise ValueError ('need one antenna pair and polarization per record')
+
+        if ((pols < -8) | (pols > 6)).any ():
+            raise ValueError ('illegal polarization code in %s' % pols)
+
+        feeds = _polToFeeds[pols + 8]
+        if (feeds < 0).any ():
+            raise ValueError ('cannot apply antenna bandpasses to Stokes data')
+
+        nants, nfeeds, nchan = self.gains.shape
+
+        if nfeeds == 1:
+            feeds = N.zeros_like (feeds)
+
+        table = self.interpolate (freqs)
+        if table.shape[2] != data.shape[1]:
+            raise ValueError ('expected %d frequencies, got %d' %
+                              (data.shape[1], table.shape[2]))
+
+        bad = (ant1 < 0) | (ant1 >= nants) | (ant2 < 0) | (ant2 >= nants)
+        N.clip (ant1, 0, nants - 1, ant1)
+        N.clip (ant2, 0, nants - 1, ant2)
+
+        factor = table[ant1,feeds[:,0]] * table[ant2,feeds[:,1]].conj ()
+        factor[bad] = 0
+
+        data *= factor
+        flags[factor == 0] = 0
+        return data
@@ -0,0 +1,340 @@
+'''mirtask.timeaver - average UV data in time without running UVAVER'''
+
+# Copyright 2009-2012 Peter Williams
+#
+# This file is part of miriad-python.
+#
+# Miriad-python is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Miriad-python is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as N
+from mirtask import util, convertFlags
+
+__all__ = ['WEIGHT_NONE', 'WEIGHT_VARIANCE', 'TimeAverager', 'timeAverage']
+
+WEIGHT_NONE = 'none'
+WEIGHT_VARIANCE = 'variance'
+
+
+class TimeAverager (object):
+    """:synopsis: accumulate UV records and write time averages
+
+:arg outhnd: the output dataset, opened for writing
+:type outhnd: :class:`mirtask.UVDataSet`
+:arg float interval: the averaging interval in minutes
+:arg str weighting: :const:`WEIGHT_NONE` to weight all records
+  equally, or :const:`WEIGHT_VARIANCE` to weight them by the inverse
+  of their variance as computed by :meth:`mirtask.UVDataSet.getVariance`
+
+Records are passed to :meth:`add` in the order in which they're read
+and are summed, channel by channel, into accumulators indexed by the
+PBP32 code of their baseline and polarization. Flagged channels are
+not accumulated. An averaging interval starts with the first record
+added after a flush, and when a record arrives that is at least
+*interval* minutes later than that (or earlier, or with a different
+number of channels, or from a different input dataset) the averages of
+the interval are written to *outhnd* before the record is accumulated.
+Call :meth:`flush` after the last record.
+
+Each output record has the weighted mean of the data, coordinates,
+and time of the records that went into it. A channel is flagged if no
+good data were accumulated into it. The variance of each output record
+is propagated from those of its inputs by writing an "inttime"
+variable that makes MIRIAD's radiometer equation yield it, given the
+values of the other variables in the last input record. If the inputs
+have no variance information, "inttime" is the summed integration
+time of the inputs; if only some of them do, the variance is that of
+the weighted mean of those that do. Records with nonpositive variance
+are discarded when weighting by variance. UV variables are
+copied to the output with :meth:`mirtask.UVDataSet.copyLineVars` and
+:meth:`mirtask.UVDataSet.copyMarkedVars`; :meth:`add` does this for
+every record, after flushing, so that each average is written with the
+variables that were current during its interval.
+"""
+
+    def __init__ (self, outhnd, interval, weighting=WEIGHT_NONE):
+        if interval <= 0:
+            raise ValueError ('averaging interval must be positive (got %f)' % interval)
+        if weighting not in (WEIGHT_NONE, WEIGHT_VARIANCE):
+            raise ValueError ('unknown weighting "%s"' % weighting)
+
+        self.outhnd = outhnd
+        self.interval = interval / 1440.
+        self.weighting = weighting
+        self.ninput = self.noutput = 0
+
+        self._prevhnd = None
+        self._nchan = None
+        self._tstart = None
+        self._slots = {}
+        self._alloc (0, 64)
+
+
+    def _alloc (self, nchan, nslot):
+        self._nchan = nchan
+        self._nalloc = nslot
+        self._sumdata = N.zeros ((nslot, nchan), dtype=N.complex128)
+        self._sumwt = N.zeros ((nslot, nchan), dtype=N.double)
+        self._sumcoord = N.zeros ((nslot, 3), dtype=N.double)
+        self._sumrecwt = N.zeros (nslot, dtype=N.double)
+        self._sumvarwt = N.zeros (nslot, dtype=N.double)
+        self._inttime = N.zeros (nslot, dtype=N.double)
+        self._sumw2var = N.zeros (nslot, dtype=N.double)
+        self._refvt = N.zeros (nslot, dtype=N.double)
+        self._bl = N.zeros (nslot, dtype=N.int)
+        self._pol = N.zeros (nslot, dtype=N.int)
+        self._good = N.empty (nchan, dtype=N.bool)
+        self._sumtime = 0.
+        self._ntime = 0
+
+
+    def _grow (self):
+        # Double the accumulator arrays when a new baseline or
+        # polarization is seen and they're full.
+        n = self._nalloc
+        for name in ('_sumdata', '_sumwt', '_sumcoord', '_sumrecwt',
+                     '_sumvarwt', '_inttime', '_sumw2var', '_refvt', '_bl',
+                     '_pol'):
+            old = getattr (self, name)
+            new = N.zeros ((2 * n, ) + old.shape[1:], dtype=old.dtype)
+            new[:n] = old
+            setattr (self, name, new)
+        self._nalloc = 2 * n
+
+
+    def add (self, inp, preamble, data, flags):
+        """Accumulate a UV record.
+
+:arg inp: the dataset the record was read from
+:type inp: :class:`mirtask.UVDataSet`
+:arg preamble: the record preamble, of type "uvw/time/baseline" or
+  "uv/time/baseline"
+:type preamble: double ndarray
+:arg data: the record data
+:type data: complex ndarray
+:arg flags: the record flags, in any of the formats described in
+  :func:`mirtask.flagsBuffer`
+:type flags: ndarray
+:returns: *self*
+"""
+        nchan = data.size
+        ncoord = preamble.size - 2
+        t = preamble[ncoord]
+
+        if self._tstart is not None and (inp is not self._prevhnd or
+                                         nchan != self._nchan or
+                                         t < self._tstart or
+                                         t - self._tstart >= self.interval):
+            self.flush ()
+
+        if inp is not self._prevhnd:
+            self._prevhnd = inp
+            inp.initVarsAsInput (' ')
+            self.outhnd.initVarsAsOutput (inp, ' ')
+
+        inp.copyLineVars (self.outhnd)
+        inp.copyMarkedVars (self.outhnd)
+        self.ninput += 1
+
+        var = inp.getVariance ()
+
+        if self.weighting == WEIGHT_VARIANCE:
+            if var <= 0:
+                return self
+            w = 1. / var
+        else:
+            w = 1.
+
+        if nchan != self._nchan:
+            self._alloc (nchan, self._nalloc)
+        if self._tstart is None:
+            self._tstart = t
+
+        bl = int (preamble[ncoord+1])
+        pol = inp.getPol ()
+        m1, m2 = util.decodeBaseline (bl)
+        key = util.bpToPBP32 (util.aap2bp (m1, m2, pol))
+
+        slot = self._slots.get (key)
+        if slot is None:
+            slot = len (self._slots)
+            if slot == self._nalloc:
+                self._grow ()
+            self._slots[key] = slot
+            self._bl[slot] = bl
+            self._pol[slot] = pol
+
+        good = convertFlags (flags, self._good, nchan)
+        wts = good * w
+        self._sumdata[slot] += data * wts
+        self._sumwt[slot] += wts
+        self._sumcoord[slot,:ncoord] += w * preamble[:ncoord]
+        self._sumrecwt[slot] += w
+        inttime = inp.getScalar ('inttime', 0.)
+        self._inttime[slot] += inttime
+        if var > 0:
+            # The variance is inversely proportional to inttime.
+            self._sumvarwt[slot] += w
+            self._sumw2var[slot] += w * w * var
+            self._refvt[slot] = var * inttime
+        self._sumtime += t
+        self._ntime += 1
+        self._ncoord = ncoord
+        return self
+
+
+    def flush (self):
+        """Write the averages of the current interval and reset the
+accumulators.
+
+:returns: *self*
+"""
+        nslot = len (self._slots)
+        if nslot == 0:
+            self._tstart = None
+            return self
+
+        outhnd = self.outhnd
+        ncoord = self._ncoord
+        if ncoord == 3:
+            outhnd.setPreambleType ('uvw', 'time', 'baseline')
+        else:
+            outhnd.setPreambleType ('uv', 'time', 'baseline')
+
+        # Write the slots grouped by baseline, with polarizations in
+        # the usual MIRIAD order.
+        bl = self._bl[:nslot]
+        pol = self._pol[:nslot]
+        order = N.lexsort ((N.abs (pol), bl))
+
+        sumwt = self._sumwt[:nslot]
+        avg = (self._sumdata[:nslot] / N.maximum (sumwt, 1e-300)).astype (N.complex64)
+        good = sumwt > 0
+        coords = self._sumcoord[:nslot,:ncoord] / \
+            N.maximum (self._sumrecwt[:nslot], 1e-300)[:,None]
+
+        # Only the records with a variance are counted here, so that
+        # mixing in records without one doesn't shrink the variance.
+        sumw2var = self._sumw2var[:nslot]
+        inttime = N.where (sumw2var > 0,
+                           self._refvt[:nslot] * self._sumvarwt[:nslot]**2 /
+                           N.maximum (sumw2var, 1e-300),
+                           self._inttime[:nslot])
+
+        preamble = N.empty (ncoord + 2, dtype=N.double)
+        preamble[ncoord] = self._sumtime / self._ntime
+        lastpol = lastnpol = None
+
+        i = 0
+        while i < nslot:
+            j = i
+            while j < nslot and bl[order[j]] == bl[order[i]]:
+                j += 1
+
+            if j - i != lastnpol:
+                outhnd.writeVarInt ('npol', j - i)
+                lastnpol = j - i
+
+            for s in order[i:j]:
+                if pol[s] != lastpol:
+                    outhnd.writeVarInt ('pol', int (pol[s]))
+                    lastpol = pol[s]
+
+                preamble[:ncoord] = coords[s]
+                preamble[ncoord+1] = bl[s]
+                outhnd.writeVarFloat ('inttime', inttime[s])
+                outhnd.write (preamble, avg[s], good[s])
+                self.noutput += 1
+
+            i = j
+
+        self._slots = {}
+        self._sumdata.fill (0)
+        self._sumwt.fill (0)
+        self._sumcoord.fill (0)
+        self._sumrecwt.fill (0)
+        self._sumvarwt.fill (0)
+        self._inttime.fill (0)
+        self._sumw2var.fill (0)
+        self._sumtime = 0.
+        self._ntime = 0
+        self._tstart = None
+        return self
+
+
+def timeAverage (gen, out, interval, weighting=WEIGHT_NONE,
+                 banner='PYTHON timeaver: time average', args=None):
+    """Average UV data in time into a new dataset.
+
+:arg gen: the source of UV data
+:type gen: iterable of ``(handle, preamble, data, flags)``, as
+  yielded by :func:`mirtask.uvdat.read`
+:arg out: the output dataset, which must not yet exist
+:type out: :class:`miriad.VisData`
+:arg float interval: the averaging interval in minutes
+:arg str weighting: the weighting scheme; see :class:`TimeAverager`
+:arg str banner: a message to write into the output's history
+:arg args: the command-line arguments to log in the output's history,
+  or :const:`None` to log none
+:type args: list of str
+:returns: the :class:`TimeAverager` that did the work, which records
+  the number of records read and written in its *ninput* and
+  *noutput* attributes, or :const:`None` if there were no data
+
+If an exception is raised while averaging, *out* is deleted.
+
+This does in one pass what would otherwise take a UVCAT to apply the
+calibration tables followed by a UVAVER (or
+:meth:`miriad.VisData.averTo`): calibration is applied by the UVDAT
+layer as *gen* reads the data, and the calibrated records are
+averaged as they arrive. For instance::
+
+  gen = uvdat.setupAndRead (vis, '3', False, flagtype=FLAGS_BOOL)
+  timeaver.timeAverage (gen, VisData ('averaged'), 5.)
+
+The preambles must be of type "uvw/time/baseline" or
+"uv/time/baseline", which is the case for the UVDAT options "3" and
+"w" or the default options, respectively.
+"""
+    outhnd = out.open ('c')
+    aver = None
+
+    try:
+        for inp, preamble, data, flags in gen:
+            if aver is None:
+                corrtype, _, _ = inp.probeVar ('corr')
+                if corrtype in ('r', 'j', 'c'):
+                    outhnd.setCorrelationType (corrtype)
+
+                inp.copyItem (outhnd, 'history')
+                outhnd.openHistory ()
+                outhnd.writeHistory (banner)
+                if args is not None:
+                    outhnd.logInvocation ('PYTHON timeaver', args)
+                outhnd.writeHistory ('PYTHON timeaver: interval=%f weighting=%s'
+                                     % (interval, weighting))
+                outhnd.closeHistory ()
+
+                aver = TimeAverager (outhnd, interval, weighting)
+
+            aver.add (inp, preamble, data, flags)
+
+        if aver is not None:
+            aver.flush ()
+    except Exception:
+        outhnd.close ()
+        out.delete ()
+        raise
+
+    outhnd.close ()
+    return aver
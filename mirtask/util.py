@@ -18,7 +18,7 @@
 # along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as N
-from mirtask import _miriad_f
+from mirtask import _miriad_f_coord, _miriad_f_grid
 
 # Banner printing (and Id string decoding)
 
@@ -240,12 +240,12 @@ See also :func:`checkusage` and :func:`showusage`.
 
 def decodeBaseline (encoded, check=True):
     """Decode an encoded baseline double into two antenna numbers."""
-    return _miriad_f.basants (encoded, check)
+    return _miriad_f_coord.basants (encoded, check)
 
 def encodeBaseline (ant1, ant2):
     """Encode a pair of antenna numbers into one baseline number
 suitable for use in UV data preambles."""
-    return _miriad_f.antbas (ant1, ant2)
+    return _miriad_f_coord.antbas (ant1, ant2)
 
 # Linetype constants. From subs/uvio.c
 
@@ -359,7 +359,7 @@ def polarizationIsInten (polnum):
     """Return True if the given polarization is intensity-type, e.g.,
     is I, XX, YY, RR, or LL."""
 
-    return _miriad_f.polspara (polnum)
+    return _miriad_f_coord.polspara (polnum)
 
 # And, merging them together: antpol and basepol handling.
 #
@@ -617,10 +617,21 @@ def fmtPBP32 (pbp32):
     return '%d%c-%d%c' % (m1, fPolNames[fp1], m2, fPolNames[fp2])
 
 
-def mir2pbp32 (handle, preamble):
-    fps = _polToFPol[handle.getPol () + 8]
-    m1, m2 = _miriad_f.basants (preamble[4], True)
+def aap2pbp32 (m1, m2, pol):
+    """\
+Create a PBP32 from antenna numbers and a FITS/MIRIAD polarization
+code.
+
+:arg int m1: the first antenna number; one-based
+:arg int m2: the second antenna number; also one-based
+:arg int pol: the FITS/MIRIAD polarization code
+:returns: the corresponding PBP32
+:raises: :exc:`ValueError` if *pol* is not a known polarization code,
+  or an antenna number is too large to be encoded
+"""
 
+    if pol < POL_YX or pol > POL_UU:
+        raise ValueError ('illegal polarization code %s' % pol)
     if m1 > 0x2000:
         raise ValueError ('cannot encode baseline %d-%d in PBP32: '
                           'm1 > 0x2000' % (m1, m2))
@@ -628,10 +639,16 @@ def mir2pbp32 (handle, preamble):
         raise ValueError ('cannot encode baseline %d-%d in PBP32: '
                           'm2 > 0x2000' % (m1, m2))
 
+    fps = _polToFPol[pol + 8]
     return ((m1 - 1) << 19) + ((fps & 0x70) << 12) + ((m2 - 1) << 3) \
         + (fps & 0x7)
 
 
+def mir2pbp32 (handle, preamble):
+    m1, m2 = _miriad_f_coord.basants (preamble[4], True)
+    return aap2pbp32 (m1, m2, handle.getPol ())
+
+
 def pbp32ToBP (pbp32):
     if pbp32 < 0 or pbp32 > 0xFFFFFFFF:
         raise ValueError ('illegal PBP32 %x' % pbp32)
@@ -713,7 +730,7 @@ Character   Result
 """
 
     calday = N.chararray (120)
-    _miriad_f.julday (jd, form, calday)
+    _miriad_f_coord.julday (jd, form, calday)
 
     for i in xrange (calday.size):
         if calday[i] == '':
@@ -731,7 +748,7 @@ def jdToPartial (jd):
     # do the same except maybe a bit better because I use jul2ut.
 
     from math import floor, pi
-    fullhrs = _miriad_f.jul2ut (jd) * 12 / pi
+    fullhrs = _miriad_f_coord.jul2ut (jd) * 12 / pi
 
     hr = int (floor (fullhrs))
     mn = int (floor (60 * (fullhrs - hr)))
@@ -755,7 +772,7 @@ See the documentation to Miriad function DAYJUL for a more detailed
 description of the parser behavior. The returned Julian date is of
 moderate accuracy only, e.g. good to a few seconds (I think?)."""
 
-    return _miriad_f.dayjul (calendar)
+    return _miriad_f_coord.dayjul (calendar)
 
 # Wrapper around NLLSQU, the non-linear least squares solver
 
@@ -854,7 +871,7 @@ with the following meanings:
 Implemented using the Miriad function NLLSQU.
 """
 
-    from _miriad_f import nllsqu
+    from mirtask._miriad_f_fit import nllsqu
     arr = lambda shape: N.zeros (shape, dtype=N.float32, order='F')
 
     # Verify arguments
@@ -953,7 +970,7 @@ linear equations simultaneously, where the i'th equation is::
   vals[i] = coeffs[0,i] * retval[0] + ... + coeffs[nunk-1,i] * retval[nunk-1]
 """
 
-    from _miriad_f import llsqu
+    from mirtask._miriad_f_fit import llsqu
 
     coeffs = N.asarray (coeffs, dtype=N.float32, order='F')
     if coeffs.ndim != 2:
@@ -1000,7 +1017,7 @@ described in the Explanatory Supplement to the Astronomical Almanac,
 1993, pp 105-106. Does not account for atmospheric refraction,
 nutation, aberration, or gravitational deflection.
 """
-    return _miriad_f.precess (jd1, ra1, dec1, jd2)
+    return _miriad_f_coord.precess (jd1, ra1, dec1, jd2)
 
 def equToHorizon (ra, dec, lst, lat):
     """Convert equatorial coordinates to horizon coordinates.
@@ -1012,7 +1029,7 @@ def equToHorizon (ra, dec, lst, lat):
 :rtype: (double, double)
 :returns: (az, el), both in radians
 """
-    return _miriad_f.azel (ra, dec, lst, lat)
+    return _miriad_f_coord.azel (ra, dec, lst, lat)
 
 
 def horizonToEqu (az, el, lst, lat):
@@ -1069,7 +1086,7 @@ expression ``index = (nsamp // width) * pixeloffset + nsamp //
 2``. Using the standard MIRIAD parameters, this is ``index = 341 *
 pixeloffset + 1023``.
 """
-    return _miriad_f.gcffun ('spheroidal', nsamp, width, alpha)
+    return _miriad_f_grid.gcffun ('spheroidal', nsamp, width, alpha)
 
 
 def sphCorrFunc (axislen, width, alpha):
@@ -1096,4 +1113,4 @@ In MIRIAD, *width* is always 6 and *alpha* is always 1.0. I don't know
 how *alpha* affects the spheroidal function used but it's probably not
 hard to look up.
 """
-    return _miriad_f.corrfun ('spheroidal', axislen, width, alpha)
+    return _miriad_f_grid.corrfun ('spheroidal', axislen, width, alpha)
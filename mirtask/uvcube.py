@@ -0,0 +1,320 @@
+'''mirtask.uvcube - gather UV data into dense time-baseline-pol-channel cubes'''
+
+# Copyright 2009-2012 Peter Williams
+#
+# This file is part of miriad-python.
+#
+# Miriad-python is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Miriad-python is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as N
+from mirtask import util
+
+__all__ = ['UVCube', 'build']
+
+
+def _goodFlags (flags, nread):
+    # Flags may come in any of the formats of mirtask.flagsBuffer.
+    if flags.dtype == N.uint8:
+        return N.unpackbits (flags)[:nread].astype (N.bool)
+    return flags[:nread] != 0
+
+
+class UVCube (object):
+    """:synopsis: UV data as a dense (time, baseline, pol, channel) array
+
+Instances are created by :func:`build`. The attributes are:
+
+=========== ============================================================
+Attribute   Meaning
+=========== ============================================================
+times       The distinct record timestamps, sorted (double, JD)
+baselines   The distinct MIRIAD-encoded baseline numbers, sorted (int)
+pols        The distinct MIRIAD polarization codes, sorted by absolute
+            value (int)
+pbp32       The PBP32 code of each baseline and polarization (uint32,
+            shape ``(nbl, npol)``); see :func:`mirtask.util.fmtPBP32`
+coords      The UV coordinates from the record preambles (double,
+            shape ``(ntime, nbl, ncoord)``); *ncoord* is 2 or 3
+            depending on whether the preambles included *w*
+present     Whether a record was seen for each time, baseline, and
+            polarization (bool, shape ``(ntime, nbl, npol)``)
+data        The visibilities, as a masked complex64 array of shape
+            ``(ntime, nbl, npol, nchan)``; entries are masked if they
+            were flagged or there was no record for them
+=========== ============================================================
+
+If the cube was built with the *memmap* option of :func:`build`, the
+storage of :attr:`data` is a pair of memory-mapped ``.npy`` files.
+"""
+
+    times = None
+    baselines = None
+    pols = None
+    pbp32 = None
+    coords = None
+    present = None
+    data = None
+
+    def __init__ (self, times, baselines, pols, nchan, ncoord, memmap=None):
+        self.times = times
+        self.baselines = baselines
+        self.pols = pols
+
+        nt, nb, np = times.size, baselines.size, pols.size
+        shape = (nt, nb, np, nchan)
+
+        self.pbp32 = N.empty ((nb, np), dtype=N.uint32)
+        for i, bl in enumerate (baselines):
+            m1, m2 = util.decodeBaseline (bl)
+            for j, pol in enumerate (pols):
+                self.pbp32[i,j] = util.aap2pbp32 (m1, m2, pol)
+
+        self.coords = N.zeros ((nt, nb, ncoord), dtype=N.double)
+        self.present = N.zeros ((nt, nb, np), dtype=N.bool)
+
+        if memmap is None:
+            data = N.zeros (shape, dtype=N.complex64)
+            mask = N.ones (shape, dtype=N.bool)
+        else:
+            from numpy.lib.format import open_memmap
+            data = open_memmap (memmap + '.data.npy', mode='w+',
+                                dtype=N.complex64, shape=shape)
+            mask = open_memmap (memmap + '.mask.npy', mode='w+',
+                                dtype=N.bool, shape=shape)
+            mask.fill (True)
+
+        self.data = N.ma.masked_array (data, mask, copy=False)
+
+
+    @property
+    def shape (self):
+        return self.data.shape
+
+
+    def _scatter (self, ti, bi, pi, coords, nreads, datas, goods):
+        # Vectorized assignment of a block of records, one fancy-index
+        # operation per distinct record length.
+        self.coords[ti,bi] = coords
+        self.present[ti,bi,pi] = True
+
+        data = self.data.data
+        mask = self.data.mask
+
+        for n in N.unique (nreads):
+            sel = N.nonzero (nreads == n)[0]
+            t, b, p = ti[sel], bi[sel], pi[sel]
+            data[t,b,p,:n] = N.vstack ([datas[i] for i in sel])
+            mask[t,b,p,:n] = ~N.vstack ([goods[i] for i in sel])
+
+
+    def write (self, outhnd):
+        """Write the cube out as UV data.
+
+:arg outhnd: the dataset to write to, opened for writing
+:type outhnd: :class:`mirtask.UVDataSet`
+:returns: *self*
+
+One record is written with :meth:`mirtask.UVDataSet.write` for every
+time, baseline, and polarization for which :attr:`present` is true,
+ordered by time, then baseline, then polarization, as MIRIAD expects.
+Every record has the full number of channels of the cube, with masked
+entries written as flagged. The preamble type of *outhnd* is set
+according to the shape of :attr:`coords`, and the "pol" and "npol"
+variables are written when they change. Other variables, such as
+those describing the spectral setup, must be written or copied to
+*outhnd* beforehand.
+"""
+        ncoord = self.coords.shape[-1]
+        if ncoord == 3:
+            outhnd.setPreambleType ('uvw', 'time', 'baseline')
+        else:
+            outhnd.setPreambleType ('uv', 'time', 'baseline')
+
+        preamble = N.empty (ncoord + 2, dtype=N.double)
+        flags = N.empty (self.data.shape[-1], dtype=N.bool)
+        data = self.data.data
+        mask = self.data.mask
+        lastpol = lastnpol = None
+
+        for ti, t in enumerate (self.times):
+            for bi, bl in enumerate (self.baselines):
+                have = self.present[ti,bi]
+                npol = int (have.sum ())
+                if npol == 0:
+                    continue
+
+                if npol != lastnpol:
+                    outhnd.writeVarInt ('npol', npol)
+                    lastnpol = npol
+
+                preamble[:ncoord] = self.coords[ti,bi]
+                preamble[ncoord] = t
+                preamble[ncoord+1] = bl
+
+                for pi in N.nonzero (have)[0]:
+                    pol = int (self.pols[pi])
+                    if pol != lastpol:
+                        outhnd.writeVarInt ('pol', pol)
+                        lastpol = pol
+
+                    N.logical_not (mask[ti,bi,pi], flags)
+                    outhnd.write (preamble, N.ascontiguousarray (data[ti,bi,pi]), flags)
+
+        return self
+
+
+class _Meta (object):
+    """Per-record metadata gathered while scanning a UV stream."""
+
+    def __init__ (self):
+        self.times = []
+        self.bls = []
+        self.pols = []
+        self.nreads = []
+        self.coords = []
+        self.ncoord = None
+
+    def add (self, inp, preamble, data):
+        ncoord = preamble.size - 2
+        if self.ncoord is None:
+            self.ncoord = ncoord
+        elif ncoord != self.ncoord:
+            raise ValueError ('preamble length changed from %d to %d'
+                              % (self.ncoord + 2, ncoord + 2))
+
+        self.times.append (preamble[ncoord])
+        self.bls.append (int (preamble[ncoord+1]))
+        self.pols.append (inp.getPol ())
+        self.nreads.append (data.size)
+        self.coords.append (preamble[:ncoord].copy ())
+
+    def finish (self, nchan, memmap, maxmem):
+        if self.ncoord is None:
+            raise ValueError ('no UV records to gather into a cube')
+
+        rtimes = N.asarray (self.times, dtype=N.double)
+        rbls = N.asarray (self.bls, dtype=N.int)
+        rpols = N.asarray (self.pols, dtype=N.int)
+        self.nreads = N.asarray (self.nreads, dtype=N.int)
+        self.coords = N.asarray (self.coords, dtype=N.double)
+
+        times = N.unique (rtimes)
+        bls = N.unique (rbls)
+        upols = N.unique (rpols)
+        self.ti = N.searchsorted (times, rtimes)
+        self.bi = N.searchsorted (bls, rbls)
+
+        # MIRIAD orders polarizations as XX, YY, XY, YX, and so on,
+        # which is by increasing absolute value of their codes.
+        order = N.argsort (N.abs (upols), kind='mergesort')
+        pols = upols[order]
+        self.pi = N.argsort (order)[N.searchsorted (upols, rpols)]
+
+        if nchan is None:
+            nchan = int (self.nreads.max ())
+        elif (self.nreads > nchan).any ():
+            raise ValueError ('records have up to %d channels but nchan is %d'
+                              % (self.nreads.max (), nchan))
+
+        nbytes = times.size * bls.size * pols.size * nchan * 9
+        if memmap is not None and maxmem is not None and nbytes <= maxmem:
+            memmap = None
+
+        return UVCube (times, bls, pols, nchan, self.ncoord, memmap)
+
+
+def build (gen, nchan=None, memmap=None, maxmem=None, blocksize=4096):
+    """Gather UV records into a dense cube.
+
+:arg gen: the source of UV data; see below
+:type gen: iterable of ``(handle, preamble, data, flags)``, as yielded
+  by :func:`mirtask.uvdat.read`, or a callable returning such an iterable
+:arg int nchan: the number of channels in the cube; defaults to the
+  largest number in any record
+:arg str memmap: if not :const:`None`, a path prefix; the cube data and
+  mask are stored in memory-mapped files named *memmap* ``.data.npy``
+  and *memmap* ``.mask.npy``, which can later be loaded with
+  :func:`numpy.load`
+:arg int maxmem: if *memmap* is given, only use memory-mapped files if
+  the cube would occupy more than this many bytes; default :const:`None`
+  means always use them
+:arg int blocksize: the number of records to scatter into the cube at
+  once
+:returns: a :class:`UVCube`
+:raises: :exc:`ValueError` if there are no records, the preamble
+  length changes, or an antenna number is too large for a PBP32 code
+
+The distinct times, baselines, and polarizations in the data are
+found, the cube is allocated once, and the records are scattered into
+it in blocks using vectorized index arrays. Records are identified by
+the exact values of their timestamps, so records from the same
+integration must have identical times, as is normal. If several
+records map to the same cube entry, the last one wins.
+
+If *gen* is an iterable, the data are necessarily buffered in memory
+before the cube is allocated, so peak memory use is about twice the
+size of the data. If *gen* is a callable, it is called twice to make
+two passes over the data, the first gathering only metadata, and
+memory use is bounded by the size of the cube plus one block of
+records. The latter is required for the *memmap* option to be useful
+for data larger than the available memory. For instance::
+
+  cube = uvcube.build (lambda: uvdat.setupAndRead (vis, 'x3', False),
+                       memmap='/big/disk/cube')
+"""
+    meta = _Meta ()
+
+    if not callable (gen):
+        datas, goods = [], []
+        for inp, preamble, data, flags in gen:
+            meta.add (inp, preamble, data)
+            datas.append (data.copy ())
+            goods.append (_goodFlags (flags, data.size))
+
+        cube = meta.finish (nchan, memmap, maxmem)
+
+        for start in xrange (0, len (datas), blocksize):
+            s = slice (start, start + blocksize)
+            cube._scatter (meta.ti[s], meta.bi[s], meta.pi[s], meta.coords[s],
+                           meta.nreads[s], datas[s], goods[s])
+        return cube
+
+    for inp, preamble, data, flags in gen ():
+        meta.add (inp, preamble, data)
+
+    cube = meta.finish (nchan, memmap, maxmem)
+    nrec = meta.nreads.size
+    datas, goods = [], []
+    start = 0
+
+    for inp, preamble, data, flags in gen ():
+        if start + len (datas) >= nrec:
+            raise ValueError ('UV data changed between passes')
+
+        datas.append (data.copy ())
+        goods.append (_goodFlags (flags, data.size))
+
+        if len (datas) == blocksize:
+            s = slice (start, start + blocksize)
+            cube._scatter (meta.ti[s], meta.bi[s], meta.pi[s], meta.coords[s],
+                           meta.nreads[s], datas, goods)
+            start += blocksize
+            datas, goods = [], []
+
+    if len (datas):
+        s = slice (start, start + len (datas))
+        cube._scatter (meta.ti[s], meta.bi[s], meta.pi[s], meta.coords[s],
+                       meta.nreads[s], datas, goods)
+
+    return cube
@@ -17,8 +17,10 @@
 # You should have received a copy of the GNU General Public License
 # along with miriad-python.  If not, see <http://www.gnu.org/licenses/>.
 
+import weakref
 import numpy as N
-from mirtask import _miriad_c, _miriad_f, MiriadError, UVDataSet
+from mirtask import _miriad_c, _miriad_f_uvdat, MiriadError, UVDataSet
+from mirtask import FLAGS_INT, convertFlags, _defaultFlagsLength
 from miriad import VisData, commasplice
 
 __all__ = []
@@ -43,6 +45,12 @@ except SyntaxError:
 # value has already been captured in the function definitions.
 default_maxchan = 16384
 
+# UVDAT keeps its state in Fortran common blocks and can only have one
+# dataset open at a time. We keep a weak reference to that dataset so
+# that reset() can close it if whoever was reading it went away
+# without doing so.
+_current = None
+
 class UVDatDataSet (UVDataSet):
     """:synopsis: a handle to a UV dataset being read with the UVDAT
     subsystem
@@ -55,11 +63,16 @@ UVDAT subsystem. It should transparently behave like a
 You should not construct a :class:`UVDatDataSet` yourself.
 """
     def __init__ (self, tno):
+        global _current
         self.tno = tno
         self._path = _getString ('name')
+        _current = weakref.ref (self)
 
     def _close (self):
-        _miriad_f.uvdatcls ()
+        global _current
+        _miriad_f_uvdat.uvdatcls ()
+        if _current is not None and _current () is self:
+            _current = None
 
     # Prohibit UVDataSet functions that affect our progress through the
     # stream, which would mess up the UVDAT routines.
@@ -73,14 +86,21 @@ You should not construct a :class:`UVDatDataSet` yourself.
     # Override UVDataSet functions that have uvdat-based implementations
 
     def rewind (self):
-        _miriad_f.uvdatrew ()
+        _miriad_f_uvdat.uvdatrew ()
 
     def lowlevelRead (self, preamble, data, flags, length=None):
         if length is None:
-            length = flags.size
+            length = _defaultFlagsLength (data, flags)
 
         self._checkOpen ()
-        return _miriad_f.uvdatrd (preamble, data, flags, length)
+
+        if flags.dtype == N.intc:
+            return _miriad_f_uvdat.uvdatrd (preamble, data, flags, length)
+
+        iflags = N.empty (length, dtype=N.intc)
+        nread = _miriad_f_uvdat.uvdatrd (preamble, data, iflags, length)
+        convertFlags (iflags, flags, nread)
+        return nread
 
     def getCurrentVisNum (self):
         return _getOneInt ('visno') - 1
@@ -100,10 +120,39 @@ You should not construct a :class:`UVDatDataSet` yourself.
         return _getOneInt ('npol')
 
     def getJyPerK (self):
-        return _miriad_f.uvdatgtr ('jyperk')
+        return _miriad_f_uvdat.uvdatgtr ('jyperk')
 
     def getVariance (self):
-        return _miriad_f.uvdatgtr ('variance')
+        return _miriad_f_uvdat.uvdatgtr ('variance')
+
+
+def reset ():
+    """Close any dataset left open by the UVDAT subsystem.
+
+:returns: :const:`True` if a dataset was closed
+
+A dataset opened by :func:`read` or :func:`inputSets` is normally
+closed when the generator is exhausted or garbage-collected, but if
+reading is abandoned the latter may not happen promptly, and UVDAT
+can't start reading anew until it does. This function closes such a
+dataset immediately. It is called when an in-process task run by
+:class:`mirexec.PyModTask` finishes. The UVDAT configuration itself is
+replaced the next time the subsystem is set up, with
+:meth:`mirtask.keys.KeySpec.process` or :func:`setupAndRead`.
+"""
+    global _current
+
+    if _current is None:
+        return False
+
+    ds = _current ()
+    _current = None
+
+    if ds is None or not ds.isOpen ():
+        return False
+
+    ds.close ()
+    return True
 
 
 def inputSets ():
@@ -167,7 +216,7 @@ enforce this condition, use :func:`inputSets`.
     #
     # Similar code is relevant in _uvdat_compat_*:inputSets.
 
-    status, tin = _miriad_f.uvdatopn ()
+    status, tin = _miriad_f_uvdat.uvdatopn ()
 
     if not status:
         raise RuntimeError ('No input datasets?!')
@@ -176,7 +225,7 @@ enforce this condition, use :func:`inputSets`.
     return UVDatDataSet (tin)
 
 
-def read (saveFlags=False, maxchan=default_maxchan):
+def read (saveFlags=False, maxchan=default_maxchan, flagtype=FLAGS_INT):
     """Read in data via the UVDAT subsystem.
 
 :arg saveFlags: whether to rewrite the flags of the dataset(s) as it/they are
@@ -184,6 +233,9 @@ def read (saveFlags=False, maxchan=default_maxchan):
 :type saveFlags: :class:`bool`
 :arg maxchan: the maximum number of spectral channels that can be read in at once
 :type maxchan: :class:`int`
+:arg flagtype: the format of the yielded flags arrays; see
+  :func:`mirtask.flagsBuffer`
+:type flagtype: :class:`str`
 :rtype: generator of ``(handle, preamble, data, flags)``
 :returns: generator yielding UV data records
 
@@ -197,13 +249,20 @@ preamble, data, flags)``, where *handle* is a :class:`UVDatDataSet`
 corresponding to the dataset being read, and *preamble*, *data*, and
 *flags* are the usual UV data arrays. For speed, the identities of the
 arrays do not change from iteration to iteration, but their contents do.
+
+By default *flags* is an int32 array with one element per channel. If
+*flagtype* is :const:`mirtask.FLAGS_BOOL` it is a bool array, and if
+it is :const:`mirtask.FLAGS_PACKED` it is a uint8 array with one bit
+per channel, which is much more compact if many records are being
+accumulated. If *saveFlags* is true, modifications to *flags* are
+written back in any of these formats.
 """
-    return _read_gen (saveFlags, UVDatDataSet, maxchan)
+    return _read_gen (saveFlags, UVDatDataSet, maxchan, flagtype)
 
 
 def setupAndRead (toread, uvdOptions, saveFlags, nopass=False, nocal=False,
                   nopol=False, select=None, line=None, stokes=None, ref=None,
-                  maxchan=default_maxchan):
+                  maxchan=default_maxchan, flagtype=FLAGS_INT):
     """Set up the UVDAT subsystem manually and read in the data.
 
 :arg toread: the name(s) of the dataset or datasets to read
@@ -229,6 +288,8 @@ def setupAndRead (toread, uvdOptions, saveFlags, nopass=False, nocal=False,
 :type ref: :class:`str` or :const:`None`
 :arg maxchan: the maximum number of spectral channels that can be read in at once
 :type maxchan: :class:`int`
+:arg flagtype: the format of the yielded flags arrays; see :func:`read`
+:type flagtype: :class:`str`
 :rtype: generator of ``(handle, preamble, data, flags)``
 :returns: generator yielding UV data records
 
@@ -292,20 +353,20 @@ Character       Feature behavior
 
     from keys import KeySpec
     KeySpec ().uvdat (flags).process (args)
-    return _read_gen (saveFlags, UVDatDataSet, maxchan)
+    return _read_gen (saveFlags, UVDatDataSet, maxchan, flagtype)
 
 
 # Variable probes
 
 def _getOneInt (kw):
     a = N.zeros (1, dtype=N.int32)
-    _miriad_f.uvdatgti (kw, a)
+    _miriad_f_uvdat.uvdatgti (kw, a)
     return a[0]
 
 
 def _getString (kw):
     buf = N.chararray (120)
-    _miriad_f.uvdatgta (kw, buf)
+    _miriad_f_uvdat.uvdatgta (kw, buf)
 
     # Better way?
     for i in xrange (buf.size):
@@ -327,7 +388,7 @@ returned by getNPol (). Zeros indicate an error. Polarization values are as in F
 and are defined in mirtask.util.POL\_??. """
 
     a = N.zeros (getNPol (), dtype=N.int32)
-    _miriad_f.uvdatgti ('pols', a)
+    _miriad_f_uvdat.uvdatgti ('pols', a)
     return a
 
 def getPol ():
@@ -359,11 +420,11 @@ be merged.
 
 def getVariance ():
     """Return the variance of the current visibility."""
-    return _miriad_f.uvdatgtr ('variance')
+    return _miriad_f_uvdat.uvdatgtr ('variance')
 
 def getJyPerK ():
     """Return the Jansky-per-Kelvin value of the current visibility."""
-    return _miriad_f.uvdatgtr ('jyperk')
+    return _miriad_f_uvdat.uvdatgtr ('jyperk')
 
 
 def getCurrentName ():